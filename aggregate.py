@@ -0,0 +1,206 @@
+"""Vectorized tallies of survey responses"""
+
+import calendar
+import logging
+import time
+
+import numpy
+
+logger = logging.getLogger('surveymonkey.aggregate')
+
+class ResponseTable:
+    """Integer-coded answers for a single survey, suitable for counting.
+
+    Every answer to an answerable question is stored as one entry of
+    (respondent, question, row, col) codes, where:
+    - question is the position of the question in the survey,
+    - row is the position of the answer_id in question.answers, not
+      counting 'col' answers (so choices, matrix rows, and open_ended
+      subquestions), or -1 for free text answers,
+    - col is the position of the answer_id among the 'col' answers of
+      a matrix question, or -1.
+
+    Responses can be added incrementally; re-adding a respondent
+    replaces their previous answers.  All counts are numpy arrays
+    aligned with row_answers() and col_answers() for the question.
+    """
+    _initial_capacity = 1024
+
+    def __init__(self, details, responses=(), respondent_list=None):
+        self.details = details
+        self._questions = []
+        self._q_num = {}
+        self._row_code = []
+        self._col_code = []
+        for page in details.pages:
+            for question in page:
+                self._q_num[question.question_id] = len(self._questions)
+                self._questions.append(question)
+                rows = [a for a in question.answers if a.type != 'col']
+                cols = [a for a in question.answers if a.type == 'col']
+                self._row_code.append(
+                    {a.answer_id: n for n, a in enumerate(rows)})
+                self._col_code.append(
+                    {a.answer_id: n for n, a in enumerate(cols)})
+        # Entries
+        self._n = 0
+        self._resp = numpy.empty(self._initial_capacity, numpy.int32)
+        self._q = numpy.empty(self._initial_capacity, numpy.int32)
+        self._row = numpy.empty(self._initial_capacity, numpy.int32)
+        self._col = numpy.empty(self._initial_capacity, numpy.int32)
+        # Respondent slots.  Replacing a respondent gives them a new
+        # slot and marks the old one dead, so nothing is rewritten.
+        self._n_slots = 0
+        self._slot_for = {}
+        self._live = numpy.zeros(self._initial_capacity, bool)
+        self._timestamp = numpy.empty(self._initial_capacity, numpy.int64)
+        if len(responses):
+            self.add(responses, respondent_list)
+
+    def __len__(self):
+        return len(self._slot_for)
+
+    @staticmethod
+    def _grow(arr, needed):
+        if needed <= len(arr):
+            return arr
+        new = numpy.empty(max(needed, len(arr) * 2), arr.dtype)
+        new[:len(arr)] = arr
+        if arr.dtype == bool:
+            new[len(arr):] = False
+        return new
+
+    @staticmethod
+    def _epoch(datestring):
+        return calendar.timegm(time.strptime(datestring,
+                                             '%Y-%m-%d %H:%M:%S'))
+
+    def _question_num(self, question):
+        return self._q_num[getattr(question, 'question_id', question)]
+
+    def row_answers(self, question):
+        """Return the SurveyAnswers that row codes refer to"""
+        q = self._questions[self._question_num(question)]
+        return [a for a in q.answers if a.type != 'col']
+
+    def col_answers(self, question):
+        """Return the SurveyAnswers that col codes refer to"""
+        q = self._questions[self._question_num(question)]
+        return [a for a in q.answers if a.type == 'col']
+
+    def add(self, responses, respondent_list=None):
+        """Add (or replace) SurveyResponses.
+
+        If respondent_list (a RespondentList) is given, the
+        date_modified of each respondent is recorded for trend().
+        """
+        resp, qs, rows, cols = [], [], [], []
+        slot = self._n_slots
+        self._live = self._grow(self._live, slot + len(responses))
+        self._timestamp = self._grow(self._timestamp, slot + len(responses))
+        by_id = {}
+        if respondent_list is not None:
+            by_id = {r.respondent_id: r for r in respondent_list}
+        for response in responses:
+            old = self._slot_for.get(response.respondent_id, None)
+            if old is not None:
+                self._live[old] = False
+            self._slot_for[response.respondent_id] = slot
+            self._live[slot] = True
+            self._timestamp[slot] = -1
+            r_info = by_id.get(response.respondent_id, None)
+            if r_info is not None and \
+                    'date_modified' in r_info.as_dict():
+                self._timestamp[slot] = self._epoch(r_info.date_modified)
+            for q_response in response.questions:
+                q_num = self._q_num.get(q_response.question_id, None)
+                if q_num is None:
+                    continue
+                row_code = self._row_code[q_num]
+                col_code = self._col_code[q_num]
+                for ans in q_response.answers:
+                    resp.append(slot)
+                    qs.append(q_num)
+                    rows.append(row_code.get(ans.row, -1))
+                    cols.append(col_code.get(getattr(ans, 'col', None), -1))
+            slot += 1
+        self._n_slots = slot
+        start, end = self._n, self._n + len(resp)
+        self._resp = self._grow(self._resp, end)
+        self._q = self._grow(self._q, end)
+        self._row = self._grow(self._row, end)
+        self._col = self._grow(self._col, end)
+        self._resp[start:end] = resp
+        self._q[start:end] = qs
+        self._row[start:end] = rows
+        self._col[start:end] = cols
+        self._n = end
+
+    def _entries(self, question):
+        """Return (slots, rows, cols) of live entries for a question"""
+        n = self._n
+        mask = ((self._q[:n] == self._question_num(question)) &
+                self._live[self._resp[:n]])
+        return self._resp[:n][mask], self._row[:n][mask], self._col[:n][mask]
+
+    def counts(self, question):
+        """Return the number of times each row answer was chosen"""
+        _, rows, _ = self._entries(question)
+        return numpy.bincount(rows[rows >= 0],
+                              minlength=len(self.row_answers(question)))
+
+    def respondent_count(self, question):
+        """Return the number of respondents who answered a question"""
+        slots, _, _ = self._entries(question)
+        return len(numpy.unique(slots))
+
+    def crosstab(self, question, other=None):
+        """Return a 2-D array of counts.
+
+        With one (matrix) question, the array is rows x columns of
+        that question.  With two questions, it is the number of
+        respondents choosing each row of the first and each row of
+        the second.
+        """
+        if other is None:
+            _, rows, cols = self._entries(question)
+            n_rows = len(self.row_answers(question))
+            n_cols = len(self.col_answers(question))
+            ok = (rows >= 0) & (cols >= 0)
+            flat = numpy.bincount(rows[ok] * n_cols + cols[ok],
+                                  minlength=n_rows * n_cols)
+            return flat.reshape(n_rows, n_cols)
+        a = self._onehot(question)
+        b = self._onehot(other)
+        return numpy.dot(a.T, b)
+
+    def _onehot(self, question):
+        slots, rows, _ = self._entries(question)
+        rv = numpy.zeros((self._n_slots, len(self.row_answers(question))),
+                         numpy.int64)
+        ok = rows >= 0
+        rv[slots[ok], rows[ok]] = 1
+        return rv
+
+    def trend(self, question, bucket=86400):
+        """Return (bucket_starts, counts) for a question over time.
+
+        bucket is the bucket width in seconds, by date_modified.
+        bucket_starts is an array of UTC epoch seconds, and counts
+        is a 2-D array of buckets x row answers.  Respondents added
+        without a date are ignored.
+        """
+        slots, rows, _ = self._entries(question)
+        stamps = self._timestamp[slots]
+        ok = (rows >= 0) & (stamps >= 0)
+        n_rows = len(self.row_answers(question))
+        if not ok.any():
+            return (numpy.empty(0, numpy.int64),
+                    numpy.zeros((0, n_rows), numpy.int64))
+        buckets = stamps[ok] // bucket
+        first = buckets.min()
+        n_buckets = int(buckets.max() - first) + 1
+        flat = numpy.bincount((buckets - first) * n_rows + rows[ok],
+                              minlength=n_buckets * n_rows)
+        starts = (numpy.arange(n_buckets, dtype=numpy.int64) + first) * bucket
+        return starts, flat.reshape(n_buckets, n_rows)
@@ -0,0 +1,209 @@
+"""Precomputed dashboard rows and PDFs
+
+poll.py knows which respondents changed since it last ran, so after
+each poll it regenerates the dashboard rows and PDFs for just those
+respondents, and monkey.py and pdf.py serve them as static files
+instead of asking SurveyMonkey.  The layout of the directory is:
+
+  <survey_id>/respondents.json        every respondent seen, and the
+                                      date they are complete since
+  <survey_id>/rows/<respondent_id>.html
+  <survey_id>/pdf/<respondent_id>.pdf
+
+Every file is written to a temporary file and renamed into place, so
+readers never see a partial file.  Survey and respondent IDs often
+come from query strings, so anything but a SurveyMonkey ID (digits) is
+a cache miss rather than part of a path.
+"""
+
+import cgi
+import contextlib
+import json
+import logging
+import os
+import re
+import urllib
+
+import surveymonkey
+import techdiagnostic
+
+logger = logging.getLogger('surveymonkey.artifacts')
+
+# The questions shown in the dashboard
+QUESTIONS = ['Name:', 'MIT email address:']
+
+_id_re = re.compile(r'[0-9]+\Z')
+
+def valid_id(s):
+    """Is s a SurveyMonkey survey or respondent ID?"""
+    return isinstance(s, basestring) and _id_re.match(s) is not None
+
+def render_row(survey_id, questions, response, r_info, local_date):
+    """Return the dashboard table row for a SurveyResponse.  questions
+    are the SurveyQuestions for QUESTIONS."""
+    cells = []
+    for q in questions:
+        answer = response.get_response_for_question(q)
+        cells.append("<td>{0}</td>".format(answer.answer[0] if answer
+                                           else '<n/a>'))
+    urldata = urllib.urlencode({'survey_id': survey_id,
+                                'respondent_id': response.respondent_id,
+                                'date': local_date,
+                                'status': r_info.status})
+    return """<tr>
+{0}
+<td>{1}</td><td>{2}</td>
+<td><a href="{3}" target="_blank">Go</a></td></tr>""".format(
+        "\n".join(cells), local_date, r_info.status,
+        cgi.escape("pdf.py?{0}".format(urldata), True))
+
+class ArtifactCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self._respondents = {}
+
+    def _path(self, survey_id, *parts):
+        if not valid_id(survey_id):
+            raise ValueError("Invalid survey_id {0!r}".format(survey_id))
+        return os.path.join(self.directory, survey_id, *parts)
+
+    @contextlib.contextmanager
+    def _atomic(self, filename):
+        """Open a temporary file, and rename it to filename on success"""
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                yield f
+            os.rename(tmp, filename)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def respondents(self, survey_id):
+        """Return the respondents.json data for a survey, or None.
+        It is a dict with 'since' (a UTC date) and 'respondents', a dict
+        of respondent_id to date_start, date_modified, local_date,
+        status, name and email."""
+        if not valid_id(survey_id):
+            return None
+        if survey_id not in self._respondents:
+            try:
+                with open(self._path(survey_id, 'respondents.json')) as f:
+                    self._respondents[survey_id] = json.loads(f.read())
+            except IOError:
+                return None
+        return self._respondents[survey_id]
+
+    def respondent_list(self, survey_id, start_date):
+        """Return RespondentInfos for respondents who started on or after
+        start_date (a UTC date), or None unless every such respondent
+        is cached."""
+        data = self.respondents(survey_id)
+        if data is None or data['since'] > start_date:
+            return None
+        return [surveymonkey.RespondentInfo(
+                {'respondent_id': k, 'date_modified': v['date_modified'],
+                 'status': v['status']})
+                for k, v in data['respondents'].iteritems()
+                if v['date_start'] >= start_date]
+
+    def _current(self, survey_id, respondent_id, key, value):
+        data = self.respondents(survey_id)
+        if data is None:
+            return None
+        info = data['respondents'].get(respondent_id, None)
+        if info is None or info[key] != value:
+            return None
+        return info
+
+    def rows(self, survey_id, respondents):
+        """Return a dict of respondent_id to cached dashboard row, for
+        those RespondentInfos whose row is up to date"""
+        rv = {}
+        for r in respondents:
+            if not valid_id(r.respondent_id) or \
+                    self._current(survey_id, r.respondent_id,
+                                  'date_modified', r.date_modified) is None:
+                continue
+            try:
+                with open(self._path(survey_id, 'rows',
+                                     r.respondent_id + '.html')) as f:
+                    rv[r.respondent_id] = f.read()
+            except IOError:
+                pass
+        return rv
+
+    def pdf(self, survey_id, respondent_id, local_date):
+        """Return (filename, info) for the cached PDF of a respondent
+        last modified at local_date, or None"""
+        if not (valid_id(survey_id) and valid_id(respondent_id)):
+            return None
+        info = self._current(survey_id, respondent_id, 'local_date',
+                             local_date)
+        filename = self._path(survey_id, 'pdf', respondent_id + '.pdf')
+        if info is None or not os.path.exists(filename):
+            return None
+        return (filename, info)
+
+    def update(self, details, responses, respondent_list, since):
+        """Regenerate the rows and PDFs for responses, which are every
+        response modified since since (a UTC date).  respondent_list
+        must have date_start, date_modified and status."""
+        survey_id = details.survey_id
+        data = self.respondents(survey_id)
+        if data is None:
+            data = {'since': since, 'respondents': {}}
+        by_id = {r.respondent_id: r for r in respondent_list}
+        questions = details.get_questions_by_heading(*QUESTIONS)
+        local_dates = surveymonkey.DateTime.convert_many(
+            [by_id[r.respondent_id].date_modified for r in responses],
+            txt=True)
+        for response, local_date in zip(responses, local_dates):
+            if not valid_id(response.respondent_id):
+                raise ValueError("Invalid respondent_id {0!r}".format(
+                        response.respondent_id))
+            r_info = by_id[response.respondent_id]
+            with self._atomic(self._path(survey_id, 'rows',
+                                         response.respondent_id +
+                                         '.html')) as f:
+                f.write(render_row(survey_id, questions, response, r_info,
+                                   local_date))
+            (name, email, header_lines) = techdiagnostic.respondent_header(
+                details, response, r_info.status, local_date)
+            with self._atomic(self._path(survey_id, 'pdf',
+                                         response.respondent_id +
+                                         '.pdf')) as f:
+                pdf = techdiagnostic.PDF(f)
+                pdf.header_lines = header_lines
+                pdf.title = 'Technical Diagnostic for {0} ({1})'.format(
+                    name, email)
+                pdf.add_survey_response(details, response)
+                pdf.save()
+            data['respondents'][response.respondent_id] = {
+                'date_start': r_info.date_start,
+                'date_modified': r_info.date_modified,
+                'local_date': local_date,
+                'status': r_info.status,
+                'name': name,
+                'email': email}
+        # Written last, so rows and PDFs are only used once complete
+        with self._atomic(self._path(survey_id, 'respondents.json')) as f:
+            f.write(json.dumps(data))
+        self._respondents[survey_id] = data
+        logger.debug("Regenerated %d artifacts for %s", len(responses),
+                     survey_id)
+
+    def invalidate(self, survey_id):
+        """Forget the respondents of a survey, e.g. after a failed
+        update, so they are fetched from SurveyMonkey until the next
+        update."""
+        if not valid_id(survey_id):
+            return
+        self._respondents.pop(survey_id, None)
+        try:
+            os.unlink(self._path(survey_id, 'respondents.json'))
+        except OSError:
+            pass
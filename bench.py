@@ -0,0 +1,212 @@
+#!/usr/bin/python
+#
+# Micro-benchmarks for the surveymonkey modules.  Not installed.
+
+import cPickle
+import gc
+import json
+import optparse
+import random
+import StringIO
+import sys
+import time
+
+import surveymonkey
+
+def fake_survey_data(n_pages=5, n_questions=8):
+    """Return (survey details dict, function(n) -> response dict) for a
+    made-up survey with a mix of question types, as they would be
+    decoded from the API's JSON"""
+    rnd = random.Random(0)
+    pages = [{'heading': 'Basic Information', 'questions': [
+                {'question_id': 'name', 'heading': 'Name:', 'position': 1,
+                 'type': {'family': 'open_ended', 'subtype': 'single'},
+                 'answers': []},
+                {'question_id': 'email', 'heading': 'MIT email address:',
+                 'position': 2,
+                 'type': {'family': 'open_ended', 'subtype': 'single'},
+                 'answers': []}]}]
+    kinds = [('single_choice', 'vertical'), ('multiple_choice', 'vertical'),
+             ('matrix', 'rating'), ('open_ended', 'essay'),
+             ('open_ended', 'multi')]
+    for p in xrange(n_pages):
+        questions = []
+        for q in xrange(n_questions):
+            family, subtype = kinds[(p + q) % len(kinds)]
+            q_id = 'q{0}_{1}'.format(p, q)
+            answers = [{'answer_id': '{0}_a{1}'.format(q_id, a),
+                        'position': a, 'type': 'row', 'visible': True,
+                        'text': 'Choice number {0}'.format(a)}
+                       for a in xrange(4)]
+            if family == 'matrix':
+                answers += [{'answer_id': '{0}_c{1}'.format(q_id, c),
+                             'position': c, 'type': 'col', 'visible': True,
+                             'text': 'Column {0}'.format(c)}
+                            for c in xrange(3)]
+            elif family == 'open_ended' and subtype == 'essay':
+                answers = []
+            questions.append({'question_id': q_id, 'position': q + 1,
+                              'heading': 'Question {0} on page {1}, with '
+                              'a reasonably long heading?'.format(q, p),
+                              'type': {'family': family, 'subtype': subtype},
+                              'answers': answers})
+        pages.append({'heading': 'Section {0}'.format(p),
+                      'questions': questions})
+    details = {'survey_id': '1', 'title': {'text': 'Fake survey'},
+               'pages': pages}
+
+    def make_response(n):
+        questions = []
+        for page in pages:
+            for q in page['questions']:
+                rows = [a['answer_id'] for a in q['answers']
+                        if a['type'] == 'row']
+                cols = [a['answer_id'] for a in q['answers']
+                        if a['type'] == 'col']
+                family = q['type']['family']
+                if family == 'open_ended' and len(rows) == 0:
+                    answers = [{'row': '0', 'text': ' '.join(
+                                    rnd.choice(['lorem', 'ipsum', 'dolor',
+                                                'kerberos', 'athena'])
+                                    for _ in xrange(60))}]
+                elif family == 'open_ended':
+                    answers = [{'row': r, 'text': 'Answer to ' + r}
+                               for r in rows]
+                elif family == 'matrix':
+                    answers = [{'row': r, 'col': rnd.choice(cols)}
+                               for r in rows]
+                else:
+                    answers = [{'row': rnd.choice(rows)}]
+                if q['question_id'] == 'name':
+                    answers = [{'row': '0', 'text': 'Person {0}'.format(n)}]
+                elif q['question_id'] == 'email':
+                    answers = [{'row': '0',
+                                'text': 'person{0}@mit.edu'.format(n)}]
+                questions.append({'question_id': q['question_id'],
+                                  'answers': answers})
+        return {'respondent_id': str(n), 'questions': questions}
+    return details, make_response
+
+def fake_survey(n_pages=5, n_questions=8):
+    """Return (SurveyDetails, function(n) -> SurveyResponse) for a
+    made-up survey with a mix of question types"""
+    (details, make_data) = fake_survey_data(n_pages, n_questions)
+
+    def decode(data):
+        return json.loads(json.dumps(data), object_hook=surveymonkey.Struct)
+
+    def make_response(n):
+        return surveymonkey.SurveyResponse(decode(make_data(n)))
+    return surveymonkey.SurveyDetails(decode(details)), make_response
+
+def timed(func, *args, **kwargs):
+    """Return (seconds, result) of the fastest of 3 calls to func, with
+    the garbage collector disabled so that collections triggered by
+    earlier allocations aren't charged to func"""
+    best = None
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in xrange(3):
+            start = time.time()
+            result = func(*args, **kwargs)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if enabled:
+            gc.enable()
+    return best, result
+
+def bench_datetime(n):
+    """DateTime per-object to_local() vs convert_many()"""
+    rnd = random.Random(0)
+    now = int(time.time())
+    datestrings = [surveymonkey.DateTime.from_epoch(
+            rnd.randint(now - 5 * 365 * 86400, now)) for _ in xrange(n)]
+    (t_each, each) = timed(lambda: [surveymonkey.DateTime(d).to_local(True)
+                                    for d in datestrings])
+    (t_many, many) = timed(surveymonkey.DateTime.convert_many,
+                           datestrings, txt=True)
+    assert each == many, "Results differ"
+    return [('per-object', t_each), ('convert_many', t_many)]
+
+def bench_pdf(n):
+    """techdiagnostic.PDF render time, fresh vs shared PDFTemplate"""
+    import techdiagnostic
+    details, make_response = fake_survey()
+    responses = [make_response(i) for i in xrange(n)]
+
+    def render(template_for):
+        for response in responses:
+            pdf = techdiagnostic.PDF(StringIO.StringIO(), template_for())
+            pdf.header_lines = ['Person', 'person@mit.edu', 'completed']
+            pdf.add_survey_response(details, response)
+            pdf.save()
+    (t_fresh, _) = timed(render, techdiagnostic.PDFTemplate)
+    (t_shared, _) = timed(render, techdiagnostic.PDFTemplate.default)
+    return [('fresh template', t_fresh), ('shared template', t_shared)]
+
+def bench_parse(n):
+    """Parsing responses per question vs SurveyResponse.parse_all()"""
+    details, make_response = fake_survey()
+    responses = [make_response(i) for i in xrange(n)]
+    (t_each, each) = timed(lambda: [[[r.get_response_for_question(q)
+                                      for q in page]
+                                     for page in details.pages]
+                                    for r in responses])
+    (t_all, parsed) = timed(lambda: [pages for _, pages in
+                                     surveymonkey.SurveyResponse.parse_batch(
+                details, responses)])
+    assert [[[p.answer for p in page] for page in r] for r in each] == \
+        [[[p.answer for p in page] for page in r] for r in parsed], \
+        "Results differ"
+    return [('per question', t_each), ('parse_all', t_all)]
+
+def bench_serialize(n):
+    """Loading SurveyDetails and responses: pickle vs from_json()"""
+    details, make_response = fake_survey()
+    responses = [make_response(i) for i in xrange(n)]
+    pickled = cPickle.dumps((details, responses), cPickle.HIGHEST_PROTOCOL)
+    dumped = (surveymonkey.to_json(details), surveymonkey.to_json(responses))
+
+    def from_json():
+        loaded = surveymonkey.from_json(dumped[0])
+        return (loaded, surveymonkey.from_json(dumped[1],
+                                               symbols=loaded._symbols))
+    (t_pickle, _) = timed(cPickle.loads, pickled)
+    (t_json, (loaded, loaded_responses)) = timed(from_json)
+    assert [[p.answer for page in r for p in page] for response, r in
+            surveymonkey.SurveyResponse.parse_batch(details, responses)] == \
+        [[p.answer for page in r for p in page] for response, r in
+         surveymonkey.SurveyResponse.parse_batch(loaded, loaded_responses)], \
+        "Results differ"
+    return [('pickle', t_pickle, '{0} bytes'.format(len(pickled))),
+            ('from_json', t_json,
+             '{0} bytes'.format(sum(len(d) for d in dumped)))]
+
+# name: (function, default problem size)
+BENCHMARKS = {'datetime': (bench_datetime, 100000),
+              'parse': (bench_parse, 2000),
+              'pdf': (bench_pdf, 50),
+              'serialize': (bench_serialize, 2000)}
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(
+        usage="%prog [options] [benchmark ...]",
+        description="Benchmarks: " + ', '.join(sorted(BENCHMARKS)))
+    parser.add_option('-n', dest='n', type='int',
+                      help='problem size (default depends on benchmark)')
+    (options, args) = parser.parse_args()
+    for name in args or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark '{0}'".format(name))
+        (func, n) = BENCHMARKS[name]
+        n = options.n or n
+        print "{0} (n={1}): {2}".format(name, n, func.__doc__)
+        # Results are (label, seconds) or (label, seconds, note)
+        for result in func(n):
+            print "  {0:<20} {1:8.3f}s {2:10.2f}us/item {3}".format(
+                result[0], result[1], result[1] * 1e6 / n,
+                ' '.join(result[2:])).rstrip()
+    sys.exit(0)
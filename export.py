@@ -0,0 +1,200 @@
+#!/usr/bin/python
+#
+# Export all responses to a survey as CSV or JSON lines
+
+import csv
+import json
+import logging
+import optparse
+import os
+import sys
+
+sys.path.append('/mit/helpdesk/web_scripts/surveymonkey/lib')
+import surveymonkey
+
+logger = logging.getLogger('export')
+
+# The largest number of respondents SurveyMonkey will return
+# responses for in one call
+CHUNK_SIZE = 100
+
+class Column:
+    """A column of the export: one answerable question, or one
+    subquestion (or matrix row) of a question."""
+    def __init__(self, question, page_num, answer=None):
+        self.question = question
+        self.answer = answer
+        self.name = u'Q{0}.{1} {2}'.format(page_num, question.position,
+                                          question.heading.strip())
+        if answer is not None:
+            self.name += u' [{0}]'.format(answer.text.strip())
+
+    def value(self, parsed):
+        """Given the ParsedQuestionResponse for the question, return
+        the text of this column, or None."""
+        if not parsed:
+            return None
+        if self.answer is not None:
+            values = [a[1] for a in parsed.answer
+                      if a[0] == self.answer.text and a[1] is not None]
+        else:
+            values = [u'{0}: {1}'.format(*a) if isinstance(a, tuple) else a
+                      for a in parsed.answer]
+        return u'; '.join(values) if len(values) else None
+
+def columns_for(details):
+    """Return the list of Columns for a SurveyDetails"""
+    rv = []
+    for page_num, page in enumerate(details.pages, start=1):
+        for question in page:
+            if question.type in ('open_ended/multi', 'open_ended/numerical'):
+                rv += [Column(question, page_num, a) for a in
+                       sorted(question.answers, key=lambda x: x.position)]
+            elif question.type.family == 'matrix':
+                rv += [Column(question, page_num, a) for a in
+                       question.answers if a.type == 'row']
+            else:
+                rv.append(Column(question, page_num))
+    return rv
+
+class CSVWriter:
+    def __init__(self, f, columns, header=True):
+        self._writer = csv.writer(f)
+        if header:
+            self._writer.writerow(
+                ['respondent_id', 'date_modified', 'status'] +
+                [c.name.encode('utf-8') for c in columns])
+
+    def write(self, row):
+        self._writer.writerow([(v or u'').encode('utf-8') for v in row])
+
+class JSONLinesWriter:
+    def __init__(self, f, columns, header=True):
+        self._f = f
+        self._keys = ['respondent_id', 'date_modified', 'status'] + \
+            [c.name for c in columns]
+
+    def write(self, row):
+        self._f.write(json.dumps(dict(zip(self._keys, row))) + '\n')
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLinesWriter}
+
+class ExportState:
+    """The last date_modified exported, and the respondents exported
+    at exactly that time, so a resumed export skips them."""
+    def __init__(self, filename):
+        self._filename = filename
+        self.last_date = None
+        self.last_ids = []
+        if filename is not None and os.path.exists(filename):
+            with open(filename, 'r') as f:
+                self.__dict__.update(json.loads(f.read()))
+
+    def update(self, respondents):
+        for r in respondents:
+            if r.date_modified != self.last_date:
+                self.last_date = r.date_modified
+                self.last_ids = []
+            self.last_ids.append(r.respondent_id)
+
+    def save(self):
+        if self._filename is None:
+            return
+        tmp = self._filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'last_date': self.last_date,
+                                'last_ids': self.last_ids}))
+        os.rename(tmp, self._filename)
+
+def export(monkey, survey_id, writer_class, out, state, **kwargs):
+    """Write every response modified since the state's last date.
+
+    Responses are fetched, parsed and written chunk_size respondents
+    at a time, oldest first, and the state is saved after each chunk.
+    Pass header=False to omit the CSV header (e.g. when appending).
+    Returns the number of responses written.
+    """
+    chunk_size = kwargs.get('chunk_size', CHUNK_SIZE)
+    details = monkey.get_survey_details(survey_id)
+    columns = columns_for(details)
+    respondents = monkey.get_survey_respondents(
+        survey_id,
+        fields=['date_modified', 'status'],
+        start_modified_date=state.last_date or details.date_created,
+        partitions=kwargs.get('partitions', 4))
+    skip = set(state.last_ids)
+    todo = sorted([r for r in respondents if r.respondent_id not in skip],
+                  key=lambda r: r.date_modified)
+    logger.debug("%d respondents to export", len(todo))
+    writer = writer_class(out, columns, kwargs.get('header', True))
+    for start in xrange(0, len(todo), chunk_size):
+        chunk = todo[start:start + chunk_size]
+        by_id = {r.respondent_id: r for r in chunk}
+        responses = monkey.get_survey_responses(survey_id, *chunk)
+        for response, pages in surveymonkey.SurveyResponse.parse_batch(
+            details, responses):
+            r_info = by_id[response.respondent_id]
+            parsed = {p.question_id: p for page in pages for p in page}
+            writer.write([response.respondent_id, r_info.date_modified,
+                          r_info.status] +
+                         [c.value(parsed[c.question.question_id])
+                          for c in columns])
+        out.flush()
+        state.update(chunk)
+        state.save()
+    return len(todo)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] [survey title]")
+    parser.add_option('-s', '--survey-id', dest='survey_id',
+                       help='export this survey_id instead of by title')
+    parser.add_option('-f', '--format', dest='format', default='csv',
+                       choices=sorted(WRITERS.keys()),
+                       help='csv or jsonl (default: %default)')
+    parser.add_option('-o', '--output', dest='output',
+                       help='write to this file (default: stdout)')
+    parser.add_option('-r', '--resume', dest='state_file',
+                       help='record progress in this file, and resume '
+                       'from the last exported date_modified')
+    parser.add_option('--since', dest='since',
+                       help='export responses modified since this UTC date '
+                       '(YYYY-MM-DD HH:MM:SS)')
+    parser.add_option('-v', '--verbose', dest='verbose', action='store_true')
+    (options, args) = parser.parse_args()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.DEBUG if options.verbose else logging.WARNING)
+    config = surveymonkey.Config.load()
+    monkey = surveymonkey.SurveyMonkey.from_config(config, caller='export',
+                                                   priority='low')
+    state = ExportState(options.state_file)
+    if options.since is not None:
+        state.last_date = options.since
+        state.last_ids = []
+    try:
+        survey_id = options.survey_id
+        if survey_id is None:
+            title = ' '.join(args) or config.poll.survey_title
+            surveys = monkey.get_survey_list(title=title)
+            if len(surveys) != 1:
+                parser.error("Found {0} surveys for title '{1}'".format(
+                        len(surveys), title))
+            survey_id = surveys[0].survey_id
+        out = sys.stdout
+        header = True
+        if options.output is not None:
+            # Append when resuming, so earlier rows are kept
+            append = state.last_date is not None and \
+                os.path.exists(options.output)
+            header = not append or os.path.getsize(options.output) == 0
+            out = open(options.output, 'a' if append else 'w')
+        n = export(monkey, survey_id, WRITERS[options.format], out, state,
+                   header=header)
+        logger.debug("Exported %d responses", n)
+    except surveymonkey.QuotaExceededError as e:
+        # The state is saved after each batch, so rerunning resumes
+        logger.error("Stopped to save quota, rerun later to resume: %s", e)
+        sys.exit(1)
+    except surveymonkey.SurveyMonkeyError as e:
+        logger.exception("Error while talking to SurveyMonkey")
+        sys.exit(1)
+    sys.exit(0)
@@ -0,0 +1,223 @@
+"""Successive versions of survey responses, and what changed
+
+Each time poll.py sees a response with a new date_modified, it records
+the new version.  Versions are stored as changes to the previous one,
+so a respondent who edits one answer of a partial survey costs one
+question's answers, not a whole response.  The layout of the
+directory is:
+
+  <survey_id>/<respondent_id>.json
+
+which holds a list of versions, oldest first, each with its
+date_modified, status, the answers of the questions answered
+differently from the previous version ('set'), the questions no
+longer answered ('unset') and, if it changed, the order of the
+answered questions ('order').  Files are written to a temporary file and
+renamed into place.
+"""
+
+import json
+import logging
+import os
+
+import surveymonkey
+
+logger = logging.getLogger('surveymonkey.history')
+
+VERSION = 1
+
+class ResponseDiff:
+    """What changed between two versions of a response.  old_date and
+    old_status are None for a respondent's first version.
+
+    changed is the list of question IDs whose answers differ
+    (including questions answered or unanswered since), in the order
+    the questions were answered.  Evaluates as False when nothing
+    changed.
+    """
+    def __init__(self, respondent_id, old, new):
+        self.respondent_id = respondent_id
+        self.old_date = old['date_modified']
+        self.new_date = new['date_modified']
+        self.old_status = old['status']
+        self.new_status = new['status']
+        self.old_answers = old['answers']
+        self.new_answers = new['answers']
+        self.changed = [q_id for q_id in new['order']
+                        if self.old_answers.get(q_id, None) !=
+                        self.new_answers[q_id]]
+        self.changed += [q_id for q_id in old['order']
+                         if q_id not in self.new_answers]
+
+    def __nonzero__(self):
+        return len(self.changed) > 0 or self.old_status != self.new_status
+
+    def __repr__(self):
+        return "ResponseDiff({0}, {1} -> {2}, changed={3})".format(
+            self.respondent_id, self.old_date, self.new_date, self.changed)
+
+    @staticmethod
+    def _format(question, answers):
+        if answers is None:
+            return '(n/a)'
+        if question is None:
+            return ', '.join(a.get('text', a.get('row', '')) for a in answers)
+        parsed = surveymonkey.ParsedQuestionResponse(
+            question, surveymonkey.SurveyQuestionResponse(
+                {'question_id': question.question_id,
+                 'answers': [surveymonkey.Struct(a) for a in answers]}))
+        if not parsed:
+            return '(n/a)'
+        return '; '.join(': '.join(unicode(x) for x in a)
+                         if isinstance(a, tuple) else unicode(a)
+                         for a in parsed.answer)
+
+    def describe(self, details):
+        """Return a list of lines describing the changes, for people.
+        details is the SurveyDetails of the survey."""
+        rv = []
+        if self.old_status != self.new_status:
+            rv.append(u"Status: {0} -> {1}".format(self.old_status,
+                                                   self.new_status))
+        questions = {}
+        for page in details.pages:
+            for q in page.questions:
+                questions[q.question_id] = q
+        for q_id in self.changed:
+            question = questions.get(q_id, None)
+            rv.append(u"{0} {1} -> {2}".format(
+                    question.heading if question is not None else q_id,
+                    self._format(question, self.old_answers.get(q_id, None)),
+                    self._format(question, self.new_answers.get(q_id,
+                                                                None))))
+        return rv
+
+class ResponseHistory:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, survey_id, respondent_id):
+        return os.path.join(self.directory, survey_id,
+                            respondent_id + '.json')
+
+    def _load(self, survey_id, respondent_id):
+        """Return the stored versions of a response, or [] if there are
+        none.  An unreadable file is moved aside to <name>.corrupt, so
+        that the next version doesn't overwrite it.  Raises ValueError
+        for a history written by an unsupported version."""
+        filename = self._path(survey_id, respondent_id)
+        try:
+            with open(filename) as f:
+                data = json.loads(f.read())
+        except IOError:
+            return []
+        except ValueError as e:
+            logger.warning("Moving aside unreadable history for %s: %s",
+                           respondent_id, e)
+            os.rename(filename, filename + '.corrupt')
+            return []
+        if data['version'] != VERSION:
+            raise ValueError(
+                "Unsupported history version {0}".format(data['version']))
+        return data['versions']
+
+    def _save(self, survey_id, respondent_id, versions):
+        filename = self._path(survey_id, respondent_id)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        tmp = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'version': VERSION, 'versions': versions},
+                               separators=(',', ':')))
+        os.rename(tmp, filename)
+
+    @staticmethod
+    def _replay(versions):
+        """Yield each version in full: a dict of date_modified, status,
+        answers (question_id -> list of answer dicts) and order (the
+        question IDs in the order they were answered)"""
+        answers = {}
+        order = []
+        for v in versions:
+            for q_id in v['unset']:
+                del answers[q_id]
+            answers.update(v['set'])
+            order = v.get('order', order)
+            yield {'date_modified': v['date_modified'],
+                   'status': v['status'], 'answers': dict(answers),
+                   'order': order}
+
+    _first = {'date_modified': None, 'status': None, 'answers': {},
+              'order': []}
+
+    def versions(self, survey_id, respondent_id):
+        """Return the date_modified of each version, oldest first"""
+        return [v['date_modified']
+                for v in self._load(survey_id, respondent_id)]
+
+    def response(self, survey_id, respondent_id, date_modified=None,
+                 symbols=None):
+        """Return a version (by default the latest) as a
+        SurveyResponse, or None"""
+        rv = None
+        for v in self._replay(self._load(survey_id, respondent_id)):
+            if date_modified is None or v['date_modified'] == date_modified:
+                rv = v
+        if rv is None:
+            return None
+        return surveymonkey.deserialize(
+            {'version': surveymonkey.SERIAL_VERSION,
+             'model': 'SurveyResponse',
+             'data': {'respondent_id': respondent_id,
+                      'questions': [{'question_id': q_id,
+                                     'answers': rv['answers'][q_id]}
+                                    for q_id in rv['order']]}},
+            symbols=symbols)
+
+    def changes(self, survey_id, respondent_id):
+        """Return a ResponseDiff for each version, from the previous
+        one (or from nothing, for the first)"""
+        rv = []
+        old = self._first
+        for v in self._replay(self._load(survey_id, respondent_id)):
+            rv.append(ResponseDiff(respondent_id, old, v))
+            old = v
+        return rv
+
+    def record(self, survey_id, response, r_info):
+        """Record a SurveyResponse, as modified at r_info.date_modified
+        with r_info.status (r_info is its RespondentInfo).  Returns the
+        ResponseDiff from the previous version.  Recording the same
+        version again changes nothing, and returns the same diff.
+        Raises IOError or OSError if it could not be saved, and
+        ValueError for an unsupported history."""
+        versions = self._load(survey_id, response.respondent_id)
+        replayed = list(self._replay(versions))
+        for i, v in enumerate(replayed):
+            if v['date_modified'] == r_info.date_modified:
+                return ResponseDiff(response.respondent_id,
+                                    replayed[i - 1] if i else self._first,
+                                    v)
+        old = replayed[-1] if replayed else self._first
+        if old['date_modified'] is not None and \
+                old['date_modified'] > r_info.date_modified:
+            logger.warning("Not recording %s from %s, older than %s",
+                           response.respondent_id, r_info.date_modified,
+                           old['date_modified'])
+            return ResponseDiff(response.respondent_id, old, old)
+        new = {'date_modified': r_info.date_modified,
+               'status': r_info.status,
+               'answers': {q.question_id: [a.to_data() for a in q.answers]
+                           for q in response.questions},
+               'order': [q.question_id for q in response.questions]}
+        version = {'date_modified': new['date_modified'],
+                   'status': new['status'],
+                   'set': {q_id: a for q_id, a in new['answers'].iteritems()
+                           if old['answers'].get(q_id, None) != a},
+                   'unset': [q_id for q_id in old['answers']
+                             if q_id not in new['answers']]}
+        if new['order'] != old['order']:
+            version['order'] = new['order']
+        versions.append(version)
+        self._save(survey_id, response.respondent_id, versions)
+        return ResponseDiff(response.respondent_id, old, new)
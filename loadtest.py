@@ -0,0 +1,295 @@
+#!/usr/bin/python
+#
+# Load test the web scripts against a fake SurveyMonkey.  Not installed.
+#
+# The CGI scripts are run by a local CGIHTTPServer, exactly as a web
+# server would run them, with SURVEYMONKEY_CONFIG pointing them at a
+# fake SurveyMonkey API served from this process.  Results are printed
+# as JSON.
+
+import BaseHTTPServer
+import CGIHTTPServer
+import json
+import optparse
+import os
+import random
+import resource
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+
+import bench
+import surveymonkey
+
+SCRIPTS = ['monkey.py', 'pdf.py', 'packet.py']
+SURVEY_TITLE = 'Student Application and Technical Survey'
+# A mix is a comma-separated list of kind[:numdays]=weight
+DEFAULT_MIX = 'dashboard:30=4,dashboard:365=1,pdf=2'
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class FakeSurveyMonkey:
+    """Serves the SurveyMonkey API calls the scripts make, for n
+    respondents spread over the last year, after latency seconds"""
+    def __init__(self, n=500, latency=0.1):
+        self.latency = latency
+        (details, self._make_response) = bench.fake_survey_data()
+        details['title'] = {'text': SURVEY_TITLE}
+        self.details = details
+        now = int(time.time())
+        self.respondents = [
+            {'respondent_id': str(i),
+             'date_start': surveymonkey.DateTime.from_epoch(
+                    now - (n - i) * 365 * 86400 // n),
+             'status': 'completed' if i % 3 else 'partial'}
+            for i in xrange(n)]
+        for r in self.respondents:
+            r['date_modified'] = r['date_start']
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                          self._handler_class())
+        self.base_uri = 'http://127.0.0.1:{0}'.format(
+            self.server.server_port)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.split('?')[0].rsplit('/', 1)[-1]
+                length = int(self.headers.getheader('content-length', 0))
+                data = json.loads(self.rfile.read(length) or 'null') or {}
+                time.sleep(fake.latency)
+                body = json.dumps(fake.call(method, data))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    def call(self, method, data):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        page = data.get('page', 1)
+        page_size = data.get('page_size', 1000)
+        if method == 'get_survey_list':
+            surveys = [{'survey_id': '1', 'title': SURVEY_TITLE,
+                        'date_modified': self.respondents[-1]['date_start']}]
+            return {'status': 0, 'data': {'page': page, 'page_size': 1000,
+                                          'surveys': surveys
+                                          if page == 1 else []}}
+        if method == 'get_survey_details':
+            return {'status': 0, 'data': self.details}
+        if method == 'get_respondent_list':
+            if 'start_modified_date' in data or 'end_modified_date' in data:
+                start, end = 'start_modified_date', 'end_modified_date'
+            else:
+                start, end = 'start_date', 'end_date'
+            matches = [r for r in self.respondents
+                       if r['date_start'] >= data.get(start, '') and
+                       (end not in data or r['date_start'] < data[end])]
+            return {'status': 0, 'data': {
+                    'page': page, 'page_size': page_size,
+                    'respondents': matches[(page - 1) * page_size:
+                                               page * page_size]}}
+        if method == 'get_responses':
+            return {'status': 0, 'data': [self._make_response(int(r))
+                                          for r in data['respondent_ids']]}
+        return {'status': 3, 'data': None}
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+class CGIHandler(CGIHTTPServer.CGIHTTPRequestHandler):
+    # Forking a threaded server is unsafe; run scripts with subprocess
+    have_fork = False
+
+    def log_message(self, *args):
+        pass
+
+def parse_mix(spec):
+    """Return [(kind, numdays, weight)] for a mix specification"""
+    rv = []
+    for item in spec.split(','):
+        (name, weight) = item.split('=')
+        (kind, _, numdays) = name.partition(':')
+        if kind not in ('dashboard', 'pdf', 'packet'):
+            raise ValueError("Unknown request kind '{0}'".format(kind))
+        rv.append((kind, int(numdays or 30), float(weight)))
+    return rv
+
+def request_url(base, kind, numdays, fake, rnd):
+    if kind == 'dashboard':
+        return '{0}/cgi-bin/monkey.py?{1}'.format(base, urllib.urlencode(
+                {'numdays': numdays}))
+    if kind == 'packet':
+        return '{0}/cgi-bin/packet.py?{1}'.format(base, urllib.urlencode(
+                {'survey_id': '1', 'numdays': numdays}))
+    r = rnd.choice(fake.respondents)
+    return '{0}/cgi-bin/pdf.py?{1}'.format(base, urllib.urlencode(
+            {'survey_id': '1', 'respondent_id': r['respondent_id'],
+             'date': r['date_modified'], 'status': r['status']}))
+
+def looks_ok(kind, body):
+    """Did a script succeed?  (CGIHTTPServer always sends 200.)"""
+    if kind in ('pdf', 'packet'):
+        return body.startswith('%PDF')
+    return '</html>' in body and 'ERROR' not in body and \
+        'A problem occurred in a Python script' not in body
+
+def percentiles(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return {}
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+            'max': values[-1], 'mean': sum(values) / len(values)}
+
+def run(options):
+    fake = FakeSurveyMonkey(options.respondents, options.latency)
+    fake.start()
+    root = tempfile.mkdtemp(prefix='loadtest')
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        os.mkdir(os.path.join(root, 'cgi-bin'))
+        for script in SCRIPTS:
+            os.symlink(os.path.join(here, script),
+                       os.path.join(root, 'cgi-bin', script))
+        token_file = os.path.join(root, 'token')
+        with open(token_file, 'w') as f:
+            f.write('fake-token')
+        config = {'token_file': token_file,
+                  'base_uri': fake.base_uri,
+                  'min_interval': options.min_interval,
+                  'survey_title': SURVEY_TITLE,
+                  'app': {'api_key': 'fake', 'client_id': 'fake',
+                          'client_secret': 'fake',
+                          'redirect_uri': 'http://localhost/'}}
+        config.update(json.loads(options.extra_config))
+        config_file = os.path.join(root, 'config.json')
+        with open(config_file, 'w') as f:
+            f.write(json.dumps(config))
+        # Inherited by the CGI scripts
+        os.environ['SURVEYMONKEY_CONFIG'] = config_file
+        os.environ['PYTHONPATH'] = os.pathsep.join(
+            [here] + [p for p in os.environ.get('PYTHONPATH', '').split(
+                    os.pathsep) if p])
+        os.chdir(root)
+        web = ThreadingHTTPServer(('127.0.0.1', 0), CGIHandler)
+        thread = threading.Thread(target=web.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base = 'http://127.0.0.1:{0}'.format(web.server_port)
+        return drive(base, fake, options)
+    finally:
+        os.chdir('/')
+        shutil.rmtree(root)
+
+def drive(base, fake, options):
+    mix = parse_mix(options.mix)
+    total_weight = sum(w for _, _, w in mix)
+    rnd = random.Random(options.seed)
+    lock = threading.Lock()
+    todo = [options.requests]
+    results = []
+
+    def choose():
+        x = rnd.uniform(0, total_weight)
+        for kind, numdays, weight in mix:
+            x -= weight
+            if x <= 0:
+                break
+        return (kind, numdays)
+
+    def worker():
+        while True:
+            with lock:
+                if todo[0] <= 0:
+                    return
+                todo[0] -= 1
+                (kind, numdays) = choose()
+                url = request_url(base, kind, numdays, fake, rnd)
+            start = time.time()
+            try:
+                body = urllib2.urlopen(url).read()
+                ok = looks_ok(kind, body)
+            except (urllib2.URLError, IOError):
+                ok = False
+            with lock:
+                results.append(('{0}:{1}'.format(kind, numdays)
+                                if kind != 'pdf' else kind,
+                                time.time() - start, ok))
+
+    start = time.time()
+    threads = [threading.Thread(target=worker)
+               for _ in xrange(options.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    api_calls = sum(fake.calls.values())
+    report = {'requests': len(results),
+              'errors': len([r for r in results if not r[2]]),
+              'concurrency': options.concurrency,
+              'api_latency': options.latency,
+              'elapsed': elapsed,
+              'throughput': len(results) / elapsed,
+              'latency': percentiles([r[1] for r in results]),
+              'by_kind': {},
+              'api_calls': api_calls,
+              'api_calls_per_request': float(api_calls) / max(1,
+                                                              len(results)),
+              'api_calls_by_method': fake.calls,
+              # ru_maxrss is in kB on Linux: the largest script run
+              'peak_script_rss_kb': resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss}
+    for kind in set(r[0] for r in results):
+        latencies = [r[1] for r in results if r[0] == kind]
+        report['by_kind'][kind] = dict(percentiles(latencies),
+                                       requests=len(latencies))
+    return report
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-c', '--concurrency', type='int', default=4,
+                      help='concurrent clients (default: %default)')
+    parser.add_option('-n', '--requests', type='int', default=40,
+                      help='total requests (default: %default)')
+    parser.add_option('-m', '--mix', default=DEFAULT_MIX,
+                      help='request mix, as kind[:numdays]=weight,... '
+                      'where kind is dashboard, pdf or packet '
+                      '(default: %default)')
+    parser.add_option('-r', '--respondents', type='int', default=500,
+                      help='respondents in the fake survey '
+                      '(default: %default)')
+    parser.add_option('-l', '--latency', type='float', default=0.1,
+                      help='seconds per fake API call (default: %default)')
+    parser.add_option('--min-interval', type='float', default=0.0,
+                      help="the client's spacing between API calls "
+                      "(default: %default)")
+    parser.add_option('--extra-config', default='{}',
+                      help='JSON to add to the scripts\' config, e.g. '
+                      '\'{"artifact_dir": "/tmp/artifacts"}\'')
+    parser.add_option('--seed', type='int', default=0)
+    (options, args) = parser.parse_args()
+    try:
+        parse_mix(options.mix)
+    except ValueError as e:
+        parser.error("Bad mix: {0}".format(e))
+    print json.dumps(run(options), indent=2, sort_keys=True)
+    sys.exit(0)
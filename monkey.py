@@ -7,80 +7,186 @@ import os
 import sys
 import time
 import urllib
+from multiprocessing.pool import ThreadPool
 cgitb.enable()
 
 sys.path.append(os.path.join(os.getcwd(), 'lib'))
 import surveymonkey
-import techdiagnostic
+import profiling
+import artifacts
 
 config = surveymonkey.Config.load()
+profiling.install(__file__, config)
 oauth = surveymonkey.OAuth(**config.app.as_dict())
 
+SURVEY_TITLE = 'Student Application and Technical Survey'
+# Responses are fetched this many at a time
+FETCH_BATCH = 10
+# Surveys, and the calls for each survey, are fetched this many at a time
+FETCH_THREADS = 4
+SORT_KEYS = {'date': lambda r: r.date_modified,
+             'status': lambda r: (r.status, r.date_modified)}
+
 numdays = 30
+page_size = 25
+cursor = 0
 formdata = cgi.FieldStorage()
 print """Content-type: text/html
 
 <html><head><title>Survey Monkey Thingy</title></head>
 <body>"""
 try:
-    numdays=int(formdata['numdays'].value)
-except KeyError:
-    pass
+    numdays=int(formdata.getfirst('numdays', numdays))
+    page_size=max(1, int(formdata.getfirst('page_size', page_size)))
+    cursor=max(0, int(formdata.getfirst('cursor', cursor)))
 except ValueError:
-    print "<p>Bad value for 'numdays'</p>"
+    print "<p>Bad value for 'numdays', 'page_size' or 'cursor'</p>"
+    print "</body></html>"
+    sys.exit(0)
+sort = formdata.getfirst('sort', 'date')
+order = formdata.getfirst('order', 'desc')
+if sort not in SORT_KEYS or order not in ('asc', 'desc'):
+    print "<p>Bad value for 'sort' or 'order'</p>"
     print "</body></html>"
     sys.exit(0)
 
-monkey = surveymonkey.SurveyMonkey(config.get_token(),
-                                   config.app.api_key)
+def page_url(**kwargs):
+    """Return the URL of this view, with some parameters changed"""
+    params = {'numdays': numdays, 'page_size': page_size, 'cursor': cursor,
+              'sort': sort, 'order': order}
+    params.update(kwargs)
+    return "{0}?{1}".format(os.getenv('SCRIPT_NAME', ''),
+                            cgi.escape(urllib.urlencode(params), True))
+
+def sort_link(key, label):
+    new_order = 'asc' if sort == key and order == 'desc' else 'desc'
+    return '<a href="{0}">{1}</a>'.format(
+        page_url(sort=key, order=new_order, cursor=0), label)
+
+monkey = surveymonkey.SurveyMonkey.from_config(
+    config, survey_cache=getattr(config, 'survey_cache_file', None),
+    caller='dashboard', priority='high')
+artifact_cache = None
+if getattr(config, 'artifact_dir', None) is not None:
+    artifact_cache = artifacts.ArtifactCache(config.artifact_dir)
+
+def fetch_survey(s):
+    """Fetch what is needed to show a page of a survey.  Returns
+    (SurveyInfo, sorted respondents, page of respondents, dict of
+    respondent_id to table row).  Independent calls are made
+    concurrently in the calls pool."""
+    date_interval = time.strftime("%Y-%m-%d %H:%M:%S",
+                                  time.gmtime(time.time() - 86400 * numdays))
+    # Only the (small) respondent list is fetched in full, so that
+    # it can be sorted; responses are only fetched for this page.
+    # poll.py may already have saved both.
+    details = None
+    respondent_list = None
+    if artifact_cache is not None:
+        respondent_list = artifact_cache.respondent_list(s.survey_id,
+                                                         date_interval)
+    if respondent_list is None:
+        # Rows are unlikely to be cached either, so fetch the details
+        # while the respondent list is being fetched
+        details = calls.apply_async(monkey.get_survey_details,
+                                    (s.survey_id,))
+        respondent_list = monkey.get_survey_respondents(
+            s.survey_id, start_date=date_interval,
+            fields=['date_modified', 'status'], partitions=4)
+    respondents = sorted(respondent_list, key=SORT_KEYS[sort],
+                         reverse=(order == 'desc'))
+    page = respondents[cursor:cursor + page_size]
+    local_dates = dict(zip(
+            [r.respondent_id for r in page],
+            surveymonkey.DateTime.convert_many(
+                [r.date_modified for r in page], txt=True)))
+    rows = {}
+    if artifact_cache is not None:
+        rows = artifact_cache.rows(s.survey_id, page)
+    missing = [r for r in page if r.respondent_id not in rows]
+    if len(missing):
+        if details is None:
+            details = calls.apply_async(monkey.get_survey_details,
+                                        (s.survey_id,))
+        batches = [calls.apply_async(monkey.get_survey_responses,
+                                     [s.survey_id] +
+                                     missing[start:start + FETCH_BATCH])
+                   for start in xrange(0, len(missing), FETCH_BATCH)]
+        questions = details.get().get_questions_by_heading(
+            *artifacts.QUESTIONS)
+        r_infos = {r.respondent_id: r for r in missing}
+        for batch in batches:
+            for r in batch.get():
+                rows[r.respondent_id] = artifacts.render_row(
+                    s.survey_id, questions, r, r_infos[r.respondent_id],
+                    local_dates[r.respondent_id])
+    return (s, respondents, page, rows)
 
 print "<h1>Survey responses in last {0} days</h1>".format(numdays)
+sys.stdout.flush()
+# Surveys are fetched concurrently, and each survey's calls are made
+# in a separate pool so that survey threads never wait on each other.
+# The client spaces the calls out to stay under the rate limit.
+surveys_pool = ThreadPool(FETCH_THREADS)
+calls = ThreadPool(FETCH_THREADS)
 try:
-    surveys = monkey.get_survey_list(title='Student Application and Technical Survey')
+    surveys = monkey.find_surveys(SURVEY_TITLE)
     if len(surveys) < 1:
         print "<p><strong>ERROR:</strong> No surveys found with title '{0}'".format(config.survey_title)
-    for s in surveys:
-        details = monkey.get_survey_details(s.survey_id)
+    # Each survey is shown as soon as it has been fetched
+    for s, respondents, page, rows in surveys_pool.imap_unordered(
+        fetch_survey, surveys):
         print "<h2>{0}</h2>".format(s.title)
-        date_interval = time.strftime("%Y-%m-%d %H:%M:%S",
-                                      time.gmtime(time.time() - 86400 * numdays))
-        respondent_list = monkey.get_survey_respondents(s.survey_id,
-                                                    start_date=date_interval,
-                                                    fields=['date_modified',
-                                                            'status'])
-        if len(respondent_list) < 1:
+        if len(respondents) < 1:
             print "<p>(no responses during this time)</p>"
-            break
-        responses = monkey.get_survey_responses(s.survey_id,
-                                                *respondent_list.respondents)
-        print "<table border=\"1\"><tr><th>Name</th><th>Email</th><th>date</th><th>status</th><th>PDF</th></tr>"
-        for r in responses:
-            print "<tr>"
-            for q in details.get_questions_by_heading('Name:',
-                                                      'MIT email address:'):
-                answer = r.get_response_for_question(q)
-                print "<td>{0}</td>".format(answer.answer[0] if answer else '<n/a>')
-            r_info = respondent_list[r.respondent_id]
-            date_modified = surveymonkey.DateTime(r_info.date_modified).to_local(True)
-            print "<td>{0}</td><td>{1}</td>".format(date_modified,
-                                                    r_info.status)
-            urldata = urllib.urlencode({'survey_id': s.survey_id,
-                                        'respondent_id': r.respondent_id,
-                                        'date': date_modified,
-                                        'status': r_info.status})
-            print """<td>
-                     <a href=\"{0}\" target=\"_blank\">Go</a>
-                     </td></tr>""".format(
-                "pdf.py?{0}".format(urldata))
-        print "</table>"
+            continue
+        if len(page) == 0:
+            # The cursor is past the end
+            print "<p>No more respondents (there are {0})</p>".format(
+                len(respondents))
+        else:
+            print "<p>Showing {0}-{1} of {2}</p>".format(
+                cursor + 1, cursor + len(page), len(respondents))
+            print "<table border=\"1\"><tr><th>Name</th><th>Email</th><th>{0}</th><th>{1}</th><th>PDF</th></tr>".format(sort_link('date', 'date'), sort_link('status', 'status'))
+            for r_info in page:
+                if r_info.respondent_id in rows:
+                    print rows[r_info.respondent_id]
+            print "</table>"
+        links = []
+        if cursor > 0:
+            links.append('<a href="{0}">&laquo; Previous</a>'.format(
+                    page_url(cursor=max(0, min(cursor, len(respondents)) -
+                                        page_size))))
+        if cursor + page_size < len(respondents):
+            links.append('<a href="{0}">Next &raquo;</a>'.format(
+                    page_url(cursor=cursor + page_size)))
+        if len(links):
+            print "<p>{0}</p>".format(' | '.join(links))
+        print '<p><a href="packet.py?{0}">All {1} responses as one PDF</a></p>'.format(
+            cgi.escape(urllib.urlencode({'survey_id': s.survey_id,
+                                         'numdays': numdays}), True),
+            len(respondents))
+        sys.stdout.flush()
+except surveymonkey.QuotaExceededError as e:
+    print "<p><strong>ERROR:</strong> {0}</p>".format(cgi.escape(str(e)))
 except surveymonkey.SurveyMonkeyError as e:
+    # The cached survey_id may be the problem
+    monkey.invalidate_survey_cache(SURVEY_TITLE)
     print "ERROR:", e
+finally:
+    surveys_pool.close()
+    calls.close()
+    surveys_pool.join()
+    calls.join()
+    monkey.close()
 print '<form name="days" method="post" action="{0}">'.format(
     os.getenv('SCRIPT_NAME'))
 print 'View the last <select name="numdays">'
 for n in range(30, 365, 30):
-    print '<option value="{0}">{1}</option>'.format(n, n)
-print '</select> days'
+    print '<option value="{0}"{1}>{0}</option>'.format(
+        n, ' selected="selected"' if n == numdays else '')
+print '</select> days, <input type="text" size="3" name="page_size" ' \
+    'value="{0}"/> per page'.format(page_size)
 print '<input type="submit" name="go" value="Update"/>'
 print '</form>'
 print "</body></html>"
@@ -0,0 +1,165 @@
+"""An on-disk queue of e-mail notifications
+
+Scripts put() messages into the outbox, which only writes a file, and
+deliver() sends them later (usually from a background process) with
+the configured sendmail command.  Messages due for delivery to the
+same recipient with the same subject are sent as one e-mail.  A
+failed batch is retried with exponential backoff, and after
+max_attempts its messages are moved aside to failed/.  The layout of
+the directory is:
+
+  tmp/      messages being written
+  new/      messages waiting to be delivered, as JSON
+  failed/   messages that could not be delivered
+  lock      held while delivering
+
+Messages are written to tmp/ and renamed into new/, so delivery never
+sees a partial message.
+"""
+
+import fcntl
+import itertools
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+logger = logging.getLogger('surveymonkey.outbox')
+
+SENDMAIL_CMD = ['/usr/sbin/sendmail', '-t']
+SENDER = 'CS Hiring Survey Checker <devnull@mit.edu>'
+# Every message has these
+FIELDS = frozenset(('to', 'subject', 'body', 'attempts', 'next_attempt'))
+
+class Outbox:
+    def __init__(self, directory, **kwargs):
+        self.directory = directory
+        self.sendmail_cmd = kwargs.get('sendmail_cmd', SENDMAIL_CMD)
+        if isinstance(self.sendmail_cmd, basestring):
+            self.sendmail_cmd = self.sendmail_cmd.split()
+        self.sender = kwargs.get('sender', SENDER)
+        # Seconds before giving up on one run of sendmail
+        self.timeout = kwargs.get('timeout', 60)
+        self.retry_after = kwargs.get('retry_after', 60)
+        self.max_retry_after = kwargs.get('max_retry_after', 3600)
+        self.max_attempts = kwargs.get('max_attempts', 10)
+        self._seq = itertools.count()
+        for d in ('tmp', 'new', 'failed'):
+            if not os.path.isdir(self._path(d)):
+                os.makedirs(self._path(d))
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _write(self, name, message):
+        tmp = self._path('tmp', name)
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(message))
+        os.rename(tmp, self._path('new', name))
+
+    def put(self, to, subject, body):
+        """Queue a message.  Raises IOError or OSError if it could not
+        be queued."""
+        name = '{0:.6f}-{1}-{2}.json'.format(time.time(), os.getpid(),
+                                             next(self._seq))
+        self._write(name, {'to': to, 'subject': subject, 'body': body,
+                           'attempts': 0, 'next_attempt': 0})
+        logger.debug("Queued %s for %s", name, to)
+
+    def pending(self):
+        """Return a list of (name, message) waiting to be delivered,
+        oldest first"""
+        rv = []
+        for name in sorted(os.listdir(self._path('new'))):
+            try:
+                with open(self._path('new', name)) as f:
+                    message = json.loads(f.read())
+            except (IOError, ValueError) as e:
+                logger.warning("Skipping unreadable message %s: %s", name, e)
+                continue
+            if not isinstance(message, dict) or \
+                    not FIELDS.issubset(message):
+                logger.warning("Skipping malformed message %s", name)
+                continue
+            rv.append((name, message))
+        return rv
+
+    def _sendmail(self, to, subject, body):
+        """Run the sendmail command on one message.  Returns None on
+        success, or an error message."""
+        text = u"To: {0}\nFrom: {1}\nSubject: {2}\n\n{3}\n".format(
+            to, self.sender, subject, body)
+        with tempfile.TemporaryFile() as stdin:
+            with tempfile.TemporaryFile() as stderr:
+                stdin.write(text.encode('utf-8'))
+                stdin.seek(0)
+                try:
+                    proc = subprocess.Popen(self.sendmail_cmd, stdin=stdin,
+                                            stdout=stderr, stderr=stderr,
+                                            close_fds=True)
+                except OSError as e:
+                    return str(e)
+                deadline = time.time() + self.timeout
+                while proc.poll() is None:
+                    if time.time() > deadline:
+                        proc.kill()
+                        proc.wait()
+                        return "Timed out after {0}s".format(self.timeout)
+                    time.sleep(0.1)
+                if proc.returncode != 0:
+                    stderr.seek(0)
+                    return "Exit status {0}: {1}".format(
+                        proc.returncode, stderr.read().strip())
+        return None
+
+    def _failed(self, batch, error):
+        for name, message in batch:
+            message['attempts'] += 1
+            message['error'] = error
+            if message['attempts'] >= self.max_attempts:
+                logger.error("Giving up on %s after %d attempts: %s", name,
+                             message['attempts'], error)
+                os.rename(self._path('new', name),
+                          self._path('failed', name))
+                continue
+            message['next_attempt'] = time.time() + min(
+                self.max_retry_after,
+                self.retry_after * 2 ** (message['attempts'] - 1))
+            self._write(name, message)
+
+    def deliver(self):
+        """Send every message that is due, batched by recipient and
+        subject.  Returns the number of messages sent, or None if
+        another process is already delivering."""
+        lock = open(self._path('lock'), 'a')
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                logger.debug("Delivery already in progress")
+                return None
+            now = time.time()
+            batches = {}
+            for name, message in self.pending():
+                if message['next_attempt'] <= now:
+                    batches.setdefault((message['to'], message['subject']),
+                                       []).append((name, message))
+            sent = 0
+            for (to, subject), batch in sorted(batches.iteritems(),
+                                               key=lambda b: b[1][0][0]):
+                error = self._sendmail(to, subject, "\n\n".join(
+                        m['body'] for _, m in batch))
+                if error is not None:
+                    logger.warning("Failed to send %d messages to %s: %s",
+                                   len(batch), to, error)
+                    self._failed(batch, error)
+                    continue
+                for name, _ in batch:
+                    os.unlink(self._path('new', name))
+                sent += len(batch)
+                logger.debug("Sent %d messages to %s", len(batch), to)
+            return sent
+        finally:
+            lock.close()
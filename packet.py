@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+import cgi
+import cgitb
+import os
+import sys
+import time
+import urlparse
+
+# Hack for easy debugging
+debug_mode = 'GATEWAY_INTERFACE' not in os.environ
+
+if not debug_mode:
+    cgitb.enable()
+
+sys.path.append(os.path.join(os.getcwd(), 'lib'))
+import surveymonkey
+import profiling
+import techdiagnostic
+
+# Responses are fetched this many at a time, as the PDF needs them
+FETCH_BATCH = 10
+
+config = surveymonkey.Config.load()
+profiling.install(__file__, config)
+monkey = surveymonkey.SurveyMonkey.from_config(config, caller='packet')
+
+formdata = cgi.FieldStorage()
+if debug_mode:
+    # Populdate FieldStorage from urlencoded data on stdin
+    print "CGI debugging mode; enter one line of url-encoded data."
+    for k,v in urlparse.parse_qsl(sys.stdin.readline().strip()):
+        print "{0}={1}".format(k,v)
+        formdata.list.append(cgi.MiniFieldStorage(k,v))
+try:
+    survey_id=formdata['survey_id'].value
+    numdays=int(formdata.getfirst('numdays', 30))
+except (KeyError, ValueError) as e:
+    if debug_mode:
+        sys.exit("Bad or missing parameter: " + str(e))
+    print """Content-type: text/html
+
+<html><head><title>Survey Monkey Thingy</title></head>
+<body>
+<p>Bad or missing parameter in URL: {0}</p>
+</body>
+</html>
+""".format(e)
+    sys.exit(0)
+
+details = monkey.get_survey_details(survey_id)
+date_interval = time.strftime("%Y-%m-%d %H:%M:%S",
+                              time.gmtime(time.time() - 86400 * numdays))
+respondents = sorted(monkey.get_survey_respondents(
+        survey_id, start_date=date_interval,
+        fields=['date_modified', 'status'], partitions=4),
+                     key=lambda r: r.date_modified)
+
+def candidates():
+    """Yield a Candidate per respondent, fetching responses in batches"""
+    for start in xrange(0, len(respondents), FETCH_BATCH):
+        batch = respondents[start:start + FETCH_BATCH]
+        dates = surveymonkey.DateTime.convert_many(
+            [r.date_modified for r in batch], txt=True)
+        responses = {r.respondent_id: r for r in
+                     monkey.get_survey_responses(survey_id, *batch)}
+        for r_info, date in zip(batch, dates):
+            response = responses.get(r_info.respondent_id, None)
+            if response is None:
+                continue
+            (name, email, header_lines) = techdiagnostic.respondent_header(
+                details, response, r_info.status, date)
+            yield techdiagnostic.Candidate(response, header_lines)
+
+pdf = techdiagnostic.Packet("output.pdf" if debug_mode else sys.stdout,
+                            details, candidates(), chunk_size=FETCH_BATCH)
+pdf.title = 'Technical Diagnostics for {0} respondents'.format(
+    len(respondents))
+# The filename, for Content-disposition purposes only.
+filename = 'tech_diagnostics_{0}.pdf'.format(survey_id)
+if debug_mode:
+    print "Generating", pdf.filename
+else:
+    print "Content-disposition: inline;filename={0}".format(filename)
+    print "Content-type: application/pdf\n"
+pdf.save()
+if debug_mode:
+    print "Successfully generated", pdf.filename, "with", \
+        len(pdf.index), "respondents"
+    print "Would have sent filename of", filename
+sys.exit(0)
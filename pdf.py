@@ -5,6 +5,7 @@ import cgitb
 import os
 import sys
 import re
+import shutil
 import urlparse
 
 # Hack for easy debugging
@@ -15,11 +16,14 @@ if not debug_mode:
 
 sys.path.append(os.path.join(os.getcwd(), 'lib'))
 import surveymonkey
+import profiling
+import artifacts
 import techdiagnostic
 
 config = surveymonkey.Config.load()
-monkey = surveymonkey.SurveyMonkey(config.get_token(),
-                                   config.app.api_key)
+profiling.install(__file__, config)
+monkey = surveymonkey.SurveyMonkey.from_config(config, caller='pdf',
+                                               priority='high')
 
 formdata = cgi.FieldStorage()
 if debug_mode:
@@ -46,6 +50,22 @@ except KeyError as e:
 """.format(e)
     sys.exit(0)
 
+# Serve the PDF poll.py made, if it is of this version of the response
+artifact_dir = getattr(config, 'artifact_dir', None)
+cached = None
+if artifact_dir is not None:
+    cached = artifacts.ArtifactCache(artifact_dir).pdf(survey_id,
+                                                       respondent_id, date)
+if cached is not None and not debug_mode:
+    (pdf_file, info) = cached
+    print "Content-disposition: inline;filename={0}".format(
+        'tech_diagnostic_{0}.pdf'.format(re.sub('[^\w@\.\-]+', '',
+                                                info['email'])))
+    print "Content-type: application/pdf\n"
+    with open(pdf_file, 'rb') as f:
+        shutil.copyfileobj(f, sys.stdout)
+    sys.exit(0)
+
 details = monkey.get_survey_details(survey_id)
 responses = monkey.get_survey_responses(survey_id, respondent_id,
                                         by_id=True)
@@ -67,32 +87,13 @@ Error: {0}
 response = responses.pop()
 pdf = techdiagnostic.PDF("output.pdf" if debug_mode else sys.stdout)
 # Pull out name and email for headers
-(name, email) = [str(response.get_response_for_question(q)) for q
-                 in details.get_questions_by_heading('Name:',
-                                                     'MIT email address:')]
-pdf.header_lines.append(name)
-pdf.header_lines.append(email)
-pdf.header_lines.append("{0} {1}".format(status, date))
+(name, email, pdf.header_lines) = techdiagnostic.respondent_header(
+    details, response, status, date)
 # The title of the PDF itself
 pdf.title = 'Technical Diagnostic for {0} ({1})'.format(name, email)
 # The filename, for Content-disposition purposes only.
 filename='tech_diagnostic_{0}.pdf'.format(re.sub('[^\w@\.\-]+', '', email))
-for page in details.pages:
-    if len(page) == 0:
-        continue
-    section = techdiagnostic.Section(page.heading)
-    if page.heading == 'Basic Information':
-        section.skip_footer = True
-        section.skip_question_numbers = True
-        section.inline_single_answers = [
-            'Name:', 'MIT email address:',
-            'Phone Number (cell phone preferred):']
-    pdf.add_section(section)
-    pdf.add_page_title(page.heading)
-    for question in page:
-        question_response = response.get_response_for_question(question)
-        pdf.add_question_response(question_response)
-    pdf.add_page_break()
+pdf.add_survey_response(details, response)
 if debug_mode:
     print "Successfully generated", pdf.filename
     print "Would have sent filename of", filename
@@ -3,6 +3,7 @@
 # Periodically poll SurveyMonkey for repsonses
 
 import json
+import optparse
 import os
 import sys
 import time
@@ -11,27 +12,46 @@ import subprocess
 
 sys.path.append('/mit/helpdesk/web_scripts/surveymonkey/lib')
 import surveymonkey
+import profiling
+import artifacts
+import history
+import outbox
 
 # What questions do we want from the survey?
 QUESTIONS=['Name:', 'MIT email address:']
 
 logger = logging.getLogger('poll')
-sendmail_cmd = ['/usr/sbin/sendmail', '-t']
-
-def send_email(email_to, body):
-    # Remember, this is a docstring, so it must end on the line after
-    # 'Subject' to provide the required blank line
-    header = """To: {to}
-From: CS Hiring Survey Checker <devnull@mit.edu>
-Subject: New Technical Surveys
-"""
-    sendmail = subprocess.Popen(sendmail_cmd,
-                                stdin=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-    (_, err) = sendmail.communicate(header.format(to=email_to) + body)
-    if sendmail.returncode != 0:
-        logger.error("Failed to send mail: %s", err)
-        sys.exit(1)
+NOTIFY_TO = 'jdreed@mit.edu'
+NOTIFY_SUBJECT = 'New Technical Surveys'
+
+def get_outbox(config):
+    """Return the Outbox for notifications: poll.outbox_dir, or next
+    to the state file.  poll.sendmail_cmd replaces sendmail -t, e.g.
+    with a stand-in for testing."""
+    kwargs = {}
+    if 'sendmail_cmd' in config.poll.__dict__:
+        kwargs['sendmail_cmd'] = config.poll.sendmail_cmd
+    return outbox.Outbox(getattr(config.poll, 'outbox_dir',
+                                 config.poll.state_file + '.outbox'),
+                         **kwargs)
+
+def start_delivery():
+    """Deliver the outbox in a background process, so that the poll
+    never waits for mail"""
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                          '--deliver'], stdin=devnull, stdout=devnull,
+                         stderr=devnull, close_fds=True)
+
+def finish(status):
+    """Start delivering the outbox, which also retries anything that
+    earlier polls failed to send, and exit with status"""
+    try:
+        start_delivery()
+    except OSError as e:
+        logger.exception("Failed to start delivering notifications")
+    logger.debug("**END**")
+    sys.exit(status)
 
 class SavedState():
     """Save the last date to a file"""
@@ -80,6 +100,10 @@ class SavedState():
             logger.exception("Failed to write config file")
 
 if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [--deliver]")
+    parser.add_option('--deliver', action='store_true',
+                      help='only deliver queued notifications')
+    (options, args) = parser.parse_args()
     # This ensures the logger receives all messages of debugging
     # and higher
     logger.setLevel(logging.DEBUG)
@@ -95,25 +119,46 @@ if __name__ == "__main__":
         logger.exception("Failed to load config")
         sys.exit(1)
 
+    profiling.install(__file__, config)
+
     # Add the debug handler
     debug_fmt = logging.Formatter('%(asctime)s:%(levelname)s:%(message)s',
                                   '%m/%d/%Y %H:%M:%S')
     debug_handler = logging.FileHandler(config.poll.log_file)
     debug_handler.setFormatter(debug_fmt)
     logger.addHandler(debug_handler)
+    outbox_logger = logging.getLogger('surveymonkey.outbox')
+    outbox_logger.setLevel(logging.DEBUG)
+    outbox_logger.addHandler(debug_handler)
+
+    if options.deliver:
+        try:
+            get_outbox(config).deliver()
+        except (IOError, OSError) as e:
+            logger.exception("Failed to deliver notifications")
+            sys.exit(1)
+        sys.exit(0)
 
     logger.debug("**BEGIN")
-    monkey = surveymonkey.SurveyMonkey(config.get_token(),
-                                       config.app.api_key)
+    monkey = surveymonkey.SurveyMonkey.from_config(
+        config, survey_cache=getattr(config, 'survey_cache_file', None),
+        caller='poll')
     state_data = SavedState(config.poll.state_file)
+    artifact_cache = None
+    if getattr(config, 'artifact_dir', None) is not None:
+        artifact_cache = artifacts.ArtifactCache(config.artifact_dir)
+    response_history = None
+    if getattr(config, 'history_dir', None) is not None:
+        response_history = history.ResponseHistory(config.history_dir)
     last_upd = state_data.last_date
     logger.debug("Last check was: %s", last_upd)
     # Update the datestamp now, but don't save it in case this fails.
     state_data.touch()
     output = []
     try:
-        surveys = monkey.get_survey_list(title=config.poll.survey_title)
+        surveys = monkey.find_surveys(config.poll.survey_title)
         if len(surveys) != 1:
+            monkey.invalidate_survey_cache(config.poll.survey_title)
             logger.error("ERROR: Found %d surveys for title '%s'",
                          len(surveys), config.poll.survey_title)
             sys.exit(1)
@@ -123,7 +168,7 @@ if __name__ == "__main__":
             respondent_list = monkey.get_survey_respondents(
                 s.survey_id,
                 start_modified_date = last_upd,
-                fields=['date_modified', 'status'])
+                fields=['date_start', 'date_modified', 'status'])
             logger.debug("Retrieved respondent list")
             if len(respondent_list) < 1:
                 logger.info("No responses during this time")
@@ -132,27 +177,64 @@ if __name__ == "__main__":
                 s.survey_id,
                 *respondent_list.respondents)
             logger.debug("Retrieved responses")
+            local_dates = dict(zip(
+                    [r.respondent_id for r in respondent_list],
+                    surveymonkey.DateTime.convert_many(
+                        [r.date_modified for r in respondent_list],
+                        txt=True)))
+            questions = details.get_questions_by_heading(*QUESTIONS)
             for r in responses:
                 answers = [r.get_response_for_question(q) for q in
-                           details.get_questions_by_heading(*QUESTIONS)]
+                           questions]
                 data = {a.heading.strip(':'): str(a) for a in answers}
                 r_info = respondent_list[r.respondent_id]
                 data.update(r_info.as_dict())
-                data['date_modified'] = surveymonkey.DateTime(
-                    r_info.date_modified).to_local(True)
+                data['date_modified'] = local_dates[r.respondent_id]
                 output.append("* {Name} ({MIT email address}) submitted a {status} survey on {date_modified}".format(**data))
+                if response_history is not None:
+                    # Say what changed since the last version we saw
+                    try:
+                        diff = response_history.record(s.survey_id, r,
+                                                       r_info)
+                    except (IOError, OSError, ValueError) as e:
+                        # Still notify about the response itself
+                        logger.exception("Failed to record history of %s",
+                                         r.respondent_id)
+                        continue
+                    if diff.old_date is not None:
+                        output.extend(u"    {0}".format(line) for line in
+                                      diff.describe(details) or
+                                      ['(no answers changed)'])
+            if artifact_cache is not None:
+                try:
+                    artifact_cache.update(details, responses,
+                                          respondent_list, last_upd)
+                except Exception as e:
+                    logger.exception("Failed to update artifacts")
+                    artifact_cache.invalidate(s.survey_id)
+    except surveymonkey.QuotaExceededError as e:
+        # Not an error; the next poll picks up from the same date
+        logger.warning("Deferred until there is quota: %s", e)
+        finish(0)
     except surveymonkey.SurveyMonkeyError as e:
         logger.exception("Error while talking to SurveyMonkey")
-        sys.exit(1)
+        # The cached survey_id may be the problem
+        monkey.invalidate_survey_cache(config.poll.survey_title)
+        finish(1)
     except Exception as e:
         logger.exception("Unexpected exception")
-        sys.exit(1)
+        finish(1)
     if len(output) > 0:
-        logger.debug("Sending e-mail...")
+        logger.debug("Queueing e-mail...")
         header = 'Surveys updated since {0}:'.format(last_upd)
         output.insert(0, header)
-        send_email('jdreed@mit.edu', "\n".join(output))
+        try:
+            get_outbox(config).put(NOTIFY_TO, NOTIFY_SUBJECT,
+                                   "\n".join(output))
+        except (IOError, OSError) as e:
+            # Don't save the state, so these are found again next time
+            logger.exception("Failed to queue e-mail")
+            finish(1)
     state_data.save()
-    logger.debug("**END**")
-    sys.exit(0)
+    finish(0)
 
@@ -0,0 +1,173 @@
+"""Opt-in profiling of whole script runs
+
+Set SURVEYMONKEY_PROFILE (or profile_dir in the config) to a directory,
+and each run of a script which calls install() is profiled with
+cProfile, including every thread started after install() (such as
+ThreadPool workers making API calls).  At exit, the merged profile of
+all threads (<stamp>-<pid>-<script>.prof, for pstats or snakeviz) and
+a short summary (.txt) are written there.  The summary has the peak
+memory, the time spent in SurveyMonkey._make_request and in
+ReportLab's build(), and the top functions.  Times are summed over
+threads, so they can add up to more than the wall time.  Peak memory
+comes from tracemalloc where it exists, and from the process's
+maximum RSS otherwise.
+
+Threads still running at exit (daemon threads, or the workers of a
+pool that was closed but not joined) are included as far as they
+got, so join pools before exiting for complete profiles.  The summary
+says how many threads were still running.
+
+SURVEYMONKEY_PROFILE_SAMPLE (or profile_sample) profiles only one run
+in N, and only the newest profile_keep (default 50) profiles are kept.
+"""
+
+import atexit
+import cProfile
+import logging
+import os
+import pstats
+import random
+import resource
+import StringIO
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logger = logging.getLogger('surveymonkey.profiling')
+
+KEEP = 50
+TOP_FUNCTIONS = 25
+# (label, filename suffix, function name) of the calls broken out in
+# summaries
+CALLS = [('API requests', 'surveymonkey.py', '_make_request'),
+         ('PDF build', 'doctemplate.py', 'build')]
+
+def _setting(config, env, key, default=None):
+    value = os.environ.get(env, None)
+    if value is None and config is not None:
+        value = getattr(config, key, None)
+    return default if value is None else value
+
+def install(name, config=None):
+    """Start profiling this run of script name, if profiling is enabled
+    and this run is sampled.  Returns the Profile, or None."""
+    directory = _setting(config, 'SURVEYMONKEY_PROFILE', 'profile_dir')
+    if directory is None:
+        return None
+    try:
+        sample = int(_setting(config, 'SURVEYMONKEY_PROFILE_SAMPLE',
+                              'profile_sample', 1))
+        keep = int(_setting(config, 'SURVEYMONKEY_PROFILE_KEEP',
+                            'profile_keep', KEEP))
+    except ValueError:
+        logger.warning("Bad profiling sample or keep value")
+        return None
+    if sample > 1 and random.randrange(sample) != 0:
+        return None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    profile = cProfile.Profile()
+    # cProfile only sees the thread that enables it, so each new
+    # thread enables a profile of its own on its first event.  These
+    # are (thread, Profile).
+    thread_profiles = []
+
+    def start_thread(frame, event, arg):
+        thread_profile = cProfile.Profile()
+        thread_profiles.append((threading.current_thread(),
+                                thread_profile))
+        thread_profile.enable()
+    threading.setprofile(start_thread)
+    atexit.register(_finish, profile, thread_profiles, name, directory,
+                    keep, time.time())
+    profile.enable()
+    return profile
+
+def _call_times(stats):
+    """Return (label, calls, cumulative seconds) for each of CALLS.
+    Where several functions match (SimpleDocTemplate.build calls
+    BaseDocTemplate.build), the outermost one is used."""
+    rv = []
+    for label, filename, function in CALLS:
+        calls = 0
+        seconds = 0.0
+        for (f, _, func), (_, nc, _, ct, _) in stats.stats.iteritems():
+            if func == function and f.endswith(filename) and ct > seconds:
+                calls = nc
+                seconds = ct
+        rv.append((label, calls, seconds))
+    return rv
+
+def merge(profile, thread_profiles):
+    """Return the pstats.Stats of a Profile and those of its threads,
+    and the number of those threads which are still running (whose
+    profiles are partial)"""
+    stats = pstats.Stats(profile)
+    running = 0
+    for thread, thread_profile in thread_profiles:
+        if thread.is_alive():
+            running += 1
+        thread_profile.create_stats()
+        if thread_profile.stats:
+            stats.add(thread_profile)
+    return stats, running
+
+def summarize(stats, name, wall_time, threads=0, running=0):
+    """Return the text summary of finished, merged Stats, of a run
+    which started threads, of which running were still running"""
+    out = StringIO.StringIO()
+    stats.stream = out
+    print >>out, "{0}: {1}".format(name, ' '.join(sys.argv[1:]) or
+                                   os.environ.get('QUERY_STRING', ''))
+    print >>out, "Wall time: {0:.3f}s, profiled (all threads): " \
+        "{1:.3f}s".format(wall_time, stats.total_tt)
+    if threads:
+        print >>out, "Threads: {0}, of which {1} were still running " \
+            "(partial)".format(threads, running)
+    for label, calls, seconds in _call_times(stats):
+        print >>out, "{0}: {1:.3f}s in {2} calls".format(label, seconds,
+                                                         calls)
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        (_, peak) = tracemalloc.get_traced_memory()
+        print >>out, "Peak traced memory: {0} kB".format(peak // 1024)
+    else:
+        # ru_maxrss is in kB on Linux
+        print >>out, "Peak RSS: {0} kB".format(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    print >>out
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    return out.getvalue()
+
+def _rotate(directory, keep):
+    profiles = sorted(f for f in os.listdir(directory)
+                      if f.endswith('.prof'))
+    for f in profiles[:max(0, len(profiles) - keep)]:
+        for filename in (f, f[:-len('.prof')] + '.txt'):
+            try:
+                os.unlink(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+def _finish(profile, thread_profiles, name, directory, keep, start):
+    profile.disable()
+    threading.setprofile(None)
+    # Profiling must never break the script being profiled
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        base = os.path.join(directory, '{0}-{1}-{2}'.format(
+                time.strftime('%Y%m%d%H%M%S'), os.getpid(),
+                os.path.splitext(os.path.basename(name))[0]))
+        (stats, running) = merge(profile, thread_profiles)
+        stats.dump_stats(base + '.prof')
+        with open(base + '.txt', 'w') as f:
+            f.write(summarize(stats, name, time.time() - start,
+                              len(thread_profiles), running))
+        _rotate(directory, keep)
+    except Exception:
+        logger.exception("Failed to write profile")
@@ -0,0 +1,219 @@
+"""Columnar on-disk snapshots of survey responses"""
+
+import json
+import logging
+import os
+import shutil
+
+import numpy
+
+import surveymonkey
+
+logger = logging.getLogger('surveymonkey.snapshot')
+
+class Snapshot:
+    """The responses to a survey, stored one column per file.
+
+    A snapshot is a directory containing meta.json (the string tables
+    for question IDs, answer IDs, respondent IDs and statuses) and one
+    .npy file per column.  Answers are stored as one entry per
+    SurveyQuestionResponse answer, grouped by respondent:
+
+    - resp_offsets: entries for respondent i are
+      resp_offsets[i]:resp_offsets[i+1]
+    - question: index into question_ids, in SurveyDetails order
+    - row, col: index into answer_ids (row '0' is answer_ids[0]);
+      col is -1 if absent
+    - text: index into the text table, or -1
+    - text_offsets, text.bin: the UTF-8 text table
+    - date_modified: per-respondent UTC epoch seconds, or -1
+    - status: per-respondent index into statuses, or -1
+
+    Columns are memory-mapped when loaded, and are only opened when
+    first used.
+    """
+    VERSION = 1
+    _columns = ('resp_offsets', 'question', 'row', 'col', 'text',
+                'text_offsets', 'date_modified', 'status')
+
+    def __init__(self, directory, mmap=True):
+        self.directory = directory
+        self._mmap_mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            meta = json.loads(f.read())
+        if meta['version'] != self.VERSION:
+            raise surveymonkey.SurveyMonkeyError(
+                "Unsupported snapshot version {0}".format(meta['version']))
+        self.survey_id = meta['survey_id']
+        self.question_ids = meta['question_ids']
+        self.answer_ids = meta['answer_ids']
+        self.respondent_ids = meta['respondent_ids']
+        self.statuses = meta['statuses']
+        self._respondent_num = None
+        self._text_data = None
+
+    def __len__(self):
+        return len(self.respondent_ids)
+
+    def __getattr__(self, name):
+        # Load columns on first use
+        if name in self._columns:
+            arr = numpy.load(os.path.join(self.directory, name + '.npy'),
+                             mmap_mode=self._mmap_mode)
+            self.__dict__[name] = arr
+            return arr
+        raise AttributeError(
+            "Snapshot instance has no attribute '{0}'".format(name))
+
+    def get_text(self, n):
+        """Return entry n of the text table"""
+        if self._text_data is None:
+            filename = os.path.join(self.directory, 'text.bin')
+            if os.path.getsize(filename) == 0:
+                self._text_data = numpy.zeros(0, numpy.uint8)
+            elif self._mmap_mode is None:
+                self._text_data = numpy.fromfile(filename, numpy.uint8)
+            else:
+                self._text_data = numpy.memmap(filename, numpy.uint8, 'r')
+        start, end = self.text_offsets[n], self.text_offsets[n + 1]
+        return self._text_data[start:end].tostring().decode('utf-8')
+
+    def index_of(self, respondent_id):
+        """Return the position of a respondent in the snapshot"""
+        if self._respondent_num is None:
+            self._respondent_num = {r: n for n, r in
+                                    enumerate(self.respondent_ids)}
+        return self._respondent_num[respondent_id]
+
+    def response(self, n):
+        """Rebuild the SurveyResponse for respondent number n"""
+        start, end = self.resp_offsets[n], self.resp_offsets[n + 1]
+        questions = []
+        by_question = {}
+        for q, row, col, text in zip(self.question[start:end],
+                                     self.row[start:end],
+                                     self.col[start:end],
+                                     self.text[start:end]):
+            answer = {'row': self.answer_ids[row]}
+            if col >= 0:
+                answer['col'] = self.answer_ids[col]
+            if text >= 0:
+                answer['text'] = self.get_text(text)
+            if q not in by_question:
+                by_question[q] = {'question_id': self.question_ids[q],
+                                  'answers': []}
+                questions.append(by_question[q])
+            by_question[q]['answers'].append(surveymonkey.Struct(answer))
+        return surveymonkey.SurveyResponse(surveymonkey.Struct(
+                {'respondent_id': self.respondent_ids[n],
+                 'questions': [surveymonkey.Struct(q) for q in questions]}))
+
+    def responses(self):
+        """Yield every SurveyResponse in the snapshot"""
+        for n in xrange(len(self)):
+            yield self.response(n)
+
+    def respondent(self, n):
+        """Rebuild the RespondentInfo for respondent number n"""
+        info = {'respondent_id': self.respondent_ids[n]}
+        if self.date_modified[n] >= 0:
+            info['date_modified'] = surveymonkey.DateTime.from_epoch(
+                self.date_modified[n])
+        if self.status[n] >= 0:
+            info['status'] = self.statuses[self.status[n]]
+        return surveymonkey.RespondentInfo(info)
+
+    @classmethod
+    def write(cls, directory, details, responses, respondent_list=None):
+        """Write a snapshot of responses to the survey described by
+        details (a SurveyDetails).  If respondent_list is given, the
+        date_modified and status of each respondent are stored too.
+
+        The snapshot is written to a temporary directory which then
+        replaces directory.
+        """
+        question_ids = [q.question_id for p in details.pages
+                        for q in p.questions]
+        q_num = {q: n for n, q in enumerate(question_ids)}
+        answer_ids = ['0'] + [a.answer_id for p in details.pages
+                              for q in p.questions for a in q.answers]
+        a_num = {a: n for n, a in enumerate(answer_ids)}
+        statuses = []
+        status_num = {}
+        respondent_ids = []
+        columns = {c: [] for c in ('question', 'row', 'col', 'text',
+                                   'date_modified', 'status')}
+        resp_offsets = [0]
+        text_offsets = [0]
+        text_chunks = []
+
+        def code(table, index, value):
+            if value not in index:
+                index[value] = len(table)
+                table.append(value)
+            return index[value]
+
+        r_infos = {}
+        if respondent_list is not None:
+            r_infos = {r.respondent_id: r for r in respondent_list}
+        for response in responses:
+            respondent_ids.append(response.respondent_id)
+            r_info = r_infos.get(response.respondent_id, None)
+            fields = r_info.as_dict() if r_info is not None else {}
+            columns['date_modified'].append(
+                surveymonkey.DateTime.to_epoch(fields['date_modified'])
+                if 'date_modified' in fields else -1)
+            columns['status'].append(
+                code(statuses, status_num, fields['status'])
+                if 'status' in fields else -1)
+            for q_response in response.questions:
+                q = code(question_ids, q_num, q_response.question_id)
+                for ans in q_response.answers:
+                    columns['question'].append(q)
+                    columns['row'].append(code(answer_ids, a_num, ans.row))
+                    col = getattr(ans, 'col', None)
+                    columns['col'].append(-1 if col is None else
+                                          code(answer_ids, a_num, col))
+                    text = getattr(ans, 'text', None)
+                    if text is None:
+                        columns['text'].append(-1)
+                    else:
+                        data = text.encode('utf-8')
+                        columns['text'].append(len(text_chunks))
+                        text_chunks.append(data)
+                        text_offsets.append(text_offsets[-1] + len(data))
+            resp_offsets.append(len(columns['question']))
+
+        tmp = directory.rstrip('/') + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        for name, dtype, values in (
+            ('resp_offsets', numpy.int64, resp_offsets),
+            ('question', numpy.int32, columns['question']),
+            ('row', numpy.int32, columns['row']),
+            ('col', numpy.int32, columns['col']),
+            ('text', numpy.int32, columns['text']),
+            ('text_offsets', numpy.int64, text_offsets),
+            ('date_modified', numpy.int64, columns['date_modified']),
+            ('status', numpy.int32, columns['status'])):
+            numpy.save(os.path.join(tmp, name + '.npy'),
+                       numpy.array(values, dtype))
+        with open(os.path.join(tmp, 'text.bin'), 'wb') as f:
+            for data in text_chunks:
+                f.write(data)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            f.write(json.dumps({'version': cls.VERSION,
+                                'survey_id': details.survey_id,
+                                'question_ids': question_ids,
+                                'answer_ids': answer_ids,
+                                'respondent_ids': respondent_ids,
+                                'statuses': statuses}))
+        if os.path.exists(directory):
+            old = directory.rstrip('/') + '.old'
+            os.rename(directory, old)
+            os.rename(tmp, directory)
+            shutil.rmtree(old)
+        else:
+            os.rename(tmp, directory)
+        return cls(directory)
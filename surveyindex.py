@@ -0,0 +1,364 @@
+"""Local indexes over survey responses"""
+
+import bisect
+import cPickle
+import logging
+import math
+import re
+
+logger = logging.getLogger('surveymonkey.index')
+
+class RespondentSet:
+    """An immutable set of respondents, stored as a bitmap over the
+    respondent numbers assigned by an AnswerIndex.
+
+    Supports &, |, - (with other RespondentSets from the same index),
+    len(), iteration over respondent IDs, and membership tests by
+    respondent ID.
+    """
+    def __init__(self, index, bits=0):
+        self._index = index
+        self._bits = bits
+
+    def _check(self, other):
+        if not isinstance(other, RespondentSet):
+            raise TypeError("Cannot combine with {0}".format(type(other)))
+        if other._index is not self._index:
+            raise ValueError("RespondentSets are from different indexes")
+
+    def __and__(self, other):
+        self._check(other)
+        return RespondentSet(self._index, self._bits & other._bits)
+
+    def __or__(self, other):
+        self._check(other)
+        return RespondentSet(self._index, self._bits | other._bits)
+
+    def __sub__(self, other):
+        self._check(other)
+        return RespondentSet(self._index, self._bits & ~other._bits)
+
+    def __len__(self):
+        return bin(self._bits).count('1')
+
+    def __nonzero__(self):
+        return self._bits != 0
+
+    def __iter__(self):
+        bits = self._bits
+        while bits:
+            low = bits & -bits
+            yield self._index._respondent_ids[low.bit_length() - 1]
+            bits ^= low
+
+    def __contains__(self, respondent_id):
+        n = self._index._respondent_num.get(respondent_id, None)
+        return n is not None and bool(self._bits >> n & 1)
+
+    def __repr__(self):
+        return "RespondentSet({0})".format(list(self))
+
+class AnswerIndex:
+    """An inverted index of a survey's responses.
+
+    Maps (question_id), (question_id, row) and (question_id, row, col)
+    to the set of respondents who gave that answer.  'row' and 'col'
+    are the answer_ids from the SurveyQuestion, as they appear in the
+    SurveyQuestionResponse.  For example, to find everyone who chose
+    Linux on one question and did not answer another:
+
+        index.match(q1, linux_id) - index.match(q2)
+
+    Responses can be added at any time; adding a newer version of a
+    response replaces the old one.
+    """
+    def __init__(self, responses=()):
+        self._respondent_ids = []
+        self._respondent_num = {}
+        self._postings = {}
+        # respondent number -> keys it is posted under, for removal
+        self._keys_for = {}
+        self.add(*responses)
+
+    def __len__(self):
+        return len(self._keys_for)
+
+    def __contains__(self, respondent_id):
+        n = self._respondent_num.get(respondent_id, None)
+        return n is not None and n in self._keys_for
+
+    def _number(self, respondent_id):
+        n = self._respondent_num.get(respondent_id, None)
+        if n is None:
+            n = len(self._respondent_ids)
+            self._respondent_ids.append(respondent_id)
+            self._respondent_num[respondent_id] = n
+        return n
+
+    @staticmethod
+    def _keys(question_response):
+        q_id = question_response.question_id
+        keys = set([(q_id,)])
+        for ans in question_response.answers:
+            row = getattr(ans, 'row', '0')
+            if row == '0':
+                continue
+            keys.add((q_id, row))
+            col = getattr(ans, 'col', None)
+            if col is not None:
+                keys.add((q_id, row, col))
+        return keys
+
+    def remove(self, respondent_id):
+        """Remove a respondent from the index, if present."""
+        n = self._respondent_num.get(respondent_id, None)
+        if n is None or n not in self._keys_for:
+            return
+        mask = ~(1 << n)
+        for key in self._keys_for.pop(n):
+            bits = self._postings[key] & mask
+            if bits:
+                self._postings[key] = bits
+            else:
+                del self._postings[key]
+
+    def add(self, *responses):
+        """Add (or replace) one or more SurveyResponses"""
+        for response in responses:
+            self.remove(response.respondent_id)
+            n = self._number(response.respondent_id)
+            bit = 1 << n
+            keys = set()
+            for q in response.questions:
+                keys |= self._keys(q)
+            for key in keys:
+                self._postings[key] = self._postings.get(key, 0) | bit
+            self._keys_for[n] = keys
+
+    def all(self):
+        """Return a RespondentSet of everyone in the index"""
+        bits = 0
+        for n in self._keys_for:
+            bits |= 1 << n
+        return RespondentSet(self, bits)
+
+    def match(self, question_id, row=None, col=None):
+        """Return a RespondentSet of those who answered question_id.
+
+        If row is given, only those who chose that answer_id; if col
+        is also given (matrix questions), only those who chose that
+        row and column.
+        """
+        if row is None and col is not None:
+            raise ValueError("col requires row")
+        key = tuple(x for x in (question_id, row, col) if x is not None)
+        return RespondentSet(self, self._postings.get(key, 0))
+
+    def all_of(self, *terms):
+        """Return respondents matching every term.  Each term is a
+        tuple of arguments to match()."""
+        if len(terms) == 0:
+            return self.all()
+        rv = self.match(*terms[0])
+        for term in terms[1:]:
+            rv = rv & self.match(*term)
+        return rv
+
+    def any_of(self, *terms):
+        """Return respondents matching at least one term.  Each term is
+        a tuple of arguments to match()."""
+        rv = RespondentSet(self)
+        for term in terms:
+            rv = rv | self.match(*term)
+        return rv
+
+class TextIndex:
+    """A positional full-text index over open-ended answers.
+
+    Documents are keyed by (survey_id, question_id, respondent_id);
+    for open_ended/multi questions, the subquestion answers are indexed
+    together as one document.  The text of each document is kept, so
+    hits can be displayed without fetching the responses again.
+
+    A blank line in a document's text ends a passage, and phrases
+    never match across passages, e.g. from one subquestion's answer
+    to the next.
+
+    Queries are whitespace-separated terms, "quoted phrases", and
+    prefixes ending in '*'.  A prefix of several words (foo-bar*) is
+    a phrase whose last word is a prefix.  All parts must match;
+    results are ranked by tf-idf.
+    """
+    subtypes = ('essay', 'multi')
+    _token_re = re.compile(r'\w+', re.UNICODE)
+    _query_re = re.compile(r'"([^"]*)"|(\S+)', re.UNICODE)
+    _passage_re = re.compile(r'\n\s*\n')
+
+    def __init__(self):
+        self._keys = []
+        self._doc_num = {}
+        self._text = {}
+        # term -> {doc number: [positions]}
+        self._postings = {}
+        self._terms_for = {}
+        self._sorted_terms = None
+
+    def __len__(self):
+        return len(self._text)
+
+    def __contains__(self, key):
+        return self._doc_num.get(key, None) in self._text
+
+    @classmethod
+    def tokenize(cls, text):
+        return cls._token_re.findall(text.lower())
+
+    def text(self, key):
+        """Return the indexed text for a key, or None"""
+        return self._text.get(self._doc_num.get(key, None), None)
+
+    def remove(self, key):
+        """Remove a document from the index, if present"""
+        n = self._doc_num.get(key, None)
+        if n is None or n not in self._text:
+            return
+        del self._text[n]
+        for term in self._terms_for.pop(n):
+            postings = self._postings[term]
+            del postings[n]
+            if len(postings) == 0:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def add_document(self, key, text):
+        """Add (or replace) the text for a key"""
+        self.remove(key)
+        n = self._doc_num.get(key, None)
+        if n is None:
+            n = self._doc_num[key] = len(self._keys)
+            self._keys.append(key)
+        if not text:
+            return
+        self._text[n] = text
+        terms = set()
+        pos = 0
+        for passage in self._passage_re.split(text):
+            for term in self.tokenize(passage):
+                postings = self._postings.get(term, None)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._sorted_terms = None
+                postings.setdefault(n, []).append(pos)
+                terms.add(term)
+                pos += 1
+            # Skipping a position keeps phrases within passages
+            pos += 1
+        self._terms_for[n] = terms
+
+    def add(self, details, *responses):
+        """Index the open-ended answers of SurveyResponses to the survey
+        described by details (a SurveyDetails)."""
+        questions = [q for page in details.pages for q in page
+                     if q.type.family == 'open_ended' and
+                     q.type.subtype in self.subtypes]
+        for response in responses:
+            for question in questions:
+                q_response = response[question.question_id]
+                key = (details.survey_id, question.question_id,
+                       response.respondent_id)
+                if q_response is None:
+                    self.remove(key)
+                    continue
+                # Blank lines between subanswers make them separate
+                # passages, so phrases don't match across them.
+                self.add_document(key, u'\n\n'.join(
+                        a.text for a in q_response.answers
+                        if getattr(a, 'text', None)))
+
+    def _expand(self, prefix):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        terms = self._sorted_terms
+        rv = []
+        for term in terms[bisect.bisect_left(terms, prefix):]:
+            if not term.startswith(prefix):
+                break
+            rv.append(term)
+        return rv
+
+    def _prefix_postings(self, prefix):
+        """Return {doc number: positions} of every term with a prefix"""
+        rv = {}
+        for term in self._expand(prefix):
+            for n, positions in self._postings[term].iteritems():
+                rv.setdefault(n, []).extend(positions)
+        return rv
+
+    def _match_phrase(self, words, prefix=False):
+        """Return {doc number: occurrences} for a list of words.  If
+        prefix is true, the last word is a prefix."""
+        if len(words) == 0:
+            return {}
+        postings = [self._postings.get(w, {}) for w in words[:-1]]
+        postings.append(self._prefix_postings(words[-1]) if prefix
+                        else self._postings.get(words[-1], {}))
+        if not all(postings):
+            return {}
+        docs = set(postings[0])
+        for p in postings[1:]:
+            docs &= set(p)
+        rv = {}
+        for n in docs:
+            later = [set(p[n]) for p in postings[1:]]
+            hits = sum(1 for pos in postings[0][n]
+                       if all(pos + i in s
+                              for i, s in enumerate(later, start=1)))
+            if hits:
+                rv[n] = hits
+        return rv
+
+    def search(self, query, survey_id=None, limit=None):
+        """Return a ranked list of (score, key) for a query.
+
+        If survey_id is given, only return documents for that survey.
+        """
+        parts = []
+        for phrase, word in self._query_re.findall(query.lower()):
+            if phrase:
+                parts.append(self._match_phrase(self.tokenize(phrase)))
+            elif word.endswith('*') and self.tokenize(word):
+                parts.append(self._match_phrase(self.tokenize(word),
+                                                prefix=True))
+            else:
+                parts.append(self._match_phrase(self.tokenize(word)))
+        if len(parts) == 0:
+            return []
+        docs = set(parts[0])
+        for p in parts[1:]:
+            docs &= set(p)
+        if survey_id is not None:
+            docs = set(n for n in docs if self._keys[n][0] == survey_id)
+        if len(docs) == 0:
+            return []
+        n_docs = float(len(self._text))
+        scores = dict.fromkeys(docs, 0.0)
+        for p in parts:
+            idf = math.log(1 + n_docs / len(p))
+            for n in docs:
+                scores[n] += (1 + math.log(p[n])) * idf
+        rv = sorted(((s, self._keys[n]) for n, s in scores.iteritems()),
+                    key=lambda x: (-x[0], x[1]))
+        return rv if limit is None else rv[:limit]
+
+    def save(self, filename):
+        """Write the index to a file"""
+        with open(filename, 'wb') as f:
+            cPickle.dump(self.__dict__, f, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        """Read an index written with save()"""
+        rv = cls()
+        with open(filename, 'rb') as f:
+            rv.__dict__.update(cPickle.load(f))
+        return rv
@@ -5,20 +5,26 @@ import sys
 if sys.hexversion < 0x2060000:
     raise Exception("Python 2.6 required")
 
+import bisect
 import calendar
+import fcntl
 import json
 import logging
+import os
+import threading
 import time
 import re
 import urllib
 
 from datetime import datetime
 from distutils.version import StrictVersion
+from multiprocessing.pool import ThreadPool
 from simplejson.decoder import JSONDecodeError
 from xml.sax import saxutils
 
 import pytz
 import requests
+import simplejson
 
 class DateTime:
     """Convenience for TZ conversion"""
@@ -56,6 +62,95 @@ class DateTime:
         else:
             return rv
 
+    @classmethod
+    def convert_many(cls, datestrings, **kwargs):
+        """Parse and convert many datestrings at once.
+
+        Takes the same fmt and is_local keyword arguments as the
+        constructor, and returns a list with the same results as
+        calling to_local() on each one, or to_utc() if to='utc' is
+        passed.  Pass txt=True to return strings.
+        """
+        fmt = kwargs.get('fmt', cls.default_fmt)
+        src_tz = cls.local_tz if kwargs.get('is_local', False) \
+            else cls.utc_tz
+        dst_tz = cls.utc_tz if kwargs.get('to', 'local') == 'utc' \
+            else cls.local_tz
+        txt = kwargs.get('txt', False)
+        offsets = _OffsetCache(dst_tz)
+        src_offset = None
+        rv = []
+        for datestring in datestrings:
+            naive = cls._parse(datestring, fmt)
+            if src_offset is None:
+                # Like the constructor, this uses replace(), which
+                # gives the zone's standard offset regardless of date.
+                src_offset = naive.replace(tzinfo=src_tz).utcoffset()
+            utc = naive - src_offset
+            tzinfo, offset = offsets.period(utc)
+            dt = utc + offset
+            if txt:
+                # Equivalent to strftime(default_fmt), but faster
+                rv.append('%04d-%02d-%02d %02d:%02d:%02d' % (
+                        dt.year, dt.month, dt.day,
+                        dt.hour, dt.minute, dt.second))
+            else:
+                rv.append(dt.replace(tzinfo=tzinfo))
+        return rv
+
+    _default_fmt_re = re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d$')
+
+    @classmethod
+    def _parse(cls, datestring, fmt):
+        """strptime(), but faster for the default format"""
+        if fmt == cls.default_fmt and cls._default_fmt_re.match(datestring):
+            return datetime(int(datestring[0:4]), int(datestring[5:7]),
+                            int(datestring[8:10]), int(datestring[11:13]),
+                            int(datestring[14:16]), int(datestring[17:19]))
+        return datetime.strptime(datestring, fmt)
+
+    @classmethod
+    def to_epoch(cls, datestring):
+        """Convert a UTC datestring in the default format to seconds
+        since the epoch"""
+        return calendar.timegm(time.strptime(datestring, cls.default_fmt))
+
+    @classmethod
+    def from_epoch(cls, seconds):
+        """Convert seconds since the epoch to a UTC datestring in the
+        default format"""
+        return time.strftime(cls.default_fmt, time.gmtime(seconds))
+
+class _OffsetCache:
+    """Looks up the UTC offset of a timezone for naive UTC datetimes,
+    once per DST period rather than once per datetime."""
+    def __init__(self, tz):
+        self._tz = tz
+        # pytz zones with DST expose their transition times; for
+        # anything else, treat all of time as a single period.
+        self._transitions = getattr(tz, '_utc_transition_times', [])
+        self._periods = {}
+        self._last = None
+
+    def period(self, utc):
+        """Return the (tzinfo, utcoffset) in effect at a naive UTC
+        datetime"""
+        if self._last is not None:
+            start, end, tzinfo, offset = self._last
+            if (start is None or start <= utc) and \
+                    (end is None or utc < end):
+                return tzinfo, offset
+        idx = bisect.bisect_right(self._transitions, utc) - 1
+        if idx not in self._periods:
+            local = self._tz.fromutc(utc.replace(tzinfo=self._tz))
+            start = self._transitions[idx] if idx >= 0 else None
+            end = self._transitions[idx + 1] \
+                if idx + 1 < len(self._transitions) else None
+            self._periods[idx] = (start, end, local.tzinfo,
+                                  local.utcoffset())
+        self._last = self._periods[idx]
+        return self._last[2:]
+
 
 logger = logging.getLogger('surveymonkey')
 
@@ -63,6 +158,11 @@ class SurveyMonkeyError(Exception):
     """Error class for this module"""
     pass
 
+class QuotaExceededError(SurveyMonkeyError):
+    """A request was refused to save the rest of the daily quota for
+    higher priority work"""
+    pass
+
 class Struct:
     """
     Simple object-like storage for dictionaries.  Can be constructed
@@ -78,10 +178,82 @@ class Struct:
     def as_dict(self):
         return self.__dict__
 
+    def to_data(self):
+        """Return the fields as plain dicts and lists, all the way
+        down, without the derived (underscore) fields.  Constructing
+        the same class from the result rebuilds those."""
+        return {k: _to_data(v) for k, v in self.__dict__.iteritems()
+                if not k.startswith('_')}
+
     def __repr__(self):
         return "{0}({1})".format(self.__class__.__name__,
                                  repr(self.__dict__))
 
+def _to_data(value):
+    if isinstance(value, Struct):
+        return value.to_data()
+    if isinstance(value, list):
+        return [_to_data(v) for v in value]
+    return value
+
+class SymbolTable:
+    """Shared strings and answers for one survey.
+
+    The same question IDs, answer IDs, statuses and so on repeat in
+    every response to a survey.  Passing the survey's SymbolTable
+    when building model objects makes them share one copy of each
+    string (so IDs from different objects can be compared with 'is'),
+    and makes answers without free text share one Struct per
+    (row, col).  Shared objects must be treated as read-only.
+
+    The client decodes responses for a survey with its SymbolTable,
+    so that nothing is allocated twice; see get_symbols().
+    """
+    _shared_keys = ('question_id', 'answer_id', 'row', 'col',
+                    'collector_id', 'collection_mode', 'status')
+    _answer_keys = frozenset(('row', 'col'))
+
+    def __init__(self):
+        self._strings = {}
+        self._answers = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def intern(self, s):
+        """Return the shared copy of a string"""
+        if s is None:
+            return None
+        return self._strings.setdefault(s, s)
+
+    def decode(self, fields):
+        """Like Struct(fields), but using shared strings and answers.
+        Use as the object_hook when decoding JSON for this survey."""
+        for k in self._shared_keys:
+            if k in fields:
+                fields[k] = self.intern(fields[k])
+        if 'row' in fields and self._answer_keys.issuperset(fields):
+            key = (fields['row'], fields.get('col', None))
+            rv = self._answers.get(key, None)
+            if rv is None:
+                rv = self._answers.setdefault(key, Struct(fields))
+            return rv
+        return Struct(fields)
+
+    def answer(self, answer):
+        """Return the shared copy of an answer Struct from a response"""
+        fields = answer.__dict__
+        if 'row' in fields and self._answer_keys.issuperset(fields):
+            key = (fields['row'], fields.get('col', None))
+            if self._answers.get(key, None) is answer:
+                return answer
+            return self.decode(dict(fields))
+        # Answers with text can't be shared, but their IDs can
+        for k in ('row', 'col'):
+            if k in fields:
+                fields[k] = self.intern(fields[k])
+        return answer
+
 class Config(Struct):
     """
     Convenience class for configuration management.
@@ -101,12 +273,38 @@ class Config(Struct):
             raise SurveyMonkeyError("No token_file value in config file.")
         return token
 
+    def get_credentials(self, **defaults):
+        """Return a list of Credentials for the 'credentials' list in
+        the config, or None if there isn't one.  Each entry has a
+        token_file and api_key, and optionally a name, min_interval,
+        pool_size and the surveys its account owns.  defaults are
+        used for options an entry doesn't have."""
+        if 'credentials' not in self.__dict__:
+            return None
+        rv = []
+        for entry in self.credentials:
+            try:
+                with open(entry.token_file, 'r') as f:
+                    token = f.read()
+            except IOError as e:
+                raise SurveyMonkeyError("{0} while reading token".format(e))
+            except AttributeError as e:
+                raise SurveyMonkeyError("No token_file value in credential")
+            kwargs = dict(defaults)
+            kwargs.update((k, entry.__dict__[k]) for k in
+                          ('name', 'min_interval', 'pool_size', 'surveys')
+                          if k in entry.__dict__)
+            rv.append(Credential(token, getattr(entry, 'api_key', None),
+                                 **kwargs))
+        return rv
+
     @staticmethod
     def load(filename=None):
         """Load the configuration from the specified file, or
-        a default location."""
+        $SURVEYMONKEY_CONFIG, or a default location."""
         if filename is None:
-            filename = Config.CONFIG_FILE
+            filename = os.environ.get('SURVEYMONKEY_CONFIG',
+                                      Config.CONFIG_FILE)
         with open(filename, 'r') as f:
             obj = json.loads(f.read(),
                              object_hook=Config)
@@ -117,10 +315,11 @@ class SurveyList(Struct):
     
     Supports iteration, access by index, and len()
     """
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
         self.surveys = [SurveyInfo(s) for s in self.surveys]
-        self.pages=[self.page]
+        if 'pages' not in self.__dict__:
+            self.pages=[self.page]
 
     def __getitem__(self, key):
         return self.surveys[key]
@@ -140,17 +339,24 @@ class RespondentList(Struct):
     
     Supports iteration, access by index, and len()
     """
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
-        self.respondents = [RespondentInfo(r) for r in self.respondents]
-        self.pages=[self.page]
+        self._symbols = kwargs.get('symbols', None)
+        self.respondents = [RespondentInfo(r, symbols=self._symbols)
+                            for r in self.respondents]
+        if 'pages' not in self.__dict__:
+            self.pages=[self.page]
+        # (len(respondents), respondent_id -> RespondentInfo), rebuilt
+        # when respondents are added
+        self._index = (0, {})
 
     def __getitem__(self, key):
         if isinstance(key, int):
             return self.respondents[key]
-        else:
-            return {r.respondent_id: r for r in self.respondents}.get(key,
-                                                                      None)
+        if self._index[0] != len(self.respondents):
+            self._index = (len(self.respondents),
+                           {r.respondent_id: r for r in self.respondents})
+        return self._index[1].get(key, None)
     def __len__(self):
         return len(self.respondents)
 
@@ -158,7 +364,8 @@ class RespondentList(Struct):
         return iter(self.respondents)
 
     def add_page(self, page):
-        self.respondents += [RespondentInfo(r) for r in page.respondents]
+        self.respondents += [RespondentInfo(r, symbols=self._symbols)
+                             for r in page.respondents]
         self.pages.append(page.page)
 
 class RespondentInfo(Struct):
@@ -170,9 +377,16 @@ class RespondentInfo(Struct):
     _fields = ('date_start', 'date_modified', 'collector_id',
                'collection_mode', 'custom_id', 'email', 'first_name',
                'last_name', 'ip_address', 'status', 'analysis_url')
+    # Fields whose values repeat across respondents
+    _shared_fields = ('collector_id', 'collection_mode', 'status')
 
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
+        symbols = kwargs.get('symbols', None)
+        if symbols is not None:
+            for k in self._shared_fields:
+                if k in self.__dict__:
+                    self.__dict__[k] = symbols.intern(self.__dict__[k])
 
     def __getattr__(self, name):
         if name in self.__dict__:
@@ -189,7 +403,7 @@ class SurveyInfo(Struct):
     _fields = ('title', 'analysis_url', 'date_created', 'date_modified',
                'language_id', 'question_count', 'num_responses')
 
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
 
     def __getattr__(self, name):
@@ -211,10 +425,24 @@ class SurveyInfo(Struct):
 
 class SurveyDetails(SurveyInfo):
     """Holds survey "details", including pages and questions.
+
+    Question and answer IDs are interned in a SymbolTable, which
+    should be passed when building SurveyResponses to this survey.
     """
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         SurveyInfo.__init__(self, *args)
-        self.pages = [SurveyPage(p) for p in self.pages]
+        self._symbols = kwargs.get('symbols', None)
+        if self._symbols is None:
+            self._symbols = SymbolTable()
+        self.pages = [SurveyPage(p, symbols=self._symbols)
+                      for p in self.pages]
+        self._answerable = None
+
+    def answerable_questions(self):
+        """Return a list for each page of its answerable SurveyQuestions"""
+        if self._answerable is None:
+            self._answerable = [list(p) for p in self.pages]
+        return self._answerable
 
     def get_questions_by_heading(self, *headings):
         """Given one or more headings, return a list of SurveyQuestions
@@ -248,9 +476,10 @@ class SurveyPage(Struct):
     iterate over .questions.  Supports len(), as well as tests for
     membership and accessing by question id.
     """
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
-        self.questions = [SurveyQuestion(q) for q in self.questions]
+        self.questions = [SurveyQuestion(q, **kwargs)
+                          for q in self.questions]
         self._question_idx = {q.question_id: q for q in self.questions}
 
     def __iter__(self):
@@ -286,11 +515,18 @@ class SurveyQuestion(Struct):
     Performs some basic validation on the answers attribute.  Supports
     membership tests and key access by answer_id.
     """
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
+        symbols = kwargs.get('symbols', None)
         self.type = SurveyQuestionType(self.type)
         self.answers = [SurveyAnswer(a) for a in self.answers]
+        if symbols is not None:
+            self.question_id = symbols.intern(self.question_id)
+            for a in self.answers:
+                a.answer_id = symbols.intern(a.answer_id)
         self._answer_idx = {a.answer_id: a for a in self.answers}
+        self._sorted_answers = None
+        self._unanswered = None
         # Because we require this in ParsedQuestionResponse when sorting
         if self.type == "open_ended/multi":
             if not all([hasattr(x, 'position') for x in self.answers]):
@@ -315,6 +551,19 @@ class SurveyQuestion(Struct):
     def answerable(self):
         return self.type.family != 'presentation'
 
+    def unanswered(self):
+        """Return the shared ParsedQuestionResponse for no answer"""
+        if self._unanswered is None:
+            self._unanswered = ParsedQuestionResponse(self, None)
+        return self._unanswered
+
+    def sorted_answers(self):
+        """Return the answers in order of position"""
+        if self._sorted_answers is None:
+            self._sorted_answers = sorted(self.answers,
+                                          key=lambda x: x.position)
+        return self._sorted_answers
+
 class SurveyQuestionType(Struct):
     """
     A 'type' of question, consisting of a family and subtype.
@@ -354,10 +603,14 @@ class SurveyResponse(Struct):
     
     Contains responses to questions.  Supports accessing by question_id,
     but returns None rather than raising IndexError or KeyError.
+
+    Pass symbols=SymbolTable to share IDs and answers with other
+    responses to the same survey.
     """
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
-        self.questions = [SurveyQuestionResponse(q) for q in self.questions]
+        self.questions = [SurveyQuestionResponse(q, **kwargs)
+                          for q in self.questions]
         self._question_idx = {q.question_id: q for q in self.questions}
 
     def __getitem__(self, question_id):
@@ -369,14 +622,36 @@ class SurveyResponse(Struct):
         return ParsedQuestionResponse(question,
                                       self[question.question_id])
 
+    def parse_all(self, details):
+        """Parse the response to every answerable question in the
+        survey described by details (a SurveyDetails).  Returns a list
+        for each page of ParsedQuestionResponses, in question order.
+        Unanswered questions share one ParsedQuestionResponse, so the
+        results must be treated as read-only."""
+        idx = self._question_idx
+        return [[ParsedQuestionResponse(q, idx[q.question_id])
+                 if q.question_id in idx else q.unanswered()
+                 for q in questions]
+                for questions in details.answerable_questions()]
+
+    @staticmethod
+    def parse_batch(details, responses):
+        """Yield (response, parse_all(details)) for each of responses"""
+        for response in responses:
+            yield (response, response.parse_all(details))
+
 class SurveyQuestionResponse(Struct):
     """A response to an individual question on a survey
 
     Supports accessing the value for a a specific answer_id by
     key, returning None if not found.
     """
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         Struct.__init__(self, *args)
+        symbols = kwargs.get('symbols', None)
+        if symbols is not None:
+            self.question_id = symbols.intern(self.question_id)
+            self.answers = [symbols.answer(a) for a in self.answers]
         self._answer_idx = {a.row: a for a in self.answers if a.row != '0'}
 
     def __getitem__(self, row):
@@ -409,6 +684,7 @@ class ParsedQuestionResponse:
             raise TypeError("SurveyQuestion required")
         self._question = question
         self._response = response
+        self.question_id = question.question_id
         self.heading = question.heading
         self.position = question.position
         self.answer = []
@@ -420,8 +696,7 @@ class ParsedQuestionResponse:
         """Return a list of the subheadings, if any"""
         if self.type == 'open_ended/multi':
             return [subanswer.text for subanswer in
-                    sorted(self._question.answers,
-                           key=lambda x: x.position)]
+                    self._question.sorted_answers()]
         else:
             return None
             
@@ -436,56 +711,57 @@ class ParsedQuestionResponse:
         return len(self.answer) > 0
 
     def _parse_response(self):
-        if self.type.family == 'presentation':
+        family = self.type.family
+        if family == 'presentation':
             # Nothing to do for these
             return
-        if self.type.family == 'open_ended':
+        answers = self._response.answers
+        # answer_id -> SurveyAnswer for the question's choices
+        choices = self._question._answer_idx
+        if family == 'open_ended':
             if self.type.subtype in ('multi','numerical'):
                # open_ended/multi questions have "sub questions"
                # e.g. a), b), c)
-               # This should already be sorted, but we'll do it anyway
-                for subanswer in sorted(self._question.answers,
-                                        key=lambda x: x.position):
-                    # Append a tuple of the subanswer text, and the response for
-                    # that answer_id (which may be None
-                    self.answer.append(
-                        (subanswer.text, self._response[subanswer.answer_id]))
+               # Append a tuple of the subanswer text, and the response for
+               # that answer_id (which may be None)
+                self.answer = [(subanswer.text,
+                                self._response[subanswer.answer_id])
+                               for subanswer in self._question.sorted_answers()]
             elif self.type.subtype in ('essay', 'single'):
-                if len(self._response.answers) > 1:
+                if len(answers) > 1:
                     raise SurveyMonkeyError("Found multiple answers for "
                                             "single response answer.")
-                if self._response.answers[0].row != '0':
+                if answers[0].row != '0':
                     raise SurveyMonkeyError("Found single response with "
                                             "non-zero row.")
-                self.answer.append(self._response.answers[0].text)
+                self.answer.append(answers[0].text)
             else:
                 raise SurveyMonkeyException(
                     "Unknown open_ended subtype {0} question id {1}".format(
                         self.type.subtype, self._question.question_id))
-        elif self.type.family in ('single_choice', 'multiple_choice'):
+        elif family in ('single_choice', 'multiple_choice'):
             other = None
-            for ans in self._response.answers:
+            for ans in answers:
                 # Each response here should have a 'row', and possibly
                 # a 'text' attribute.  We must match the row with
                 # that answer_id in the question to find out what the
                 # text of that choice was.
-                answer = self._question[ans.row]
-                if answer.type == 'other':
+                answer = choices[ans.row]
+                if answer.type == 'row':
+                    self.answer.append(answer.text)
+                elif answer.type == 'other':
                     # Save to append at end
                     other = (answer.text, ans.text)
-                elif answer.type == 'row':
-                    self.answer.append(answer.text)
                 else:
                     raise SurveyMonkeyException(
                         "Unknown answer type {0} for question id {1})".format(
                             self.type, self._question.question_id))
             if other is not None:
                 self.answer.append(other)
-        elif self.type.family in ('matrix'):
-            for ans in self._response.answers:
-                # TODO: weight?
-                self.answer.append((self._question[ans.row].text,
-                                    self._question[ans.col].text))
+        elif family == 'matrix':
+            # TODO: weight?
+            self.answer = [(choices[ans.row].text, choices[ans.col].text)
+                           for ans in answers]
         else:
             raise SurveyMonkeyException(
                 "Can't parse {0} question id {1}".format(
@@ -496,6 +772,76 @@ class ParsedQuestionResponse:
             self.type, self.heading, self.answer)
         return rv.encode("utf-8")
 
+# Bump when the serialized form of a model changes incompatibly
+SERIAL_VERSION = 1
+MODELS = {cls.__name__: cls for cls in
+          (SurveyList, SurveyInfo, SurveyDetails, RespondentList,
+           RespondentInfo, SurveyResponse)}
+
+def serialize(obj):
+    """Return a model object, or a list of objects of one model, as
+    JSON-compatible dicts and lists, for caches or other processes.
+    Derived fields are left out; deserialize() rebuilds them.
+
+    The format is chosen for safety and size rather than speed: unlike
+    pickle it is safe to load from a shared cache, and it is about
+    half the size, but loading it takes roughly 1.5 times as long."""
+    items = obj if isinstance(obj, list) else [obj]
+    names = set(item.__class__.__name__ for item in items)
+    if len(names) > 1 or not names.issubset(MODELS):
+        raise TypeError("Can't serialize {0}".format(', '.join(names)))
+    rv = {'version': SERIAL_VERSION,
+          'model': names.pop() if len(names) else None}
+    if isinstance(obj, list):
+        rv['items'] = [item.to_data() for item in items]
+    else:
+        rv['data'] = obj.to_data()
+    return rv
+
+def _decode_all(value, hook):
+    """Apply a JSON object_hook to already-decoded data"""
+    if isinstance(value, dict):
+        return hook({k: _decode_all(v, hook) for k, v in value.iteritems()})
+    if isinstance(value, list):
+        return [_decode_all(v, hook) for v in value]
+    return value
+
+def _build(data, symbols):
+    if data['version'] != SERIAL_VERSION:
+        raise SurveyMonkeyError(
+            "Can't load serialized models of version {0}".format(
+                data['version']))
+    if 'items' in data:
+        if data['model'] is None:
+            return []
+        cls = MODELS[data['model']]
+        return [cls(item, symbols=symbols) for item in data['items']]
+    return MODELS[data['model']](data['data'], symbols=symbols)
+
+def deserialize(data, symbols=None):
+    """Rebuild what serialize() returned.  Pass the survey's
+    SymbolTable (see SurveyMonkey.get_symbols()) to share IDs and
+    answers with other objects from the same survey.
+
+    Raises SurveyMonkeyError if data is from an incompatible version.
+    """
+    if symbols is None:
+        symbols = SymbolTable()
+    return _build({k: _decode_all(v, symbols.decode)
+                   for k, v in data.iteritems()}, symbols)
+
+def to_json(obj):
+    """serialize(), as compact JSON"""
+    return json.dumps(serialize(obj), separators=(',', ':'))
+
+def from_json(s, symbols=None):
+    """deserialize() JSON from to_json()"""
+    if symbols is None:
+        symbols = SymbolTable()
+    # simplejson's decoder is about twice as fast as json's
+    data = simplejson.loads(s, object_hook=symbols.decode)
+    return _build(data.__dict__, symbols)
+
 class OAuth:
     """Convenience class for SurveyMonkey OAuth operations"""
     AUTH_ENDPOINT = '/oauth/authorize'
@@ -545,9 +891,572 @@ class OAuth:
             raise SurveyMonkeyError(
                 "Failed to write token to file: {0}".format(e))
 
+class SurveyCache:
+    """A persistent cache of survey title -> surveys with that title.
+
+    Survey IDs almost never change, so looking them up by title on
+    every run is wasted effort.  Entries store the survey_id, title
+    and date_modified of each survey, and are kept in a JSON file
+    shared by all processes.  Entries older than refresh_after
+    seconds are still used, but should be refreshed.
+    """
+    def __init__(self, filename, refresh_after=86400):
+        self.filename = filename
+        self.refresh_after = refresh_after
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._mtime = None
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.filename)
+        except OSError:
+            self._entries = {}
+            self._mtime = None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                self._entries = json.loads(f.read())
+            self._mtime = mtime
+        except (IOError, ValueError) as e:
+            logger.warning("Ignoring unreadable survey cache: %s", e)
+            self._entries = {}
+
+    def _save(self):
+        tmp = "{0}.{1}.tmp".format(self.filename, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(self._entries))
+            os.rename(tmp, self.filename)
+        except (IOError, OSError) as e:
+            logger.warning("Failed to write survey cache: %s", e)
+
+    def get(self, title):
+        """Return (list of survey dicts, is_stale), or None if the
+        title is not cached"""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(title, None)
+        if entry is None:
+            return None
+        return (entry['surveys'],
+                time.time() - entry['fetched'] > self.refresh_after)
+
+    def put(self, title, surveys):
+        """Cache the SurveyInfos for a title"""
+        entry = {'fetched': time.time(),
+                 'surveys': [{k: s.__dict__[k] for k in
+                              ('survey_id', 'title', 'date_modified',
+                               'credentials')
+                              if k in s.__dict__} for s in surveys]}
+        with self._lock:
+            self._load()
+            self._entries[title] = entry
+            self._save()
+
+    def invalidate(self, title=None):
+        """Forget one title, or every title if none is given"""
+        with self._lock:
+            self._load()
+            if title is None:
+                self._entries = {}
+            else:
+                self._entries.pop(title, None)
+            self._save()
+
+class QuotaLedger:
+    """A count of today's API calls, shared by every process on the
+    host through a JSON file (locked with fcntl while it is updated).
+
+    Calls are counted by method and by caller (e.g. 'poll',
+    'dashboard', 'pdf').  With a daily_limit, charge() also rations
+    what is left of it by priority:
+
+    - 'high' (interactive pages) is refused only once the limit is used
+    - 'normal' is refused once normal_share of the limit is used
+    - 'low' (background and bulk work) is refused once low_share is
+      used, and before that is slowed down whenever the day's usage is
+      projected to reach normal_share, so its calls are spread over
+      the rest of the day.  A call that would have to wait more than
+      max_wait seconds is refused instead.
+
+    Days are UTC days.  If the ledger can't be written, calls are not
+    counted (or refused) at all.
+    """
+    PRIORITIES = ('high', 'normal', 'low')
+
+    def __init__(self, filename, daily_limit=None, **kwargs):
+        self.filename = filename
+        self.daily_limit = daily_limit
+        self.normal_share = kwargs.get('normal_share', 0.9)
+        self.low_share = kwargs.get('low_share', 0.7)
+        # Don't project usage from less than this much of the day
+        self.min_elapsed = kwargs.get('min_elapsed', 3600)
+        self.max_wait = kwargs.get('max_wait', 60)
+
+    @staticmethod
+    def _today(now):
+        return time.strftime('%Y-%m-%d', time.gmtime(now))
+
+    def _load(self, now):
+        try:
+            with open(self.filename, 'r') as f:
+                data = json.loads(f.read())
+        except IOError:
+            data = None
+        except ValueError as e:
+            logger.warning("Ignoring unreadable quota ledger: %s", e)
+            data = None
+        if data is None or data.get('day') != self._today(now):
+            data = {'day': self._today(now), 'total': 0, 'methods': {},
+                    'callers': {}}
+        return data
+
+    def _locked(self):
+        lock = open(self.filename + '.lock', 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def usage(self):
+        """Return today's counts: a dict of day, total, methods and
+        callers, and the projected total for the day.  Raises
+        SurveyMonkeyError if the ledger can't be locked."""
+        now = time.time()
+        try:
+            lock = self._locked()
+        except (IOError, OSError) as e:
+            raise SurveyMonkeyError(
+                "{0} while locking quota ledger".format(e))
+        try:
+            data = self._load(now)
+        finally:
+            lock.close()
+        data['projected'] = self._projected(data['total'], now)
+        return data
+
+    def _projected(self, total, now):
+        elapsed = max(now % 86400, self.min_elapsed)
+        return int(total * 86400 / elapsed)
+
+    def _admit(self, total, priority, now):
+        """Return the seconds to wait before the call, or raise
+        QuotaExceededError"""
+        if self.daily_limit is None:
+            return 0
+        share = {'high': 1.0, 'normal': self.normal_share,
+                 'low': self.low_share}[priority]
+        if total >= share * self.daily_limit:
+            raise QuotaExceededError(
+                "{0} of {1} daily API calls used; refusing {2} priority "
+                "call".format(total, self.daily_limit, priority))
+        if priority != 'low':
+            return 0
+        budget = self.normal_share * self.daily_limit
+        if self._projected(total, now) < budget:
+            return 0
+        # Spread what is left of the low priority share over the day
+        left = self.low_share * self.daily_limit - total
+        wait = (86400 - now % 86400) / max(1.0, left)
+        if wait > self.max_wait:
+            raise QuotaExceededError(
+                "{0} of {1} daily API calls used; low priority calls "
+                "must wait {2:.0f}s each".format(total, self.daily_limit,
+                                                 wait))
+        return wait
+
+    def charge(self, method, caller, priority='normal'):
+        """Count a call, if its priority allows it.  Returns the number
+        of seconds to wait before making it; raises QuotaExceededError
+        if it should not be made now."""
+        if priority not in self.PRIORITIES:
+            raise ValueError("Unknown priority '{0}'".format(priority))
+        now = time.time()
+        try:
+            return self._charge(method, caller, priority, now)
+        except (IOError, OSError) as e:
+            logger.warning("Not counting API calls: %s", e)
+            return 0
+
+    def _charge(self, method, caller, priority, now):
+        lock = self._locked()
+        try:
+            data = self._load(now)
+            delay = self._admit(data['total'], priority, now)
+            data['total'] += 1
+            data['methods'][method] = data['methods'].get(method, 0) + 1
+            data['callers'][caller] = data['callers'].get(caller, 0) + 1
+            tmp = "{0}.{1}.tmp".format(self.filename, os.getpid())
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(data))
+            os.rename(tmp, self.filename)
+        finally:
+            lock.close()
+        return delay
+
+class _InFlightCall:
+    """A request that is currently being made on behalf of one or
+    more callers.  The first caller makes the request; the others
+    wait() for it and share the result (or the exception)."""
+    def __init__(self):
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class PageSizeTuner:
+    """Chooses the page_size for paginated list calls.
+
+    Each method starts at initial.  After every full page, its page
+    size moves towards the size that would take target_seconds to
+    fetch and stay under max_bytes, by at most a factor of 2 at a
+    time, within [min_size, max_size].  Every page costs a request's
+    worth of rate limit however small it is, so pages are never
+    aimed at less than the client's spacing between requests.  A
+    partial page (the end of a listing) says nothing about bigger
+    pages, and is only counted.
+
+    metrics maps each method to its page_size, and totals of pages,
+    items, seconds and bytes.  With a filename, they are loaded from
+    and saved to a JSON file, so short-lived processes start from
+    what earlier ones learned.
+    """
+    def __init__(self, filename=None, **kwargs):
+        self.filename = filename
+        self.initial = kwargs.get('initial', 500)
+        self.min_size = kwargs.get('min_size', 25)
+        self.max_size = kwargs.get('max_size', 1000)
+        self.target_seconds = kwargs.get('target_seconds', 2.0)
+        self.max_bytes = kwargs.get('max_bytes', 4 * 1024 * 1024)
+        self._lock = threading.Lock()
+        self.metrics = {}
+        if filename is not None and os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.metrics = json.loads(f.read())
+            except (IOError, ValueError) as e:
+                logger.warning("Ignoring unreadable page sizes: %s", e)
+
+    def _entry(self, method):
+        if method not in self.metrics:
+            self.metrics[method] = {'page_size': self.initial, 'pages': 0,
+                                    'items': 0, 'seconds': 0.0, 'bytes': 0}
+        return self.metrics[method]
+
+    def page_size(self, method):
+        """Return the page_size to use for the next listing"""
+        with self._lock:
+            size = self._entry(method)['page_size']
+        return max(self.min_size, min(self.max_size, size))
+
+    def observe(self, method, page_size, items, seconds, size=None,
+                min_seconds=0):
+        """Record a page of items fetched in seconds, which was size
+        bytes, and adjust the page size for method"""
+        with self._lock:
+            entry = self._entry(method)
+            entry['pages'] += 1
+            entry['items'] += items
+            entry['seconds'] += seconds
+            entry['bytes'] += size or 0
+            if items < page_size or seconds <= 0:
+                return
+            target = max(self.target_seconds, min_seconds)
+            desired = target * items / seconds
+            if size:
+                desired = min(desired, float(self.max_bytes) * items / size)
+            current = entry['page_size']
+            new = int(max(current / 2, min(current * 2, desired)))
+            new = max(self.min_size, min(self.max_size, new))
+            if new != current:
+                logger.debug("page_size for %s: %d -> %d", method,
+                             current, new)
+                entry['page_size'] = new
+
+    def save(self):
+        if self.filename is None:
+            return
+        tmp = "{0}.{1}.{2}.tmp".format(self.filename, os.getpid(),
+                                       threading.current_thread().ident)
+        with self._lock:
+            data = json.dumps(self.metrics)
+        try:
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError) as e:
+            logger.warning("Failed to write page sizes: %s", e)
+
+# Requests outstanding at once, and so connections kept alive
+DEFAULT_MAX_IN_FLIGHT = 4
+
+def _session(pool_size):
+    """Return a requests session which keeps up to pool_size
+    connections alive, for that many threads to share.  Headers and
+    params are passed with each request rather than set on the
+    session."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class Credential:
+    """One access token and API key, with its own session and rate
+    limit state.  Requests made with it start min_interval seconds
+    after the previous one started and after the last response
+    arrived, and share pool_size (default DEFAULT_MAX_IN_FLIGHT)
+    connections.  surveys lists the survey IDs owned by its account,
+    if known; others are learned from get_survey_list()."""
+    def __init__(self, token, api_key, **kwargs):
+        if token is None:
+            raise ValueError("token required")
+        if api_key is None:
+            raise ValueError("api_key required")
+        self.name = kwargs.get('name', api_key)
+        self.min_interval = kwargs.get('min_interval', 0.4)
+        self.surveys = kwargs.get('surveys', [])
+        self.session = _session(kwargs.get('pool_size',
+                                           DEFAULT_MAX_IN_FLIGHT))
+        self.headers = {
+            "Authorization": "bearer {0}".format(token),
+            "Content-Type": "application/json"
+            }
+        self.params = {
+            "api_key": api_key
+            }
+        # Managed by CredentialPool
+        self.in_flight = 0
+        self.next_request = 0.0
+        self.backoff_until = 0.0
+        self.failures = 0
+
+    def __repr__(self):
+        return "Credential({0!r})".format(self.name)
+
+class CredentialPool:
+    """Several Credentials, used to spread requests over more than one
+    rate limit.
+
+    acquire() picks the least loaded credential (fewest requests in
+    flight, then the soonest free slot) that is not backing off, and
+    waits for its next slot.  A credential that is throttled backs
+    off for backoff seconds, doubling with each consecutive throttle
+    up to max_backoff (or for as long as the server's Retry-After
+    says).  Surveys pinned to credentials are only ever requested
+    with those credentials.
+
+    With a pins_file, pins are loaded from and saved to a JSON file
+    of survey_id -> credential names, so that short-lived processes
+    which only know a survey_id still use the right credential.
+    """
+    def __init__(self, credentials, backoff=30, max_backoff=600,
+                 pins_file=None):
+        if len(credentials) < 1:
+            raise ValueError("One or more credentials required")
+        self.credentials = list(credentials)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pins_file = pins_file
+        self._cond = threading.Condition()
+        self._pins = {}
+        self._unsaved = False
+        for c in self.credentials:
+            for survey_id in c.surveys:
+                self.pin(survey_id, c)
+        for survey_id, names in self._load_pins().iteritems():
+            for name in names:
+                self.pin(survey_id, name)
+        self._unsaved = False
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def __iter__(self):
+        return iter(self.credentials)
+
+    def pin(self, survey_id, credential):
+        """Only use credential (and others pinned) for survey_id"""
+        if isinstance(credential, basestring):
+            matches = [c for c in self.credentials if c.name == credential]
+            if len(matches) == 0:
+                return
+            credential = matches[0]
+        with self._cond:
+            pinned = self._pins.setdefault(survey_id, [])
+            if credential not in pinned:
+                pinned.append(credential)
+                self._unsaved = True
+
+    def pinned(self, survey_id):
+        """Return the credentials pinned to survey_id, or None"""
+        with self._cond:
+            return self._pins.get(survey_id, None)
+
+    def _load_pins(self):
+        if self.pins_file is None or not os.path.exists(self.pins_file):
+            return {}
+        try:
+            with open(self.pins_file, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError) as e:
+            logger.warning("Ignoring unreadable credential pins: %s", e)
+            return {}
+
+    def save(self):
+        """Save new pins to the pins_file, merged with any saved by
+        other processes since it was loaded"""
+        if self.pins_file is None or not self._unsaved:
+            return
+        pins = self._load_pins()
+        with self._cond:
+            for survey_id, pinned in self._pins.iteritems():
+                names = pins.setdefault(survey_id, [])
+                names += [c.name for c in pinned if c.name not in names]
+            self._unsaved = False
+        tmp = "{0}.{1}.{2}.tmp".format(self.pins_file, os.getpid(),
+                                       threading.current_thread().ident)
+        try:
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(pins))
+            os.rename(tmp, self.pins_file)
+        except (IOError, OSError) as e:
+            logger.warning("Failed to write credential pins: %s", e)
+
+    def acquire(self, survey_id=None, credential=None, exclude=()):
+        """Return the credential to use for a request, after waiting
+        for its next free slot.  It must be passed to release().
+        Credentials in exclude are not used, unless there are no
+        others to choose from."""
+        with self._cond:
+            while True:
+                if credential is not None:
+                    choices = [credential]
+                else:
+                    choices = self._pins.get(survey_id, None) or \
+                        self.credentials
+                    choices = [c for c in choices
+                               if c not in exclude] or choices
+                now = time.time()
+                ready = [c for c in choices if c.backoff_until <= now]
+                if len(ready):
+                    break
+                wait = min(c.backoff_until for c in choices) - now
+                logger.debug("All credentials backing off; waiting %.1fs",
+                             wait)
+                self._cond.wait(wait)
+            rv = min(ready, key=lambda c: (c.in_flight, c.next_request))
+            rv.in_flight += 1
+            delay = rv.next_request - now
+            rv.next_request = max(now, rv.next_request) + rv.min_interval
+        if delay > 0:
+            time.sleep(delay)
+        return rv
+
+    def release(self, credential, response=None):
+        """Finish a request made with credential.  If response shows
+        that the credential was throttled, it backs off; returns True
+        if so."""
+        throttled = response is not None and self.is_throttled(response)
+        with self._cond:
+            credential.in_flight -= 1
+            # As for a single token, space requests after responses too
+            credential.next_request = max(
+                credential.next_request,
+                time.time() + credential.min_interval)
+            if throttled:
+                credential.failures += 1
+                try:
+                    backoff = float(response.headers.get('Retry-After'))
+                except (TypeError, ValueError):
+                    backoff = min(self.backoff *
+                                  2 ** (credential.failures - 1),
+                                  self.max_backoff)
+                credential.backoff_until = time.time() + backoff
+                logger.warning("Credential %s throttled; backing off "
+                               "for %ds", credential.name, backoff)
+            elif response is not None:
+                credential.failures = 0
+            self._cond.notify_all()
+        return throttled
+
+    @staticmethod
+    def is_throttled(response):
+        """Is response a rate limit error?"""
+        if response.status_code in (429, 503):
+            return True
+        # SurveyMonkey's API gateway reports going over the per-second
+        # or per-day rate as a 403 with an error code header
+        error = response.headers.get('X-Mashery-Error-Code', '')
+        return response.status_code == 403 and 'OVER' in error
+
+    @staticmethod
+    def status(response):
+        """Return the API status of a response, or None"""
+        try:
+            return response.json()['status']
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    @classmethod
+    def is_denied(cls, response):
+        """Is response a refusal to let the credential see what was
+        asked for, e.g. a survey owned by another account?"""
+        if response.status_code in (401, 403):
+            return not cls.is_throttled(response)
+        # Not Authenticated, Invalid User Credentials, Invalid Request
+        return cls.status(response) in (1, 2, 3)
+
 class SurveyMonkey:
     """
     The connection to SurveyMonkey
+
+    Identical concurrent calls (same method and same request data)
+    made from several threads on one instance are coalesced: only one
+    request is sent, and every caller gets the same decoded result.
+    Callers must therefore treat returned objects as read-only.
+
+    Pass survey_cache (a filename or SurveyCache) to have
+    find_surveys() resolve titles locally.  Long-running processes
+    can also pass background_refresh=True to refresh stale titles in
+    a background thread.
+
+    An instance is safe to share between threads.  However many
+    threads are making requests, at most max_in_flight (default
+    DEFAULT_MAX_IN_FLIGHT) are outstanding at once, and each starts
+    at least min_interval (default 0.4) seconds after the previous
+    one started and after the last response arrived, so one thread
+    making requests in turn gets the rate it always had.  Up to
+    pool_size (default max_in_flight) keep-alive connections are
+    shared by those requests.  close() the instance, or use it as a
+    context manager, to close the connections.
+
+    Listings choose their own page_size unless the caller passes
+    one; see PageSizeTuner.  Pass page_sizes (a filename or
+    PageSizeTuner) to keep what is learned between processes, or
+    page_sizes=False to use the server's default.
+
+    Pass quota (a filename or QuotaLedger) to count calls against a
+    daily quota, as caller (default 'other') with priority (default
+    'normal'); low priority calls are slowed or refused with
+    QuotaExceededError as the quota runs low.
+
+    Pass credentials (a CredentialPool, or a list of Credentials)
+    instead of token and api_key to spread requests over several
+    credentials; see CredentialPool.  get_survey_list() then asks
+    every credential, and pins each survey to the credentials that
+    can see it.
     """
     _status_codes = ('Success',
                      'Not Authenticated',
@@ -562,32 +1471,151 @@ class SurveyMonkey:
             raise SurveyMonkeyError("'requests' library too old;"
                                     "version 1.1.0 or higher required")
         
-        if token is None:
-            raise ValueError("token required")
-        if api_key is None:
-            raise ValueError("api_key required")
+        self.credentials = kwargs.get('credentials', None)
+        if isinstance(self.credentials, list):
+            self.credentials = CredentialPool(self.credentials)
+        if self.credentials is None:
+            if token is None:
+                raise ValueError("token required")
+            if api_key is None:
+                raise ValueError("api_key required")
         self.base_uri = kwargs.get('base_uri', self._default_base_uri)
-        self.client = requests.session()
-        self.client.headers = {
-            "Authorization": "bearer {0}".format(token),
-            "Content-Type": "application/json"
-            }
-        # The api_key must be passed as a param, because it's part
-        # of the URL being POSTed to.  It cannot be in the POST data.
-        self.client.params = {
-            "api_key": api_key
-            }
-
-    def _make_request(self, method_name, data=None):
+        self.max_in_flight = kwargs.get('max_in_flight',
+                                        DEFAULT_MAX_IN_FLIGHT)
+        self._in_flight = threading.Semaphore(self.max_in_flight)
+        self.client = None
+        if self.credentials is None:
+            self.client = _session(kwargs.get('pool_size',
+                                              self.max_in_flight))
+            self._headers = {
+                "Authorization": "bearer {0}".format(token),
+                "Content-Type": "application/json"
+                }
+            # The api_key must be passed as a param, because it's part
+            # of the URL being POSTed to.  It cannot be in the POST data.
+            self._params = {
+                "api_key": api_key
+                }
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._symbols = {}
+        self.survey_cache = kwargs.get('survey_cache', None)
+        if isinstance(self.survey_cache, basestring):
+            self.survey_cache = SurveyCache(self.survey_cache)
+        self.background_refresh = kwargs.get('background_refresh', False)
+        self._refreshing = set()
+        # Requests with a single token are spaced this far apart
+        self.min_interval = kwargs.get('min_interval', 0.4)
+        self._rate_lock = threading.Lock()
+        self._next_request = 0.0
+        self.page_sizes = kwargs.get('page_sizes', None)
+        if self.page_sizes is None or isinstance(self.page_sizes,
+                                                 basestring):
+            self.page_sizes = PageSizeTuner(self.page_sizes)
+        # The latency and size of this thread's last response, and
+        # any priority override for this thread's requests
+        self._local = threading.local()
+        self.quota = kwargs.get('quota', None)
+        if isinstance(self.quota, basestring):
+            self.quota = QuotaLedger(self.quota,
+                                     kwargs.get('daily_quota', None))
+        self.caller = kwargs.get('caller', 'other')
+        self.priority = kwargs.get('priority', 'normal')
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """Return a SurveyMonkey using the config's credentials list if
+        it has one, or its token_file and app.api_key otherwise.  The
+        config's base_uri, min_interval, max_in_flight, pool_size,
+        page_size_file, quota_file, daily_quota, quota_max_wait and
+        credential_pins_file, if any, are used too."""
+        for k in ('base_uri', 'min_interval', 'max_in_flight', 'pool_size'):
+            if k in config.__dict__:
+                kwargs.setdefault(k, config.__dict__[k])
+        if 'page_size_file' in config.__dict__:
+            kwargs.setdefault('page_sizes', config.page_size_file)
+        if 'quota_file' in config.__dict__:
+            quota_kwargs = {}
+            if 'quota_max_wait' in config.__dict__:
+                quota_kwargs['max_wait'] = config.quota_max_wait
+            kwargs.setdefault('quota', QuotaLedger(
+                    config.quota_file,
+                    config.__dict__.get('daily_quota', None),
+                    **quota_kwargs))
+        credentials = config.get_credentials(pool_size=kwargs.get(
+                'pool_size', kwargs.get('max_in_flight',
+                                        DEFAULT_MAX_IN_FLIGHT)))
+        if credentials is not None:
+            credentials = CredentialPool(
+                credentials,
+                pins_file=config.__dict__.get('credential_pins_file', None))
+            return cls(None, None, credentials=credentials, **kwargs)
+        return cls(config.get_token(), config.app.api_key, **kwargs)
+
+    def close(self):
+        """Close the connections.  The instance can't be used after."""
+        if self.client is not None:
+            self.client.close()
+        if self.credentials is not None:
+            for cred in self.credentials:
+                cred.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _make_request(self, method_name, data=None, object_hook=Struct,
+                      credential=None):
+        key = (method_name, json.dumps(data, sort_keys=True),
+               None if credential is None else credential.name)
+        with self._inflight_lock:
+            call = self._inflight.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlightCall()
+        if not leader:
+            logger.debug("Waiting for in-flight request %s", method_name)
+            return call.wait()
+        try:
+            result = self._send_request(method_name, data, object_hook,
+                                        credential)
+        except Exception as e:
+            call.finish(error=e)
+            raise
+        else:
+            call.finish(result=result)
+            return result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def _send_request(self, method_name, data=None, object_hook=Struct,
+                      credential=None):
         try:
             prefix, method = method_name.split('.', 1)
         except ValueError:
             raise ValueError("Can't parse method: {0}".format(method_name))
         url = "{0}/v2/{1}/{2}".format(self.base_uri, prefix, method)
         logger.debug("Making request to %s, data=%s", url, str(data))
-        response = self.client.post(url, data=json.dumps(data))
-        # TODO: Better avoidance of rate limiting
-        time.sleep(0.4)
+        if self.quota is not None:
+            priority = getattr(self._local, 'priority', self.priority)
+            delay = self.quota.charge(method_name, self.caller, priority)
+            if delay > 0:
+                logger.debug("Slowing %s priority request by %.1fs",
+                             priority, delay)
+                time.sleep(delay)
+        if self.credentials is not None:
+            response = self._pooled_post(url, data, credential)
+        else:
+            with self._in_flight:
+                self._wait_for_slot()
+                try:
+                    response = self._timed_post(self.client, url, data,
+                                                self._headers, self._params)
+                finally:
+                    self._request_done()
         if not response:
             raise SurveyMonkeyError('Bad response: ' + repr(response))
             logger.error("Response code: {0} text: {1}".format(
@@ -598,7 +1626,7 @@ class SurveyMonkey:
             # everywhere, which supports kwargs in the json() method
             # e.g. response_json = response.json(object_hook=Struct)
             response_json = json.loads(json.dumps(response.json()),
-                                       object_hook=Struct)
+                                       object_hook=object_hook)
         except JSONDecodeError as e:
             logger.exception("Unable to decode response as JSON")
             logger.error("Response was: %s", response)
@@ -611,11 +1639,100 @@ class SurveyMonkey:
             raise SurveyMonkeyError(self._status_codes[response_json.status])
         return response_json.data
 
+    def _wait_for_slot(self):
+        """Wait until min_interval seconds after the last request
+        started (or the last response arrived), so that concurrent
+        callers share the rate limit"""
+        with self._rate_lock:
+            now = time.time()
+            delay = self._next_request - now
+            self._next_request = max(now, self._next_request) + \
+                self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def _request_done(self):
+        """Space the next request min_interval after this response"""
+        with self._rate_lock:
+            self._next_request = max(self._next_request,
+                                     time.time() + self.min_interval)
+
+    def _timed_post(self, session, url, data, headers, params):
+        start = time.time()
+        response = session.post(url, data=json.dumps(data),
+                                headers=headers, params=params)
+        self._local.last_response = (time.time() - start,
+                                     len(response.content or ''))
+        return response
+
+    def _get_page(self, method_name, postdata, key, tuned, **kwargs):
+        """_make_request() for a page of a listing, whose items are in
+        key.  If tuned, tell the page size tuner how it went."""
+        self._local.last_response = None
+        page = self._make_request(method_name, postdata, **kwargs)
+        last = self._local.last_response
+        if tuned and last is not None:
+            self.page_sizes.observe(method_name, postdata['page_size'],
+                                    len(page.__dict__[key]), last[0],
+                                    last[1], self.min_interval)
+        return page
+
+    def _tune_page_size(self, method_name, postdata):
+        """Choose a page_size for a listing, unless the caller did (or
+        asked for a specific page).  Returns True if it was chosen."""
+        if self.page_sizes is False or 'page_size' in postdata or \
+                'page' in postdata:
+            return False
+        postdata['page_size'] = self.page_sizes.page_size(method_name)
+        return True
+
+    def _pooled_post(self, url, data, credential=None):
+        """POST with a credential from the pool, retrying with another
+        credential (or after the backoff) when throttled.  A survey
+        that isn't pinned is tried with each credential in turn until
+        one is allowed to see it, and pinned to that one."""
+        survey_id = data.get('survey_id', None) if data else None
+        probing = credential is None and survey_id is not None and \
+            self.credentials.pinned(survey_id) is None
+        denied = []
+        throttles = 0
+        while True:
+            cred = self.credentials.acquire(survey_id, credential,
+                                            exclude=denied)
+            response = None
+            try:
+                response = self._timed_post(cred.session, url, data,
+                                            cred.headers, cred.params)
+            finally:
+                throttled = self.credentials.release(cred, response)
+            if throttled:
+                throttles += 1
+                if throttles < 2 * len(self.credentials):
+                    continue
+            elif probing and self.credentials.is_denied(response):
+                if cred not in denied:
+                    denied.append(cred)
+                if len(denied) < len(self.credentials):
+                    logger.debug("Credential %s can't see survey %s; "
+                                 "trying another", cred.name, survey_id)
+                    continue
+            elif probing and self.credentials.status(response) == 0:
+                self.credentials.pin(survey_id, cred)
+                self.credentials.save()
+            return response
+
+    def get_symbols(self, survey_id):
+        """Return the SymbolTable used for objects from survey_id"""
+        with self._inflight_lock:
+            return self._symbols.setdefault(survey_id, SymbolTable())
+
     def get_survey_details(self, survey_id):
         """Get survey details for a survey_id"""
+        symbols = self.get_symbols(survey_id)
         details = self._make_request('surveys.get_survey_details',
-                                     {'survey_id': survey_id})
-        return SurveyDetails(details)
+                                     {'survey_id': survey_id},
+                                     object_hook=symbols.decode)
+        return SurveyDetails(details, symbols=symbols)
 
     def get_survey_responses(self, survey_id, *respondents, **kwargs):
         """Get responses to a survey, given one or more respondents
@@ -628,11 +1745,21 @@ class SurveyMonkey:
         respondent_ids = respondents if kwargs.get('by_id', False) else [r.respondent_id for r in respondents]
         postdata = {'survey_id': survey_id,
                     'respondent_ids': respondent_ids}
-        return [SurveyResponse(r) for r in
-                self._make_request('surveys.get_responses', postdata)]
+        symbols = self.get_symbols(survey_id)
+        return [SurveyResponse(r, symbols=symbols) for r in
+                self._make_request('surveys.get_responses', postdata,
+                                   object_hook=symbols.decode)]
 
     def get_survey_list(self, fields=SurveyInfo._fields, **kwargs):
-        """Get a list of all surveys"""
+        """Get a list of all surveys
+
+        With a CredentialPool, every credential is asked (unless one is
+        passed as credential), and each SurveyInfo has a 'credentials'
+        list of the names of the credentials that can see it.
+        """
+        credential = kwargs.pop('credential', None)
+        if self.credentials is not None and credential is None:
+            return self._get_pooled_survey_list(fields, **kwargs)
         postdata={'fields': fields}
         for arg, val in [(k, kwargs.get(k, None)) for k in
                          'page_size', 'page',
@@ -641,20 +1768,111 @@ class SurveyMonkey:
             if val is not None:
                 postdata[arg] = val
         max_pages=kwargs.get('max_pages', 0 if 'page' in postdata else 10)
-        s_list = SurveyList(self._make_request('surveys.get_survey_list',
-                                               postdata))
+        tuned = self._tune_page_size('surveys.get_survey_list', postdata)
+        s_list = SurveyList(self._get_page('surveys.get_survey_list',
+                                           postdata, 'surveys', tuned,
+                                           credential=credential))
         for _ in xrange(max_pages - 1):
             postdata['page'] = s_list.pages[-1] + 1
-            next_page = self._make_request('surveys.get_survey_list',
-                                           postdata)
+            next_page = self._get_page('surveys.get_survey_list',
+                                       postdata, 'surveys', tuned,
+                                       credential=credential)
             if len(next_page.surveys) == 0:
                 break
             s_list.add_page(next_page)
+        if tuned:
+            self.page_sizes.save()
         return s_list
 
+    def _get_pooled_survey_list(self, fields, **kwargs):
+        merged = SurveyList(Struct({'page': 1, 'surveys': []}))
+        merged.pages = []
+        by_id = {}
+        for cred in self.credentials:
+            s_list = self.get_survey_list(fields, credential=cred, **kwargs)
+            merged.pages += s_list.pages
+            for survey in s_list:
+                self.credentials.pin(survey.survey_id, cred)
+                if survey.survey_id not in by_id:
+                    survey.credentials = []
+                    by_id[survey.survey_id] = survey
+                    merged.surveys.append(survey)
+                by_id[survey.survey_id].credentials.append(cred.name)
+        self.credentials.save()
+        return merged
+
+    def find_surveys(self, title):
+        """Return a SurveyList of the surveys with a title.
+
+        With a survey_cache, this is a local lookup: a missing title is
+        fetched and cached.  A stale one is refreshed first, or with
+        background_refresh, returned immediately and refreshed in a
+        background thread (which a short-lived process may not live
+        to finish).  If a refresh fails, the stale surveys are used.
+        Titles with no surveys are not cached.  Each SurveyInfo only
+        has survey_id, title and date_modified.
+        """
+        if self.survey_cache is None:
+            return self.get_survey_list(title=title)
+        cached = self.survey_cache.get(title)
+        if cached is None:
+            return self._refresh_survey_cache(title)
+        surveys, stale = cached
+        if stale and not self.background_refresh:
+            s_list = self._refresh_survey_cache(title, stale=True)
+            if s_list is not None:
+                return s_list
+            stale = False
+        if self.credentials is not None:
+            for survey in surveys:
+                for name in survey.get('credentials', []):
+                    self.credentials.pin(survey['survey_id'], name)
+        if stale:
+            with self._inflight_lock:
+                start = title not in self._refreshing
+                self._refreshing.add(title)
+            if start:
+                refresh = threading.Thread(
+                    target=self._refresh_survey_cache,
+                    args=(title,), kwargs={'background': True})
+                refresh.daemon = True
+                refresh.start()
+        return SurveyList(Struct({'page': 1, 'surveys': surveys}))
+
+    def _refresh_survey_cache(self, title, background=False, stale=False):
+        """Fetch and cache the surveys for a title.  When refreshing a
+        stale entry (in the background or not), errors are logged and
+        None is returned, so the stale entry is used."""
+        if background:
+            self._local.priority = 'low'
+        try:
+            s_list = self.get_survey_list(
+                title=title, fields=['title', 'date_modified'])
+            # Don't remember a (possibly transient) miss
+            if len(s_list) > 0:
+                self.survey_cache.put(title, s_list)
+            return s_list
+        except SurveyMonkeyError:
+            if not (background or stale):
+                raise
+            logger.exception("Failed to refresh cached surveys for '%s'",
+                             title)
+        finally:
+            with self._inflight_lock:
+                self._refreshing.discard(title)
+
+    def invalidate_survey_cache(self, title=None):
+        """Forget the cached surveys for a title (or all titles)"""
+        if self.survey_cache is not None:
+            self.survey_cache.invalidate(title)
+
     def get_survey_respondents(self, survey_id,
                                fields=RespondentInfo._fields, **kwargs):
-        """Get a list of respondents to a survey_id"""
+        """Get a list of respondents to a survey_id
+
+        Pass partitions=N to fetch a date range as N concurrent windows;
+        see _get_partitioned_respondents().
+        """
         postdata={'survey_id': survey_id,
                   'fields': fields}
         for arg, val in [(k, kwargs.get(k, None)) for k in
@@ -664,17 +1882,137 @@ class SurveyMonkey:
                          'order_by', 'order_asc']:
             if val is not None:
                 postdata[arg] = val
+        if kwargs.get('partitions', None) is not None:
+            return self._get_partitioned_respondents(postdata, **kwargs)
         max_pages=kwargs.get('max_pages', 0 if 'page' in postdata else 10)
-        r_list = RespondentList(
-            self._make_request('surveys.get_respondent_list', postdata))
-        for _ in xrange(max_pages - 1):
+        return self._get_respondent_pages(postdata, max_pages)[0]
+
+    @staticmethod
+    def _is_last_page(page, postdata):
+        """Is page of respondents the end of the listing?  A page
+        shorter than the page size is, if the page size is known."""
+        page_size = page.__dict__.get('page_size',
+                                      postdata.get('page_size', None))
+        return len(page.respondents) == 0 or \
+            (page_size is not None and len(page.respondents) < page_size)
+
+    def _get_respondent_pages(self, postdata, max_pages):
+        """Return (RespondentList of up to max_pages pages, whether
+        there may be more)"""
+        symbols = self.get_symbols(postdata['survey_id'])
+        tuned = self._tune_page_size('surveys.get_respondent_list',
+                                     postdata)
+        page = self._get_page('surveys.get_respondent_list', postdata,
+                              'respondents', tuned,
+                              object_hook=symbols.decode)
+        r_list = RespondentList(page, symbols=symbols)
+        more = not self._is_last_page(page, postdata)
+        while more and len(r_list.pages) < max_pages:
             postdata['page'] = r_list.pages[-1] + 1
-            next_page = self._make_request('surveys.get_respondent_list',
-                                           postdata)
-            if len(next_page.respondents) == 0:
+            page = self._get_page('surveys.get_respondent_list',
+                                  postdata, 'respondents', tuned,
+                                  object_hook=symbols.decode)
+            if len(page.respondents) == 0:
+                more = False
                 break
-            r_list.add_page(next_page)
-        return r_list
+            r_list.add_page(page)
+            more = not self._is_last_page(page, postdata)
+        if more and max_pages > 1:
+            logger.debug("Stopped after max_pages (%d) pages of "
+                         "respondents", max_pages)
+        if tuned:
+            self.page_sizes.save()
+        return r_list, more
+
+    def _get_partitioned_respondents(self, postdata, **kwargs):
+        """Fetch respondents by splitting the date range into windows.
+
+        Called by get_survey_respondents() when 'partitions' is passed.
+        The start_date/end_date range (or start_modified_date/
+        end_modified_date, if those were given) is split into that many
+        windows, which are fetched concurrently, 'concurrency' (default
+        4) at a time, in order of that date.  If a window has more than
+        'max_pages' (default 10, and at least 2) pages, the rest of it
+        (from the last date fetched) is fetched as another window, so
+        the result is complete.  Results are merged, de-duplicated by
+        respondent_id, and sorted by the date being partitioned on, if
+        it was requested in 'fields'.
+        """
+        if 'page' in postdata:
+            raise ValueError("Cannot combine 'page' and 'partitions'")
+        if 'start_modified_date' in postdata or \
+                'end_modified_date' in postdata:
+            start_key, end_key = 'start_modified_date', 'end_modified_date'
+            date_field = 'date_modified'
+        else:
+            start_key, end_key = 'start_date', 'end_date'
+            date_field = 'date_start'
+        if start_key not in postdata:
+            raise ValueError("'partitions' requires {0}".format(start_key))
+        start = DateTime.to_epoch(postdata[start_key])
+        end = DateTime.to_epoch(postdata[end_key]) if end_key in postdata \
+            else int(time.time()) + 1
+        partitions = max(1, int(kwargs['partitions']))
+        page_budget = kwargs.get('max_pages', 10)
+        if page_budget < 2:
+            raise ValueError("'partitions' requires max_pages of 2 or more")
+        step = max(1, (end - start + partitions - 1) // partitions)
+        windows = [(t, min(t + step, end)) for t in xrange(start, end, step)]
+        # Where a window stopped is known from its last date fetched
+        fields = list(postdata['fields'])
+        if date_field not in fields:
+            fields.append(date_field)
+
+        def fetch(window):
+            data = dict(postdata, fields=fields, order_by=date_field,
+                        order_asc=True)
+            data[start_key] = DateTime.from_epoch(window[0])
+            data[end_key] = DateTime.from_epoch(window[1])
+            r_list, more = self._get_respondent_pages(data, page_budget)
+            return window, r_list, more
+
+        merged = RespondentList(Struct({'page': 1, 'respondents': []}),
+                                symbols=self.get_symbols(
+                                    postdata['survey_id']))
+        merged.pages = []
+        if len(windows) == 0:
+            # An empty or inverted range, e.g. a start in the future
+            return merged
+        seen = set()
+        pool = ThreadPool(min(kwargs.get('concurrency', 4), len(windows)))
+        try:
+            while len(windows):
+                rest = []
+                for window, r_list, more in pool.imap_unordered(fetch,
+                                                                windows):
+                    merged.pages += r_list.pages
+                    for r in r_list:
+                        if r.respondent_id not in seen:
+                            seen.add(r.respondent_id)
+                            merged.respondents.append(r)
+                    if not more:
+                        continue
+                    # Respondents at the last date may continue on the
+                    # next page, so start from it; they are de-duplicated
+                    last = DateTime.to_epoch(
+                        r_list[len(r_list) - 1].__dict__[date_field])
+                    if last <= window[0]:
+                        logger.warning("More than %d pages of respondents "
+                                       "at %s; results may be incomplete",
+                                       page_budget,
+                                       DateTime.from_epoch(window[0]))
+                        continue
+                    rest.append((last, window[1]))
+                windows = rest
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+        if date_field in postdata['fields']:
+            merged.respondents.sort(key=lambda r: r.__dict__.get(date_field))
+        return merged
 
     def get_user_details(self):
         """
@@ -1,5 +1,6 @@
 """Generate PDF for the Technical Diagnostic"""
 
+import itertools
 import logging
 import sys
 
@@ -10,6 +11,10 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
 from reportlab.platypus.flowables import NullDraw
 from reportlab.pdfbase.pdfmetrics import stringWidth
 
+# Questions in the 'Basic Information' page that are rendered inline
+INLINE_BASIC_INFORMATION = ['Name:', 'MIT email address:',
+                            'Phone Number (cell phone preferred):']
+
 class StyleSheet(dict):
     def __init__(self):
         super(StyleSheet, self).__init__()
@@ -73,6 +78,100 @@ class StyleSheet(dict):
                                                       spaceBefore=0)
 
 
+class PDFTemplate:
+    """The parts of a PDF that are the same for every document.
+
+    Building the StyleSheet, laying out the scoring table, measuring
+    headings and parsing the text of headings is done once per
+    template, rather than once per PDF.  Use PDFTemplate.default() to
+    share one template per process.
+    """
+    _default = None
+    # Limit on the number of parsed paragraphs to remember
+    max_cached_paragraphs = 5000
+
+    # The header scoring table
+    table_data = [['Reader #', 'Initials', 'General', 'Mac', 'Win',
+                   'Net', 'Athena', 'TOTAL'],
+                  ['1'],
+                  ['2']]
+
+    def __init__(self, pagesize=pagesizes.letter):
+        self.stylesheet = StyleSheet()
+        self.pagesize = pagesize
+        (self.page_w, self.page_h) = pagesize
+        self.leftMargin = 0.5 * units.inch
+        self.rightMargin = self.leftMargin
+        self.topMargin = 0.5 * units.inch
+        self.bottomMargin = 0.75 * units.inch
+        self._fits = {}
+        self._parsed = {}
+        self.scoring_table = self.layout_table(
+            self.table_data,
+            row_height = 0.25 * units.inch,
+            col_width = 0.5 * units.inch)
+
+    @classmethod
+    def default(cls):
+        """Return the shared template for this process"""
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def layout_table(self, data, **kwargs):
+        """Return (v_lines, h_lines, cells) for a table, where cells is
+        a list of (x, y, text) for drawCentredString()"""
+        row_height = kwargs.get('row_height', None)
+        col_width = kwargs.get('col_width', None)
+        x_offset = kwargs.get('x_offset', 0.5 * units.inch)
+        y_offset = kwargs.get('y_offset', 0.5 * units.inch)
+        align = kwargs.get('align', 'left')
+        n_rows = len(data)
+        n_cols = max([len(x) for x in data])
+        rng = range(0, n_cols +1)
+        if align == 'right':
+            rng = range(-1 * n_cols, 1)
+            x_offset = self.page_w - x_offset
+        v_lines = [x_offset + (col_width * x) for x in rng]
+        h_lines = [(self.page_h - y_offset -
+                    (row_height * x)) for x in range(0, n_rows + 1)]
+        cells = []
+        for y, row in enumerate(data, start=1):
+            for x,txt in zip(v_lines, row):
+                cells.append((x + (col_width * 0.5), h_lines[y] + 7.0, txt))
+        return (v_lines, h_lines, cells)
+
+    def draw_table(self, canvas, table):
+        (v_lines, h_lines, cells) = table
+        canvas.grid(v_lines, h_lines)
+        canvas.setFont('Helvetica', 8)
+        for (x, y, txt) in cells:
+            canvas.drawCentredString(x, y, txt)
+
+    def will_fit_inline(self, txt, style):
+        """Whether txt, as the bullet of style, fits on the left half
+        of the page.  Results are remembered."""
+        key = (txt, style)
+        if key not in self._fits:
+            sheet = self.stylesheet[style]
+            self._fits[key] = stringWidth(
+                txt, sheet.bulletFontName,
+                sheet.bulletFontSize) <= (self.leftMargin +
+                                          (self.page_w * 0.5))
+        return self._fits[key]
+
+    def paragraph(self, text, style, **kwargs):
+        """Return a Paragraph of (escaped) text in a named style.
+        Parsing the text is only done the first time it is seen."""
+        key = (text, style)
+        parsed = self._parsed.get(key, None)
+        if parsed is None:
+            rv = Paragraph(text, self.stylesheet[style], **kwargs)
+            if len(self._parsed) < self.max_cached_paragraphs:
+                self._parsed[key] = (rv.style, rv.frags)
+            return rv
+        return Paragraph(text, parsed[0], frags=parsed[1], **kwargs)
+
 class Section:
     def __init__(self, title, **kwargs):
         self.title = title
@@ -96,51 +195,70 @@ class SectionStart(NullDraw):
     def draw(self):
         self._callback(self._section)
 
+class CandidateStart(NullDraw):
+    def __init__(self, candidate, callback):
+        NullDraw.__init__(self)
+        self._candidate = candidate
+        self._callback = callback
+
+    def draw(self):
+        self._callback(self._candidate)
+
+class Candidate:
+    """One respondent's response, and the lines for its page header"""
+    def __init__(self, response, header_lines):
+        self.response = response
+        self.header_lines = header_lines
+        # Set to the first page number when the Packet is built
+        self.page = None
+
+def respondent_header(details, response, status, date):
+    """Return (name, email, header_lines) for a SurveyResponse"""
+    (name, email) = [str(response.get_response_for_question(q)) for q
+                     in details.get_questions_by_heading('Name:',
+                                                         'MIT email address:')]
+    return (name, email, [name, email, "{0} {1}".format(status, date)])
+
+class _ChunkedStory(list):
+    """A story which calls refill(story) whenever it runs out, so
+    only part of it exists at once.  BaseDocTemplate.build() consumes
+    the story from the front until len() is 0."""
+    def __init__(self, refill):
+        list.__init__(self)
+        self._refill = refill
+
+    def __len__(self):
+        if list.__len__(self) == 0:
+            self._refill(self)
+        return list.__len__(self)
+
 class PDF(SimpleDocTemplate):
-    def __init__(self, filename):
+    def __init__(self, filename, template=None):
+        if template is None:
+            template = PDFTemplate.default()
         # Sigh.  SimpleDocTemplate is an old-style class
         SimpleDocTemplate.__init__(self, filename,
-                                   pagesize=pagesizes.letter)
-        self.stylesheet = StyleSheet()
+                                   pagesize=template.pagesize)
+        self.template = template
+        self.stylesheet = template.stylesheet
         self.header_lines = []
         self._this_section = Section('Untitled')
         # Start with a Spacer for the header on the first page
         self.story = [Spacer(1, 1.5 * units.inch)]
-        self.leftMargin = 0.5 * units.inch
-        self.rightMargin = self.leftMargin
-        self.topMargin = 0.5 * units.inch
-        self.bottomMargin = 0.75 * units.inch
+        self.leftMargin = template.leftMargin
+        self.rightMargin = template.rightMargin
+        self.topMargin = template.topMargin
+        self.bottomMargin = template.bottomMargin
         # Record the width and height now, because in the build stage
         # width and height are set to the area inside the margins
-        (self.page_w, self.page_h) = pagesizes.letter
+        (self.page_w, self.page_h) = template.pagesize
 
     def _scoring_table(self, canvas, data, **kwargs):
-        row_height = kwargs.get('row_height', None)
-        col_width = kwargs.get('col_width', None)
-        x_offset = kwargs.get('x_offset', 0.5 * units.inch)
-        y_offset = kwargs.get('y_offset', 0.5 * units.inch)
-        align = kwargs.get('align', 'left')
-        n_rows = len(data)
-        n_cols = max([len(x) for x in data])
-        rng = range(0, n_cols +1)
-        if align == 'right':
-            rng = range(-1 * n_cols, 1)
-            x_offset = self.page_w - x_offset
-        v_lines = [x_offset + (col_width * x) for x in rng]
-        h_lines = [(self.page_h - y_offset -
-                    (row_height * x)) for x in range(0, n_rows + 1)]
-        canvas.grid(v_lines, h_lines)
-        canvas.setFont('Helvetica', 8)
-        for y, row in enumerate(data, start=1):
-            for x,txt in zip(v_lines, row):
-                canvas.drawCentredString(x + (col_width * 0.5),
-                                         h_lines[y] + 7.0, txt)
+        self.template.draw_table(canvas,
+                                 self.template.layout_table(data, **kwargs))
 
     def _will_fit_inline(self, txt, style):
-        sheet = self.stylesheet[style]
-        return stringWidth(
-            txt, sheet.bulletFontName,
-            sheet.bulletFontSize) <= (self.leftMargin + (self.page_w * 0.5))
+        return self.template.will_fit_inline(txt, style)
 
     def _header(self, canvas, _):
         # self.width and self.height are the dimensions of the area
@@ -153,14 +271,8 @@ class PDF(SimpleDocTemplate):
                                                                   0.25 *
                                                                   units.inch),
                                    txt)
-        table_data = [['Reader #', 'Initials', 'General', 'Mac', 'Win',
-                       'Net', 'Athena', 'TOTAL'],
-                      ['1'],
-                      ['2']]
         canvas.setLineWidth(0.1)
-        self._scoring_table(canvas, table_data,
-                            row_height = 0.25 * units.inch,
-                            col_width = 0.5 * units.inch)
+        self.template.draw_table(canvas, self.template.scoring_table)
         canvas.restoreState()
 
     def _footer(self, canvas, _):
@@ -222,7 +334,7 @@ class PDF(SimpleDocTemplate):
                                        self._set_current_section))
 
     def add_page_title(self, text):
-        self.add_paragraph(text, style='Title')
+        self.add_paragraph(text, style='Title', cache=True)
 
     def can_inline_question(self, question):
         if ((question.type == 'open_ended/single') and
@@ -238,20 +350,24 @@ class PDF(SimpleDocTemplate):
         if self._this_section.skip_question_numbers:
             question_heading = response.heading
         if not response:
-            self.add_paragraph(question_heading, style='Question')
+            self.add_paragraph(question_heading, style='Question',
+                               cache=True)
             if response.subheadings() is not None:
                 [self.add_paragraph('(no response)',
                                     style='InlineSubquestion',
-                                    bulletText=subhead) for subhead
+                                    bulletText=subhead,
+                                    cache=True) for subhead
                  in response.subheadings()]
             else:
-                self.add_paragraph('(no response)', style='Answer')
+                self.add_paragraph('(no response)', style='Answer',
+                                   cache=True)
             return
         if self.can_inline_question(response):
             self.add_paragraph(response.answer[0], style='InlineQuestion',
                                bulletText=question_heading)
         else:
-            self.add_paragraph(question_heading, style='Question')
+            self.add_paragraph(question_heading, style='Question',
+                               cache=True)
             bullet = u"\u2022" if response.type.family == 'multiple_choice' \
                 else u''
             for a in response.answer:
@@ -267,9 +383,13 @@ class PDF(SimpleDocTemplate):
     def add_paragraph(self, text, **kwargs):
         # Paragraph class takes XML for formatting, so
         # we must escape our unformatted text
-        if not kwargs.pop('xml', False):
+        xml = kwargs.pop('xml', False)
+        if not xml:
             text = saxutils.escape(text)
         style = kwargs.pop('style', 'Normal')
+        # Text that repeats in every document (e.g. headings) can
+        # be parsed once by the template.
+        cache = kwargs.pop('cache', False) and not xml
         # Deal with questions which have newlines in them.
         # SurveyMonkey renders these with linebreaks, so
         # we expect to see them.
@@ -279,12 +399,97 @@ class PDF(SimpleDocTemplate):
                               ['Start' if len(paragraphs) > 1 else ''] +
                               ['Mid'] * (len(paragraphs) - 2) + ['End']
                               ]):
-            self.story.append(Paragraph(txt, self.stylesheet[style], **kwargs))
+            if cache:
+                self.story.append(self.template.paragraph(txt, style,
+                                                          **kwargs))
+            else:
+                self.story.append(Paragraph(txt, self.stylesheet[style],
+                                            **kwargs))
 
     def add_page_break(self):
         self.story.append(PageBreak())
 
+    def add_survey_response(self, details, response):
+        """Add every page of a SurveyResponse to the survey described
+        by details (a SurveyDetails), one section per page."""
+        for page, parsed in zip(details.pages, response.parse_all(details)):
+            if len(page) == 0:
+                continue
+            section = Section(page.heading)
+            if page.heading == 'Basic Information':
+                section.skip_footer = True
+                section.skip_question_numbers = True
+                section.inline_single_answers = INLINE_BASIC_INFORMATION
+            self.add_section(section)
+            self.add_page_title(page.heading)
+            for question_response in parsed:
+                self.add_question_response(question_response)
+            self.add_page_break()
+
     def save(self):
         self.build(self.story,
                    onFirstPage=self._header,
                    onLaterPages=self._footer)
+
+class Packet(PDF):
+    """The technical diagnostics of many respondents in one PDF.
+
+    candidates is an iterable of Candidates, which is only consumed
+    while the PDF is saved, chunk_size candidates at a time; a
+    generator which fetches responses as it goes keeps memory flat
+    however many candidates there are.  Each candidate starts on a
+    new page with its own header and scoring table, and an index of
+    candidates and their first pages follows the last one.
+    """
+    def __init__(self, filename, details, candidates, template=None,
+                 chunk_size=10):
+        PDF.__init__(self, filename, template)
+        self.details = details
+        self.chunk_size = chunk_size
+        self.index = []
+        self.pageCompression = 1
+        self._candidates = iter(candidates)
+        self._header_pending = False
+        self._finished = False
+        self.story = _ChunkedStory(self._add_chunk)
+
+    def _start_candidate(self, candidate):
+        self.header_lines = candidate.header_lines
+        candidate.page = self.page
+        self._header_pending = True
+
+    def _add_chunk(self, story):
+        if self._finished:
+            return
+        for candidate in itertools.islice(self._candidates, self.chunk_size):
+            story.append(CandidateStart(candidate, self._start_candidate))
+            story.append(Spacer(1, 1.5 * units.inch))
+            self.add_survey_response(self.details, candidate.response)
+            # Only the header and page are needed for the index
+            candidate.response = None
+            self.index.append(candidate)
+        if list.__len__(story) == 0:
+            self._finished = True
+            self._add_index()
+
+    def _add_index(self):
+        section = Section('Index')
+        section.skip_footer = True
+        self.add_section(section)
+        self.add_page_title('Index')
+        for candidate in self.index:
+            self.add_paragraph(u'{0} \u2014 page {1}'.format(
+                    u', '.join(candidate.header_lines), candidate.page))
+
+    def handle_pageEnd(self):
+        # Like the section footer, the header is drawn at the end of
+        # the page, once the candidate on it is known.
+        if self._header_pending:
+            self._header_pending = False
+            self._header(self.canv, self)
+        PDF.handle_pageEnd(self)
+
+    def save(self):
+        self.build(self.story,
+                   onFirstPage=self._footer,
+                   onLaterPages=self._footer)
@@ -0,0 +1,57 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import artifacts
+import surveymonkey
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        data = {'since': '2013-01-01 00:00:00', 'respondents': {
+                '1': {'date_start': '2013-01-01 00:00:00',
+                      'date_modified': '2013-01-02 00:00:00',
+                      'local_date': 'Jan 1', 'status': 'completed',
+                      'name': 'Pat', 'email': 'pat@mit.edu'}}}
+        # One survey in the cache, and one respondents.json outside it
+        for survey_dir in ('cache/100', 'outside'):
+            os.makedirs(os.path.join(self.directory, survey_dir, 'pdf'))
+            with open(os.path.join(self.directory, survey_dir,
+                                   'respondents.json'), 'w') as f:
+                f.write(json.dumps(data))
+            with open(os.path.join(self.directory, survey_dir, 'pdf',
+                                   '1.pdf'), 'w') as f:
+                f.write('%PDF')
+        self.cache = artifacts.ArtifactCache(os.path.join(self.directory,
+                                                          'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_valid_ids(self):
+        self.assertEqual(self.cache.pdf('100', '1', 'Jan 1')[1]['name'],
+                         'Pat')
+        self.assertEqual(len(self.cache.respondent_list(
+                    '100', '2013-01-01 00:00:00')), 1)
+
+    def test_survey_id_outside_cache(self):
+        self.assertEqual(self.cache.respondents('../outside'), None)
+        self.assertEqual(self.cache.respondent_list(
+                '../outside', '2013-01-01 00:00:00'), None)
+        self.assertEqual(self.cache.pdf('../outside', '1', 'Jan 1'), None)
+        self.cache.invalidate('../outside')
+        self.assertTrue(os.path.exists(os.path.join(
+                    self.directory, 'outside', 'respondents.json')))
+
+    def test_respondent_id_outside_cache(self):
+        self.assertEqual(self.cache.pdf('100', '../../outside/pdf/1',
+                                        'Jan 1'), None)
+        r_info = surveymonkey.RespondentInfo(
+            {'respondent_id': '1/../1', 'date_modified':
+                 '2013-01-02 00:00:00'})
+        self.assertEqual(self.cache.rows('100', [r_info]), {})
+
+if __name__ == "__main__":
+    unittest.main()
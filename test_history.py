@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import history
+import surveymonkey
+
+DETAILS = {'survey_id': '100', 'title': {'text': 'Title'}, 'pages': [
+        {'heading': 'Page', 'questions': [
+                {'question_id': 'q1', 'heading': 'Pick one', 'position': 1,
+                 'type': {'family': 'single_choice', 'subtype': 'vertical'},
+                 'answers': [{'answer_id': 'a{0}'.format(i), 'position': i,
+                              'type': 'row', 'visible': True,
+                              'text': 'Choice {0}'.format(i)}
+                             for i in (1, 2)]},
+                {'question_id': 'q2', 'heading': 'Name', 'position': 2,
+                 'type': {'family': 'open_ended', 'subtype': 'single'},
+                 'answers': []}]}]}
+
+def decode(data):
+    return json.loads(json.dumps(data), object_hook=surveymonkey.Struct)
+
+def response(*questions):
+    """A SurveyResponse from respondent 1, answering questions, a list
+    of (question_id, answers)"""
+    return surveymonkey.SurveyResponse(decode(
+            {'respondent_id': '1',
+             'questions': [{'question_id': q_id, 'answers': answers}
+                           for q_id, answers in questions]}))
+
+def info(date_modified, status='completed'):
+    return surveymonkey.RespondentInfo({'respondent_id': '1',
+                                        'date_modified': date_modified,
+                                        'status': status})
+
+PICK_1 = ('q1', [{'row': 'a1'}])
+PICK_2 = ('q1', [{'row': 'a2'}])
+NAME = ('q2', [{'row': '0', 'text': 'Pat'}])
+
+class ResponseHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = history.ResponseHistory(self.directory)
+        self.details = surveymonkey.SurveyDetails(decode(DETAILS))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, r, date_modified, status='completed'):
+        return self.history.record('100', r, info(date_modified, status))
+
+    def test_first_version(self):
+        diff = self.record(response(PICK_1, NAME), '2013-01-01 00:00:00')
+        self.assertEqual(diff.old_date, None)
+        self.assertEqual(diff.changed, ['q1', 'q2'])
+        self.assertEqual(self.history.versions('100', '1'),
+                         ['2013-01-01 00:00:00'])
+
+    def test_same_date_twice(self):
+        self.record(response(PICK_1), '2013-01-01 00:00:00', 'partial')
+        first = self.record(response(PICK_2, NAME), '2013-01-02 00:00:00')
+        again = self.record(response(PICK_2, NAME), '2013-01-02 00:00:00')
+        self.assertEqual(again.old_date, '2013-01-01 00:00:00')
+        self.assertEqual(again.changed, first.changed)
+        self.assertEqual(len(self.history.versions('100', '1')), 2)
+
+    def test_older_date(self):
+        self.record(response(PICK_2), '2013-01-02 00:00:00')
+        diff = self.record(response(PICK_1), '2013-01-01 00:00:00')
+        self.assertFalse(diff)
+        self.assertEqual(self.history.versions('100', '1'),
+                         ['2013-01-02 00:00:00'])
+        self.assertEqual(
+            self.history.response('100', '1')['q1'].answers[0].row, 'a2')
+
+    def test_question_unset(self):
+        self.record(response(PICK_1, NAME), '2013-01-01 00:00:00')
+        diff = self.record(response(PICK_1), '2013-01-02 00:00:00')
+        self.assertEqual(diff.changed, ['q2'])
+        self.assertEqual(diff.describe(self.details), [u"Name Pat -> (n/a)"])
+        self.assertEqual(self.history.response('100', '1')['q2'], None)
+        old = self.history.response('100', '1', '2013-01-01 00:00:00')
+        self.assertEqual(old['q2'].answers[0].text, 'Pat')
+
+    def test_order_change(self):
+        self.record(response(PICK_1, NAME), '2013-01-01 00:00:00')
+        diff = self.record(response(NAME, PICK_1), '2013-01-02 00:00:00')
+        self.assertFalse(diff)
+        self.assertEqual(diff.describe(self.details), [])
+        self.assertEqual([q.question_id for q in
+                          self.history.response('100', '1').questions],
+                         ['q2', 'q1'])
+        self.assertEqual([q.question_id for q in self.history.response(
+                        '100', '1', '2013-01-01 00:00:00').questions],
+                         ['q1', 'q2'])
+
+    def test_describe(self):
+        self.record(response(PICK_1), '2013-01-01 00:00:00', 'partial')
+        diff = self.record(response(PICK_2), '2013-01-02 00:00:00')
+        self.assertEqual(diff.describe(self.details),
+                         [u"Status: partial -> completed",
+                          u"Pick one Choice 1 -> Choice 2"])
+        self.assertEqual([bool(d) for d in self.history.changes('100', '1')],
+                         [True, True])
+
+    def test_corrupt_history_moved_aside(self):
+        self.record(response(PICK_1), '2013-01-01 00:00:00')
+        filename = os.path.join(self.directory, '100', '1.json')
+        with open(filename, 'w') as f:
+            f.write('{"version": 1, "vers')
+        self.record(response(PICK_2), '2013-01-02 00:00:00')
+        with open(filename + '.corrupt') as f:
+            self.assertEqual(f.read(), '{"version": 1, "vers')
+        self.assertEqual(self.history.versions('100', '1'),
+                         ['2013-01-02 00:00:00'])
+
+    def test_unsupported_version(self):
+        filename = os.path.join(self.directory, '100', '1.json')
+        os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(json.dumps({'version': history.VERSION + 1,
+                                'versions': []}))
+        self.assertRaises(ValueError, self.record, response(PICK_1),
+                          '2013-01-01 00:00:00')
+
+if __name__ == "__main__":
+    unittest.main()
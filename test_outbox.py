@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import outbox
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sent = os.path.join(self.directory, 'sent')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def outbox(self, sendmail_cmd, **kwargs):
+        return outbox.Outbox(os.path.join(self.directory, 'outbox'),
+                             sendmail_cmd=sendmail_cmd, **kwargs)
+
+    def catting(self, **kwargs):
+        """An Outbox whose messages are appended to self.sent"""
+        return self.outbox(['/bin/sh', '-c', 'cat >> ' + self.sent],
+                           **kwargs)
+
+    def sent_mail(self):
+        with open(self.sent) as f:
+            return f.read()
+
+    def test_batching(self):
+        box = self.catting()
+        box.put('a@mit.edu', 'Subject', 'one')
+        box.put('b@mit.edu', 'Subject', 'two')
+        box.put('a@mit.edu', 'Subject', 'three')
+        self.assertEqual(box.deliver(), 3)
+        self.assertEqual(box.pending(), [])
+        mail = self.sent_mail()
+        self.assertEqual(mail.count('Subject: Subject\n'), 2)
+        self.assertTrue('To: a@mit.edu\n' in mail)
+        self.assertTrue('\n\none\n\nthree\n' in mail)
+        self.assertTrue('\n\ntwo\n' in mail)
+
+    def test_backoff(self):
+        box = self.outbox(['false'], retry_after=10, max_retry_after=15)
+        box.put('a@mit.edu', 'Subject', 'one')
+        start = time.time()
+        self.assertEqual(box.deliver(), 0)
+        [(name, message)] = box.pending()
+        self.assertEqual(message['attempts'], 1)
+        self.assertTrue(message['error'].startswith('Exit status 1'))
+        self.assertTrue(start + 10 <= message['next_attempt'] <=
+                        time.time() + 10)
+        # Not due yet
+        self.assertEqual(box.deliver(), 0)
+        self.assertEqual(box.pending()[0][1]['attempts'], 1)
+        message['next_attempt'] = 0
+        box._write(name, message)
+        box.deliver()
+        message = box.pending()[0][1]
+        self.assertEqual(message['attempts'], 2)
+        # 20s, but capped at max_retry_after
+        self.assertTrue(message['next_attempt'] <= time.time() + 15)
+
+    def test_failed_after_max_attempts(self):
+        box = self.outbox(['false'], retry_after=0, max_attempts=2)
+        box.put('a@mit.edu', 'Subject', 'one')
+        box.deliver()
+        self.assertEqual(len(box.pending()), 1)
+        box.deliver()
+        self.assertEqual(box.pending(), [])
+        failed = os.listdir(os.path.join(self.directory, 'outbox',
+                                         'failed'))
+        self.assertEqual(len(failed), 1)
+
+    def test_timeout(self):
+        box = self.outbox(['sleep', '10'], timeout=0.2)
+        box.put('a@mit.edu', 'Subject', 'one')
+        start = time.time()
+        self.assertEqual(box.deliver(), 0)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(box.pending()[0][1]['error'],
+                         'Timed out after 0.2s')
+
+    def test_malformed_message_skipped(self):
+        box = self.catting()
+        with open(os.path.join(self.directory, 'outbox', 'new',
+                               '0-bad.json'), 'w') as f:
+            f.write(json.dumps({'to': 'a@mit.edu', 'body': 'old'}))
+        box.put('a@mit.edu', 'Subject', 'one')
+        self.assertEqual(box.deliver(), 1)
+        self.assertFalse('old' in self.sent_mail())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+import surveyindex
+
+class TextIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = surveyindex.TextIndex()
+        # Two subanswers, as TextIndex.add() joins them
+        self.index.add_document(('s', 'q', '1'),
+                                u'I mostly use linux\n\nwindows at work')
+        self.index.add_document(('s', 'q', '2'),
+                                u'I run linux windows and mac-os')
+
+    def keys(self, query):
+        return sorted(key for _, key in self.index.search(query))
+
+    def test_phrase_within_passage(self):
+        self.assertEqual(self.keys('"mostly use linux"'), [('s', 'q', '1')])
+        self.assertEqual(self.keys('"windows at work"'), [('s', 'q', '1')])
+
+    def test_phrase_across_passages(self):
+        self.assertEqual(self.keys('"linux windows"'), [('s', 'q', '2')])
+
+    def test_prefix(self):
+        self.assertEqual(self.keys('win*'), [('s', 'q', '1'),
+                                             ('s', 'q', '2')])
+
+    def test_multi_word_prefix(self):
+        self.assertEqual(self.keys('mac-o*'), [('s', 'q', '2')])
+        # A phrase and a prefix, not just the prefix "w*"
+        self.assertEqual(self.keys('linux-w*'), [('s', 'q', '2')])
+        self.assertEqual(self.keys('use-w*'), [])
+
+if __name__ == "__main__":
+    unittest.main()
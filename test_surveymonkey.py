@@ -0,0 +1,313 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import surveymonkey
+
+class NoRequests:
+    """A session which fails the test if it is used"""
+    def post(self, *args, **kwargs):
+        raise AssertionError("Unexpected request")
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, data):
+        self._data = data
+        self.content = self.text = 'x'
+
+    def json(self):
+        return self._data
+
+class SurveyListSession:
+    """Answers get_survey_list with surveys"""
+    def __init__(self, surveys):
+        self.surveys = surveys
+
+    def post(self, url, **kwargs):
+        page = json.loads(kwargs['data']).get('page', 1)
+        return FakeResponse({'status': 0, 'data': {
+                    'page': page, 'page_size': 1000,
+                    'surveys': self.surveys if page == 1 else []}})
+
+class OwnerSession:
+    """Answers get_responses only for the surveys in owned"""
+    def __init__(self, owned):
+        self.owned = owned
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        if json.loads(kwargs['data'])['survey_id'] in self.owned:
+            return FakeResponse({'status': 0, 'data': []})
+        return FakeResponse({'status': 3, 'data': None})
+
+    def close(self):
+        pass
+
+class RespondentListSession:
+    """Answers get_respondent_list from respondents, one a minute
+    from 2013-01-01 (or all at once, with interval=0)"""
+    def __init__(self, n, interval=60):
+        start = surveymonkey.DateTime.to_epoch('2013-01-01 00:00:00')
+        self.respondents = [
+            {'respondent_id': str(i),
+             'date_start': surveymonkey.DateTime.from_epoch(
+                    start + i * interval),
+             'date_modified': surveymonkey.DateTime.from_epoch(
+                    start + i * interval)} for i in xrange(n)]
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        data = json.loads(kwargs['data'])
+        key = 'date_start'
+        if 'start_modified_date' in data:
+            key = 'date_modified'
+        start = data.get('start_date', data.get('start_modified_date'))
+        end = data.get('end_date', data.get('end_modified_date'))
+        matches = [r for r in self.respondents
+                   if start <= r[key] < end]
+        matches.sort(key=lambda r: r[data.get('order_by', 'respondent_id')])
+        page, page_size = data.get('page', 1), data['page_size']
+        return FakeResponse({'status': 0, 'data': {
+                    'page': page, 'page_size': page_size,
+                    'respondents': [
+                        {k: r[k] for k in ['respondent_id'] + data['fields']
+                         if k in r} for r in matches[(page - 1) * page_size:
+                                             page * page_size]]}})
+
+DETAILS = {'survey_id': '100', 'title': {'text': 'Title'}, 'pages': [
+        {'heading': 'Page', 'questions': [
+                {'question_id': 'q1', 'heading': 'Pick one', 'position': 1,
+                 'type': {'family': 'single_choice', 'subtype': 'vertical'},
+                 'answers': [{'answer_id': 'a{0}'.format(i), 'position': i,
+                              'type': 'row', 'visible': True,
+                              'text': 'Choice {0}'.format(i)}
+                             for i in (1, 2)]},
+                {'question_id': 'q2', 'heading': 'Name', 'position': 2,
+                 'type': {'family': 'open_ended', 'subtype': 'single'},
+                 'answers': []}]}]}
+
+def make_response(n):
+    return {'respondent_id': str(n), 'questions': [
+            {'question_id': 'q1',
+             'answers': [{'row': 'a{0}'.format(n % 2 + 1)}]},
+            {'question_id': 'q2',
+             'answers': [{'row': '0', 'text': 'Person {0}'.format(n)}]}]}
+
+class PartitionedRespondentsTest(unittest.TestCase):
+    def setUp(self):
+        self.monkey = surveymonkey.SurveyMonkey('token', 'key',
+                                                page_sizes=False)
+        self.monkey.client = NoRequests()
+
+    def test_empty_range(self):
+        r_list = self.monkey.get_survey_respondents(
+            '100', start_date='2013-01-02 00:00:00',
+            end_date='2013-01-02 00:00:00', partitions=4)
+        self.assertEqual(len(r_list), 0)
+
+    def get(self, session, **kwargs):
+        self.monkey.client = session
+        self.monkey.min_interval = 0
+        return self.monkey.get_survey_respondents(
+            '100', start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00', page_size=50, **kwargs)
+
+    def test_window_over_max_pages(self):
+        session = RespondentListSession(250)
+        r_list = self.get(session, max_pages=2, partitions=1,
+                          fields=['date_start'])
+        self.assertEqual([r.respondent_id for r in r_list],
+                         [str(i) for i in xrange(250)])
+        # Each window after the first repeats the respondent it
+        # starts from
+        self.assertEqual(session.calls, 6)
+
+    def test_window_of_exactly_max_pages(self):
+        session = RespondentListSession(100)
+        r_list = self.get(session, max_pages=2, partitions=1)
+        self.assertEqual(len(r_list), 100)
+        self.assertEqual(session.calls, 3)
+
+    def test_too_many_at_once(self):
+        session = RespondentListSession(250, interval=0)
+        r_list = self.get(session, max_pages=2, partitions=1)
+        self.assertEqual(len(r_list), 100)
+        self.assertEqual(session.calls, 2)
+
+    def test_max_pages_too_small(self):
+        self.assertRaises(ValueError, self.get, NoRequests(), max_pages=1,
+                          partitions=4)
+
+    def test_inverted_range(self):
+        r_list = self.monkey.get_survey_respondents(
+            '100', start_modified_date='2013-01-02 00:00:00',
+            end_modified_date='2013-01-01 00:00:00', partitions=4)
+        self.assertEqual(len(r_list), 0)
+
+class SurveyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = surveymonkey.SurveyCache(
+            os.path.join(self.directory, 'surveys.json'))
+        self.monkey = surveymonkey.SurveyMonkey(
+            'token', 'key', page_sizes=False, min_interval=0,
+            survey_cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_misses_not_cached(self):
+        self.monkey.client = SurveyListSession([])
+        self.assertEqual(len(self.monkey.find_surveys('Title')), 0)
+        self.assertEqual(self.cache.get('Title'), None)
+
+    def test_stale_refreshed_in_foreground(self):
+        self.cache.put('Title', [surveymonkey.SurveyInfo(
+                    {'survey_id': '1', 'title': 'Title'})])
+        self.cache.refresh_after = -1
+        self.monkey.client = SurveyListSession(
+            [{'survey_id': '2', 'title': 'Title'}])
+        surveys = self.monkey.find_surveys('Title')
+        self.assertEqual([s.survey_id for s in surveys], ['2'])
+        self.assertEqual(self.cache.get('Title')[0][0]['survey_id'], '2')
+
+    def test_stale_used_if_refresh_fails(self):
+        self.cache.put('Title', [surveymonkey.SurveyInfo(
+                    {'survey_id': '1', 'title': 'Title'})])
+        self.cache.refresh_after = -1
+        self.monkey.client = SurveyListSession(None)
+        self.monkey.client.post = lambda url, **kwargs: FakeResponse(
+            {'status': 5, 'data': None})
+        surveys = self.monkey.find_surveys('Title')
+        self.assertEqual([s.survey_id for s in surveys], ['1'])
+
+class SerializeTest(unittest.TestCase):
+    def setUp(self):
+        self.details = surveymonkey.SurveyDetails(
+            json.loads(json.dumps(DETAILS), object_hook=surveymonkey.Struct))
+        self.responses = [surveymonkey.SurveyResponse(
+                json.loads(json.dumps(make_response(n)),
+                           object_hook=surveymonkey.Struct))
+                          for n in xrange(3)]
+
+    def parsed(self, details, responses):
+        return [[[p.answer for p in page] for page in pages]
+                for _, pages in surveymonkey.SurveyResponse.parse_batch(
+                details, responses)]
+
+    def test_round_trip(self):
+        symbols = surveymonkey.SymbolTable()
+        details = surveymonkey.deserialize(
+            surveymonkey.serialize(self.details), symbols=symbols)
+        responses = surveymonkey.from_json(
+            surveymonkey.to_json(self.responses), symbols=symbols)
+        self.assertTrue(isinstance(details, surveymonkey.SurveyDetails))
+        self.assertEqual([r.__class__ for r in responses],
+                         [surveymonkey.SurveyResponse] * 3)
+        # Derived indexes are rebuilt
+        self.assertEqual(details.pages[0]['q1']['a2'].text, 'Choice 2')
+        self.assertEqual(responses[1]['q2'].answers[0].text, 'Person 1')
+        self.assertEqual(self.parsed(details, responses),
+                         self.parsed(self.details, self.responses))
+        self.assertEqual([r.to_data() for r in responses],
+                         [r.to_data() for r in self.responses])
+
+    def test_symbols_shared(self):
+        symbols = surveymonkey.SymbolTable()
+        details = surveymonkey.deserialize(
+            surveymonkey.serialize(self.details), symbols=symbols)
+        responses = surveymonkey.from_json(
+            surveymonkey.to_json(self.responses), symbols=symbols)
+        self.assertTrue(len(symbols) > 0)
+        self.assertTrue(details._symbols is symbols)
+        self.assertTrue(responses[0]['q1'].question_id is
+                        details.pages[0].questions[0].question_id)
+        self.assertTrue(responses[0]['q1'].answers[0] is
+                        responses[2]['q1'].answers[0])
+
+    def test_version_mismatch(self):
+        data = surveymonkey.serialize(self.responses)
+        data['version'] += 1
+        self.assertRaises(surveymonkey.SurveyMonkeyError,
+                          surveymonkey.deserialize, data)
+        self.assertRaises(surveymonkey.SurveyMonkeyError,
+                          surveymonkey.from_json, json.dumps(data))
+
+class QuotaLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ledger = surveymonkey.QuotaLedger(
+            os.path.join(self.directory, 'quota.json'), 1000,
+            normal_share=0.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_low_priority_slowed(self):
+        # Ten minutes before the end of the day, with 100 calls left
+        self.assertEqual(self.ledger._admit(600, 'low', 86400 - 600), 6)
+
+    def test_long_wait_refused(self):
+        # At noon, with 10 calls left
+        self.assertRaises(surveymonkey.QuotaExceededError,
+                          self.ledger._admit, 690, 'low', 43200)
+        self.assertEqual(self.ledger._admit(690, 'high', 43200), 0)
+
+    def test_unwritable_ledger(self):
+        ledger = surveymonkey.QuotaLedger(
+            os.path.join(self.directory, 'missing', 'quota.json'), 1000)
+        self.assertEqual(ledger.charge('surveys.get_survey_list', 'test'), 0)
+        self.assertRaises(surveymonkey.SurveyMonkeyError, ledger.usage)
+
+class CredentialPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pins_file = os.path.join(self.directory, 'pins.json')
+        self.credentials = [surveymonkey.Credential(
+                'token', 'key', name=name, min_interval=0)
+                            for name in ('a', 'b')]
+        self.credentials[0].session = OwnerSession(['100'])
+        self.credentials[1].session = OwnerSession(['200'])
+        self.pool = surveymonkey.CredentialPool(self.credentials,
+                                                pins_file=self.pins_file)
+        self.monkey = surveymonkey.SurveyMonkey(
+            None, None, credentials=self.pool, page_sizes=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unpinned_survey_finds_its_credential(self):
+        self.monkey.get_survey_responses('200', '1', by_id=True)
+        self.assertEqual(self.pool.pinned('200'), [self.credentials[1]])
+        # Now only the owner is asked
+        calls = self.credentials[0].session.calls
+        self.monkey.get_survey_responses('200', '2', by_id=True)
+        self.assertEqual(self.credentials[0].session.calls, calls)
+
+    def test_pins_saved(self):
+        self.monkey.get_survey_responses('200', '1', by_id=True)
+        pool = surveymonkey.CredentialPool(self.credentials,
+                                           pins_file=self.pins_file)
+        self.assertEqual(pool.pinned('200'), [self.credentials[1]])
+
+    def test_denied_by_all(self):
+        self.assertRaises(surveymonkey.SurveyMonkeyError,
+                          self.monkey.get_survey_responses, '300', '1',
+                          by_id=True)
+        self.assertEqual(self.pool.pinned('300'), None)
+
+    def test_explicit_no_credential(self):
+        for c in self.credentials:
+            c.session = SurveyListSession([{'survey_id': '1',
+                                            'title': 'Title'}])
+        s_list = self.monkey.get_survey_list(credential=None)
+        self.assertEqual(s_list[0].credentials, ['a', 'b'])
+
+if __name__ == "__main__":
+    unittest.main()